@@ -1,6 +1,7 @@
 # Tabs/create_update_db.py
 
 import sqlite3
+from migrations import migrate
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QPushButton, QMessageBox
 
 class CreateUpdateDBTab(QWidget):
@@ -17,111 +18,15 @@ class CreateUpdateDBTab(QWidget):
 
     def create_update_db(self):
         conn = sqlite3.connect('student_register.db')
-        cursor = conn.cursor()
 
-        # Create AcademicYear table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS AcademicYear (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                semester TEXT,
-                year INTEGER
-            )
-        ''')
+        # Create or upgrade all tables through the shared versioned migrations
+        try:
+            version = migrate(conn)
+        except sqlite3.Error as e:
+            conn.close()
+            QMessageBox.critical(self, "Error", f"Database update failed: {e}")
+            return
 
-        # Create LabSlots table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS LabSlots (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                academic_year_id INTEGER,
-                FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
-            )
-        ''')
-
-        # Create Students table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Students (
-                student_id TEXT PRIMARY KEY,
-                name TEXT,
-                email TEXT,
-                registration_number TEXT,
-                username TEXT
-            )
-        ''')
-
-        # Create Enrollments table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Enrollments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id TEXT,
-                lab_slot_id INTEGER,
-                academic_year_id INTEGER,
-                FOREIGN KEY(student_id) REFERENCES Students(student_id),
-                FOREIGN KEY(lab_slot_id) REFERENCES LabSlots(id),
-                FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
-            )
-        ''')
-
-        # Create StudentTeams table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS StudentTeams (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                team_number INTEGER,
-                student_id TEXT,
-                lab_slot_id INTEGER,
-                FOREIGN KEY(student_id) REFERENCES Students(student_id),
-                FOREIGN KEY(lab_slot_id) REFERENCES LabSlots(id)
-            )
-        ''')
-
-        # Create Attendance table with lab_slot_id column
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Attendance (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id TEXT,
-                lab_slot_id INTEGER,
-                exercise_slot TEXT,
-                status TEXT,
-                timestamp TEXT,
-                academic_year_id INTEGER,
-                FOREIGN KEY(student_id) REFERENCES Students(student_id),
-                FOREIGN KEY(lab_slot_id) REFERENCES LabSlots(id),
-                FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
-            )
-        ''')
-
-        # Create Grades table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Grades (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id TEXT,
-                lab_slot_id INTEGER,
-                exercise_slot TEXT,
-                grade REAL,
-                timestamp TEXT,
-                academic_year_id INTEGER,
-                FOREIGN KEY(student_id) REFERENCES Students(student_id),
-                FOREIGN KEY(lab_slot_id) REFERENCES LabSlots(id),
-                FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
-            )
-        ''')
-
-        # Create FinalGrades table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS FinalGrades (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id TEXT,
-                lab_average REAL,
-                jun_exam_grade REAL,
-                sep_exam_grade REAL,
-                final_grade REAL,
-                academic_year_id INTEGER,
-                FOREIGN KEY(student_id) REFERENCES Students(student_id),
-                FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
-            )
-        ''')
-
-        conn.commit()
         conn.close()
 
-        QMessageBox.information(self, "Success", "Database created or updated successfully.")
+        QMessageBox.information(self, "Success", f"Database created or updated successfully (schema version {version}).")
@@ -4,56 +4,62 @@ from PyQt5.QtWidgets import (
 )
 from PyQt5.QtCore import QDateTime, Qt, QThread, pyqtSignal
 import sqlite3
-import time
-from sqlite3 import OperationalError
+from queries import QUERIES
+from write_queue import WriteQueue
 
-class GradeProcessingThread(QThread):
-    processing_complete = pyqtSignal()
+_write_queue = None
+
+def get_write_queue():
+    # All grade saves of the desktop app go through one writer connection
+    global _write_queue
+    if _write_queue is None:
+        _write_queue = WriteQueue('student_register.db')
+    return _write_queue
+
+class GradeSaveCancelled(Exception):
+    pass
 
-    def __init__(self, table, students, exercise_slot, lab_slot_id, academic_year_id, parent=None):
+class GradeProcessingThread(QThread):
+    """Upsert a snapshot of the grade sheet off the GUI thread.
+
+    `rows` are plain (student_id, lab_slot_id, exercise_slot, grade, timestamp,
+    academic_year_id) tuples taken from the table on the GUI thread, so the
+    worker never touches a widget. They are written in chunks inside one
+    transaction: a cancelled or failed save leaves the sheet as it was. Final
+    grades need no recalculation, the FinalGrades view reads the new grades.
+    """
+    progress = pyqtSignal(int, int)
+    processing_complete = pyqtSignal(int)
+    processing_cancelled = pyqtSignal()
+    processing_failed = pyqtSignal(str)
+
+    CHUNK_SIZE = 200
+
+    def __init__(self, rows, parent=None):
         super().__init__(parent)
-        self.table = table
-        self.students = students
-        self.exercise_slot = exercise_slot
-        self.lab_slot_id = lab_slot_id
-        self.academic_year_id = academic_year_id
-        self.parent = parent
+        self.rows = rows
 
     def run(self):
-        max_retries = 5
-        for attempt in range(max_retries):
-            try:
-                with sqlite3.connect('student_register.db', timeout=20) as conn:
-                    cursor = conn.cursor()
-
-                    for idx, student in enumerate(self.students):
-                        student_id = student[0]
-                        attendance_status = self.table.item(idx, 4).text()
-                        grade_item = self.table.item(idx, 5)
-                        timestamp_item = self.table.item(idx, 6)
-                        confirm_checkbox = self.table.cellWidget(idx, 7)
-
-                        if attendance_status == "Present" and confirm_checkbox.isChecked():
-                            grade = float(grade_item.text())
-                            timestamp = timestamp_item.text()
-
-                            cursor.execute('''
-                                INSERT OR REPLACE INTO Grades (student_id, lab_slot_id, exercise_slot, grade, timestamp, academic_year_id) 
-                                VALUES (?, ?, ?, ?, ?, ?)
-                            ''', (student_id, self.lab_slot_id, self.exercise_slot, grade, timestamp, self.academic_year_id))
-
-                            # Calculate and update final grades
-                            self.parent.calculate_and_update_final_grades(student_id, self.academic_year_id, cursor)
-
-                    conn.commit()
-                break  # Break out of the loop if the operation is successful
-            except OperationalError:
-                if attempt < max_retries - 1:
-                    time.sleep(1)  # Wait for 1 second before retrying
-                else:
-                    raise
+        total = len(self.rows)
+        try:
+            # The writer connection takes the lock up front (BEGIN IMMEDIATE) and
+            # waits on busy_timeout, so there is no need to retry on "database is locked"
+            with get_write_queue().transaction() as conn:
+                for start in range(0, total, self.CHUNK_SIZE):
+                    if self.isInterruptionRequested():
+                        raise GradeSaveCancelled()
+                    conn.executemany(QUERIES['upsert_grade'], self.rows[start:start + self.CHUNK_SIZE])
+                    self.progress.emit(min(start + self.CHUNK_SIZE, total), total)
+                if self.isInterruptionRequested():
+                    raise GradeSaveCancelled()
+        except GradeSaveCancelled:
+            self.processing_cancelled.emit()
+            return
+        except Exception as e:
+            self.processing_failed.emit(str(e))
+            return
 
-        self.processing_complete.emit()
+        self.processing_complete.emit(total)
 
 class InsertGradesTab(QWidget):
     def __init__(self, parent=None):
@@ -220,21 +226,64 @@ class InsertGradesTab(QWidget):
         timestamp = QDateTime.currentDateTime().toString("yyyy-MM-dd HH:mm:ss")
         table.setItem(row, 6, QTableWidgetItem(timestamp))
 
+    def snapshot_grades(self, table, students, exercise_slot, lab_slot_id, academic_year_id):
+        # Read the confirmed grades out of the table; widgets are only touched on the GUI thread
+        rows = []
+        invalid = []
+        for idx, student in enumerate(students):
+            student_id = student[0]
+            attendance_status = table.item(idx, 4).text()
+            confirm_checkbox = table.cellWidget(idx, 7)
+            if attendance_status != "Present" or not confirm_checkbox.isChecked():
+                continue
+
+            timestamp_item = table.item(idx, 6)
+            try:
+                grade = float(table.item(idx, 5).text())
+            except ValueError:
+                invalid.append(str(student_id))
+                continue
+            timestamp = timestamp_item.text() if timestamp_item else QDateTime.currentDateTime().toString("yyyy-MM-dd HH:mm:ss")
+            rows.append((student_id, lab_slot_id, exercise_slot, grade, timestamp, academic_year_id))
+        return rows, invalid
+
     def save_grades(self, table, students, exercise_slot, lab_slot_id, academic_year_id):
-        self.progress_dialog = QProgressDialog("Processing grades...", "Cancel", 0, 100, self)
+        rows, invalid = self.snapshot_grades(table, students, exercise_slot, lab_slot_id, academic_year_id)
+        if invalid:
+            QMessageBox.warning(self, "Invalid Grades",
+                                "Not saved, the grade is not a number for: " + ", ".join(invalid))
+        if not rows:
+            return
+
+        self.progress_dialog = QProgressDialog("Processing grades...", "Cancel", 0, len(rows), self)
         self.progress_dialog.setWindowTitle("Please Wait")
         self.progress_dialog.setWindowModality(Qt.WindowModal)
         self.progress_dialog.setMinimumDuration(0)
         self.progress_dialog.setValue(0)
 
         # Start the background processing thread
-        self.thread = GradeProcessingThread(table, students, exercise_slot, lab_slot_id, academic_year_id, self)
+        self.thread = GradeProcessingThread(rows, self)
+        self.thread.progress.connect(self.on_processing_progress)
         self.thread.processing_complete.connect(self.on_processing_complete)
+        self.thread.processing_cancelled.connect(self.on_processing_cancelled)
+        self.thread.processing_failed.connect(self.on_processing_failed)
+        self.progress_dialog.canceled.connect(self.thread.requestInterruption)
         self.thread.start()
 
-    def on_processing_complete(self):
-        self.progress_dialog.setValue(100)
-        QMessageBox.information(self, "Success", "Grades saved successfully")
+    def on_processing_progress(self, done, total):
+        self.progress_dialog.setValue(done)
+
+    def on_processing_complete(self, count):
+        self.progress_dialog.setValue(self.progress_dialog.maximum())
+        QMessageBox.information(self, "Success", f"Grades saved successfully ({count} grades)")
+
+    def on_processing_cancelled(self):
+        self.progress_dialog.reset()
+        QMessageBox.information(self, "Cancelled", "Saving was cancelled, no grades were changed")
+
+    def on_processing_failed(self, error):
+        self.progress_dialog.reset()
+        QMessageBox.critical(self, "Error", f"Error saving grades: {error}")
 
     def toggle_grade_editing(self, table, students, lab_slot_id, exercise_slot, academic_year_id):
         for idx, student in enumerate(students):
@@ -442,53 +491,4 @@ class InsertGradesTab(QWidget):
             return [slot for slot, cb in self.slot_vars.items() if cb.isChecked()]
         return []
 
-    def calculate_and_update_final_grades(self, student_id, academic_year_id, cursor):
-        # Calculate lab average for the latest lab grades
-        cursor.execute('''
-        SELECT grade FROM Grades
-        WHERE student_id = ? AND exercise_slot IN ("Lab1", "Lab2", "Lab3", "Lab4", "Lab5", "Replacement1", "Replacement2")
-        AND academic_year_id = ?
-        ''', (student_id, academic_year_id))
-        lab_grades = cursor.fetchall()
-
-        lab_average = sum(grade[0] for grade in lab_grades) / len(lab_grades) if lab_grades else None
-
-        # Retrieve exam grades
-        cursor.execute('''
-        SELECT grade FROM Grades WHERE student_id = ? AND exercise_slot = "Exam.Sep" AND academic_year_id = ?
-        ''', (student_id, academic_year_id))
-        sep_exam = cursor.fetchone()
-
-        cursor.execute('''
-        SELECT grade FROM Grades WHERE student_id = ? AND exercise_slot = "Exam.Jun" AND academic_year_id = ?
-        ''', (student_id, academic_year_id))
-        jun_exam = cursor.fetchone()
-
-        sep_exam_grade = sep_exam[0] if sep_exam else None
-        jun_exam_grade = jun_exam[0] if jun_exam else None
-
-        # Apply the correct rule for the final exam grade
-        if sep_exam_grade is not None:
-            final_exam_grade = sep_exam_grade
-        elif jun_exam_grade is not None:
-            final_exam_grade = jun_exam_grade
-        else:
-            final_exam_grade = None
-
-        # Determine the final grade
-        if final_exam_grade is None or lab_average is None:
-            final_grade = None
-        else:
-            final_grade = 0.25 * lab_average + 0.75 * final_exam_grade
-
-        # Delete any existing entry for this student, academic year
-        cursor.execute('''
-        DELETE FROM FinalGrades WHERE student_id = ? AND academic_year_id = ?
-        ''', (student_id, academic_year_id))
-
-        # Insert the new entry in the FinalGrades table for this student
-        cursor.execute('''
-        INSERT INTO FinalGrades (student_id, lab_average, jun_exam_grade, sep_exam_grade, final_grade, academic_year_id)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', (student_id, lab_average, jun_exam_grade, sep_exam_grade, final_grade, academic_year_id))
 
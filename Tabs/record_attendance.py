@@ -234,33 +234,33 @@ class RecordAttendanceTab(QWidget):
 
         timestamp = QDateTime.currentDateTime().toString("yyyy-MM-dd HH:mm:ss")
 
-        for idx, student in enumerate(students):
-            present_checked = button_group[idx].buttons()[0].isChecked()
-            absent_checked = button_group[idx].buttons()[1].isChecked()
+        try:
+            for idx, student in enumerate(students):
+                present_checked = button_group[idx].buttons()[0].isChecked()
+                absent_checked = button_group[idx].buttons()[1].isChecked()
 
-            if not (present_checked or absent_checked):
-                QMessageBox.warning(self, "Incomplete Attendance", f"Missing attendance data for student {student[1]} {student[2]}. Please fill all the missing data.")
-                return
+                if not (present_checked or absent_checked):
+                    conn.close()
+                    QMessageBox.warning(self, "Incomplete Attendance", f"Missing attendance data for student {student[1]} {student[2]}. Please fill all the missing data.")
+                    return
 
-            status = "Present" if present_checked else "Absent"
+                status = "Present" if present_checked else "Absent"
 
-            # Check if attendance record exists
-            cursor.execute('''
-                SELECT * FROM Attendance WHERE student_id = ? AND lab_slot_id = ? AND exercise_slot = ? AND academic_year_id = ?
-            ''', (student[0], lab_slot_id, exercise_slot, academic_year_id))
-            if cursor.fetchone():
-                # Update existing record
-                cursor.execute('''
-                    UPDATE Attendance SET status = ?, timestamp = ? WHERE student_id = ? AND lab_slot_id = ? AND exercise_slot = ? AND academic_year_id = ?
-                ''', (status, timestamp, student[0], lab_slot_id, exercise_slot, academic_year_id))
-            else:
-                # Insert new record
+                # Insert the record or update the existing one for this sheet
                 cursor.execute('''
                     INSERT INTO Attendance (student_id, lab_slot_id, exercise_slot, status, timestamp, academic_year_id)
                     VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (student_id, lab_slot_id, exercise_slot, academic_year_id)
+                    DO UPDATE SET status = excluded.status, timestamp = excluded.timestamp
                 ''', (student[0], lab_slot_id, exercise_slot, status, timestamp, academic_year_id))
 
-        conn.commit()
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            conn.close()
+            QMessageBox.critical(self, "Error", f"Saving attendance failed: {e}")
+            return
+
         conn.close()
         QMessageBox.information(self, "Success", "Attendance saved successfully.")
 
@@ -0,0 +1,157 @@
+"""
+Benchmark: dashboard statistics on a 10-year synthetic dataset.
+
+Compares the legacy dashboard queries (one lab-slot query per academic year
+with correlated COUNT(*) subqueries per lab slot) with `dashboard_stats`,
+which reads the trigger-maintained LabSlotStats rows. Both versions are
+checked to return the same numbers, which also checks the triggers that
+counted the seeded rows. Repeat loads between saves are timed through the
+data-version cache the dashboard route uses. Runs against a throw-away database in a
+temporary directory.
+
+Usage: python benchmark_dashboard.py [--years 10] [--slots 12] [--students 20] [--runs 20]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from simple_app import (app, init_db, close_pools, dashboard_context, dashboard_stats, get_result_cache,
+                        modify_many, query_db, transaction)
+
+SEMESTERS = ('Fall', 'Spring')
+EXERCISES = [f'Lab{i}' for i in range(1, 14)]
+
+
+def seed(num_years, slots_per_semester, students_per_slot):
+    rng = random.Random(2025)
+    academic_years = [(semester, 2015 + i) for i in range(num_years) for semester in SEMESTERS]
+    students, lab_slots, enrollments, teams, attendance = [], [], [], [], []
+
+    for year_id, _ in enumerate(academic_years, start=1):
+        for slot in range(slots_per_semester):
+            lab_slot_id = len(lab_slots) + 1
+            lab_slots.append((f'LAB {slot + 1:02d}', year_id))
+            for i in range(students_per_slot):
+                student_id = f'S{len(students):06d}'
+                students.append((student_id, f'Student {len(students)}', f'{student_id}@example.org', student_id.lower()))
+                enrollments.append((student_id, lab_slot_id, year_id))
+                teams.append((i // 2 + 1, student_id, lab_slot_id))
+                for exercise in EXERCISES:
+                    status = 'Absent' if rng.random() < 0.08 else 'Present'
+                    attendance.append((student_id, lab_slot_id, exercise, status, '2025-01-01 10:00:00', year_id))
+
+    with transaction():
+        modify_many('INSERT INTO AcademicYear (semester, year) VALUES (?, ?)', academic_years)
+        modify_many('INSERT INTO LabSlots (name, academic_year_id) VALUES (?, ?)', lab_slots)
+        modify_many('INSERT INTO Students (student_id, name, email, username) VALUES (?, ?, ?, ?)', students)
+        modify_many('INSERT INTO Enrollments (student_id, lab_slot_id, academic_year_id) VALUES (?, ?, ?)', enrollments)
+        modify_many('INSERT INTO StudentTeams (team_number, student_id, lab_slot_id) VALUES (?, ?, ?)', teams)
+        modify_many('''INSERT INTO Attendance
+            (student_id, lab_slot_id, exercise_slot, status, timestamp, academic_year_id)
+            VALUES (?, ?, ?, ?, ?, ?)''', attendance)
+    return len(academic_years), len(lab_slots), len(students), len(attendance)
+
+
+def legacy_dashboard_stats():
+    # The unfiltered dashboard as it used to be queried
+    stats = {
+        'total_students': query_db('SELECT COUNT(*) as count FROM Students', one=True)['count'],
+        'total_lab_slots': query_db('SELECT COUNT(*) as count FROM LabSlots', one=True)['count'],
+        'absences': query_db('SELECT COUNT(*) as count FROM Attendance WHERE status = "Absent"', one=True)['count'],
+    }
+    lab_slots_by_year = {}
+    for year in query_db('SELECT id, semester, year FROM AcademicYear ORDER BY year, semester'):
+        lab_slots_by_year[f"{year['semester']} {year['year']}"] = query_db('''
+            SELECT
+                LabSlots.id,
+                LabSlots.name,
+                (SELECT COUNT(*) FROM Enrollments WHERE Enrollments.lab_slot_id = LabSlots.id) as student_count,
+                (SELECT COUNT(*) FROM Attendance WHERE Attendance.lab_slot_id = LabSlots.id AND Attendance.status = 'Absent') as absences_count
+            FROM LabSlots
+            WHERE LabSlots.academic_year_id = ?
+        ''', [year['id']])
+    stats['lab_slots_by_year'] = lab_slots_by_year
+    stats['team_counts'] = query_db('''
+        SELECT LabSlots.name, COUNT(DISTINCT StudentTeams.team_number) as count
+        FROM StudentTeams
+        JOIN LabSlots ON StudentTeams.lab_slot_id = LabSlots.id
+        GROUP BY LabSlots.name
+    ''')
+    stats['absences_by_lab'] = query_db('''
+        SELECT l.name as lab_name, COUNT(*) as absent_count
+        FROM Attendance a
+        JOIN LabSlots l ON a.lab_slot_id = l.id
+        WHERE a.status = 'Absent'
+        GROUP BY l.id
+        ORDER BY absent_count DESC
+        LIMIT 10
+    ''')
+    return stats
+
+
+def same_numbers(legacy, current):
+    """Compare the two results, ignoring row order within equal counts."""
+    for key in ('total_students', 'total_lab_slots', 'absences'):
+        if legacy[key] != current[key]:
+            return False
+    for year, rows in legacy['lab_slots_by_year'].items():
+        slots = {(row['id'], row['student_count'], row['absences_count']) for row in rows}
+        if slots != {(s['id'], s['student_count'], s['absences_count']) for s in current['lab_slots_by_year'][year]}:
+            return False
+    if [tuple(row) for row in legacy['team_counts']] != [(t['name'], t['count']) for t in current['team_counts']]:
+        return False
+    return sorted(row['absent_count'] for row in legacy['absences_by_lab']) == \
+        sorted(row['absent_count'] for row in current['absences_by_lab'])
+
+
+def measure(func, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--slots', type=int, default=12, help='lab slots per semester')
+    parser.add_argument('--students', type=int, default=20, help='students per lab slot')
+    parser.add_argument('--runs', type=int, default=20)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.config['DATABASE'] = os.path.join(tmp, 'bench.db')
+        init_db()
+        with app.test_request_context('/dashboard'):
+            sizes = seed(options.years, options.slots, options.students)
+            consistent = same_numbers(legacy_dashboard_stats(), dashboard_stats())
+            results = {
+                'all years, per-year queries (before)': measure(legacy_dashboard_stats, options.runs),
+                'all years, LabSlotStats (after)': measure(dashboard_stats, options.runs),
+                'one year, LabSlotStats (after)': measure(lambda: dashboard_stats(1), options.runs),
+                'all years, page context, cached': measure(
+                    lambda: get_result_cache().get(('dashboard', None), dashboard_context), options.runs
+                ),
+            }
+        # Release pooled connections before the temporary directory is removed
+        close_pools()
+
+    print(f"\nDashboard, {sizes[0]} academic years, {sizes[1]} lab slots, "
+          f"{sizes[2]} students, {sizes[3]} attendance rows, {options.runs} runs")
+    print(f"{'pattern':<40}{'median ms':>12}{'mean ms':>12}{'max ms':>12}")
+    for name, timings in results.items():
+        print(f"{name:<40}{statistics.median(timings):>12.2f}{statistics.mean(timings):>12.2f}{max(timings):>12.2f}")
+    before = statistics.median(results['all years, per-year queries (before)'])
+    after = statistics.median(results['all years, LabSlotStats (after)'])
+    print(f"\nSpeed-up over per-year queries: {before / after:.1f}x")
+    print(f"Same numbers as the legacy queries: {'yes' if consistent else 'NO'}")
+    return 0 if consistent else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
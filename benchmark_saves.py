@@ -0,0 +1,107 @@
+"""
+Benchmark: per-save latency of an attendance/grade sheet for a 200-student lab.
+
+Compares the legacy write pattern (one INSERT + COMMIT per student), the
+unit-of-work pattern (one transaction, one executemany) and the diff-only
+upsert used by the save handlers, which writes just the rows whose status
+changed since the last save. Runs against a throw-away database in a
+temporary directory.
+
+Usage: python benchmark_saves.py [--students 200] [--runs 20]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from simple_app import app, init_db, close_pools, modify_db, modify_many, named_many, sheet_values, transaction
+
+INSERT_ATTENDANCE = '''INSERT INTO Attendance
+    (student_id, lab_slot_id, exercise_slot, status, timestamp, academic_year_id)
+    VALUES (?, ?, ?, ?, ?, ?)'''
+DELETE_ATTENDANCE = '''DELETE FROM Attendance
+    WHERE lab_slot_id = ? AND exercise_slot = ? AND academic_year_id = ?'''
+
+
+def seed(num_students):
+    modify_db('INSERT INTO AcademicYear (semester, year) VALUES (?, ?)', ['EARINO', 2025])
+    modify_db('INSERT INTO LabSlots (name, academic_year_id) VALUES (?, ?)', ['BENCH LAB', 1])
+    students = [(f'B{i:05d}', f'Student {i}', f'b{i}@example.org', f'b{i}') for i in range(num_students)]
+    with transaction():
+        modify_many('INSERT INTO Students (student_id, name, email, username) VALUES (?, ?, ?, ?)', students)
+        modify_many(
+            'INSERT INTO Enrollments (student_id, lab_slot_id, academic_year_id) VALUES (?, ?, ?)',
+            [(s[0], 1, 1) for s in students]
+        )
+    return [s[0] for s in students]
+
+
+def sheet(student_ids, run):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return [
+        (student_id, 1, 'Lab1', 'Absent' if (i + run) % 7 == 0 else 'Present', timestamp, 1)
+        for i, student_id in enumerate(student_ids)
+    ]
+
+
+def save_per_row(rows):
+    # Legacy pattern: every statement commits on its own
+    modify_db(DELETE_ATTENDANCE, [1, 'Lab1', 1])
+    for row in rows:
+        modify_db(INSERT_ATTENDANCE, row)
+
+
+def save_unit_of_work(rows):
+    with transaction():
+        modify_db(DELETE_ATTENDANCE, [1, 'Lab1', 1])
+        modify_many(INSERT_ATTENDANCE, rows)
+
+
+def save_changed_rows(rows):
+    current = sheet_values('attendance_sheet_values', 1, 'Lab1', 1)
+    named_many('upsert_attendance', [row for row in rows if current.get(row[0]) != row[3]])
+
+
+def measure(save, student_ids, runs):
+    timings = []
+    for run in range(runs):
+        rows = sheet(student_ids, run)
+        start = time.perf_counter()
+        save(rows)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--runs', type=int, default=20)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.config['DATABASE'] = os.path.join(tmp, 'bench.db')
+        init_db()
+        with app.app_context():
+            student_ids = seed(options.students)
+            results = {
+                'per-row commit (before)': measure(save_per_row, student_ids, options.runs),
+                'transaction + executemany (after)': measure(save_unit_of_work, student_ids, options.runs),
+                'diff-only upsert (current)': measure(save_changed_rows, student_ids, options.runs),
+            }
+        # Release pooled connections before the temporary directory is removed
+        close_pools()
+
+    print(f"\nAttendance sheet save, {options.students} students, {options.runs} runs")
+    print(f"{'pattern':<36}{'median ms':>12}{'mean ms':>12}{'max ms':>12}")
+    for name, timings in results.items():
+        print(f"{name:<36}{statistics.median(timings):>12.2f}{statistics.mean(timings):>12.2f}{max(timings):>12.2f}")
+    before = statistics.median(results['per-row commit (before)'])
+    print()
+    for name in ('transaction + executemany (after)', 'diff-only upsert (current)'):
+        print(f"Speed-up over per-row commit, {name}: {before / statistics.median(results[name]):.1f}x")
+
+
+if __name__ == '__main__':
+    main()
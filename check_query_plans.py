@@ -0,0 +1,148 @@
+"""
+Check that the hot roster/attendance/grade queries are served by indexes.
+
+Builds the schema in a temporary database, runs EXPLAIN QUERY PLAN on each
+query below and exits with status 1 if any of them falls back to a full
+table scan.
+
+Usage: python check_query_plans.py [-v]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+from grading import override_params
+from queries import QUERIES
+from simple_app import app, init_db, close_pools
+
+# name -> (sql, params); shapes taken from simple_app.py and routes/*.py
+HOT_QUERIES = {
+    'roster with teams (teams_show, export_teams, grades_export)': ('''
+        SELECT s.student_id, s.name, st.team_number
+        FROM Students s
+        JOIN Enrollments e ON s.student_id = e.student_id
+        LEFT JOIN StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
+        WHERE e.lab_slot_id = ? AND e.academic_year_id = ?
+        ORDER BY st.team_number, s.name
+    ''', [1, 1, 1]),
+    'attendance sheet (attendance_record)': ('''
+        SELECT s.student_id, s.name, st.team_number, COALESCE(a.status, 'Present') as status
+        FROM Students s
+        JOIN Enrollments e ON s.student_id = e.student_id
+        LEFT JOIN StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
+        LEFT JOIN Attendance a ON s.student_id = a.student_id AND a.lab_slot_id = ? AND a.exercise_slot = ? AND a.academic_year_id = ?
+        WHERE e.lab_slot_id = ? AND e.academic_year_id = ?
+    ''', [1, 1, 'Lab1', 1, 1, 1]),
+    'attendance view (attendance_view, export_attendance_view)': ('''
+        SELECT s.student_id, s.name, st.team_number, a.status, a.timestamp
+        FROM Attendance a
+        JOIN Students s ON a.student_id = s.student_id
+        LEFT JOIN StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
+        WHERE a.lab_slot_id = ? AND a.exercise_slot = ? AND a.academic_year_id = ?
+    ''', [1, 1, 'Lab1', 1]),
+    'cleared grade delete (grades_save)': ('''
+        DELETE FROM Grades WHERE student_id = ? AND lab_slot_id = ? AND exercise_slot = ? AND academic_year_id = ?
+    ''', ['S1', 1, 'Lab1', 1]),
+    'absences per year (attendance_absences, export_absences)': ('''
+        SELECT a.id, s.student_id, s.name, l.name, a.exercise_slot, a.timestamp
+        FROM Attendance a
+        JOIN Students s ON a.student_id = s.student_id
+        JOIN LabSlots l ON a.lab_slot_id = l.id
+        WHERE a.academic_year_id = ? AND a.status = 'Absent'
+    ''', [1]),
+    'absences per lab slot (routes/dashboard)': ('''
+        SELECT COUNT(*) FROM Attendance WHERE Attendance.lab_slot_id = ? AND Attendance.status = 'Absent'
+    ''', [1]),
+    'lab slot counts for one year (dashboard)': (QUERIES['dashboard_lab_slots_for_year'], [1]),
+    'students in one year (dashboard)': (QUERIES['dashboard_students_for_year'], [1]),
+    'grade statistics for one year (dashboard)': (QUERIES['dashboard_grades_for_year'], [1]),
+    'recent attendance sessions (attendance_index)': (QUERIES['attendance_sessions'], {'limit': 21}),
+    'older attendance sessions (attendance_index)': (
+        QUERIES['attendance_sessions_before'], {'limit': 21, 'before_updated': '2025-01-01', 'before_academic_year_id': 1, 'before_lab_slot_id': 1, 'before_exercise_slot': 'Lab1'}
+    ),
+    'recent graded sessions (grades_index)': (QUERIES['grade_sessions'], {'limit': 21}),
+    'older graded sessions (grades_index)': (
+        QUERIES['grade_sessions_before'], {'limit': 21, 'before_updated': '2025-01-01', 'before_academic_year_id': 1, 'before_lab_slot_id': 1, 'before_exercise_slot': 'Lab1'}
+    ),
+    'student absences (export_data, routes/attendance.show)': ('''
+        SELECT COUNT(*) FROM Attendance a
+        WHERE a.student_id = ? AND a.lab_slot_id = ? AND a.academic_year_id = ? AND a.status = 'Absent'
+    ''', ['S1', 1, 1]),
+    'grade sheet (grades_insert)': ('''
+        SELECT s.student_id, s.name, st.team_number, g.grade
+        FROM Students s
+        JOIN Enrollments e ON s.student_id = e.student_id
+        LEFT JOIN StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
+        LEFT JOIN Grades g ON s.student_id = g.student_id AND g.lab_slot_id = ? AND g.exercise_slot = ? AND g.academic_year_id = ?
+        WHERE e.lab_slot_id = ? AND e.academic_year_id = ?
+    ''', [1, 1, 'Lab1', 1, 1, 1]),
+    'grade view (grades_view)': ('''
+        SELECT s.student_id, s.name, g.grade, g.timestamp
+        FROM Grades g
+        JOIN Students s ON g.student_id = s.student_id
+        WHERE g.lab_slot_id = ? AND g.exercise_slot = ? AND g.academic_year_id = ?
+    ''', [1, 'Lab1', 1]),
+    'grade matrix (export_grades, export_data)': (
+        QUERIES['grade_matrix'], {'lab_slot_id': 1, 'academic_year_id': 1}
+    ),
+    'final grade sheet (grades_final, FinalGrades view)': (QUERIES['final_grade_sheet'], [1]),
+    'final grade per student (api_final_grades_update, student_detail)': (QUERIES['final_grade'], ['S1', 1]),
+    'final grade override (grades_final_save)': (
+        QUERIES['save_final_grade_override'], override_params('S1', 1, 7.5, 6.0, None)
+    ),
+    'lab slot stats (teams_assign)': (QUERIES['lab_slot_stats'], [1]),
+    'lab slots per year (api_lab_slots)': ('''
+        SELECT id, name FROM LabSlots WHERE academic_year_id = ? ORDER BY name
+    ''', [1]),
+    'student history (student_detail)': ('''
+        SELECT a.exercise_slot, a.status, l.name
+        FROM Attendance a JOIN LabSlots l ON a.lab_slot_id = l.id
+        WHERE a.student_id = ?
+    ''', ['S1']),
+    'student enrollment (transfer_student)': ('''
+        SELECT e.*, l.name FROM Enrollments e JOIN LabSlots l ON e.lab_slot_id = l.id
+        WHERE e.student_id = ? AND e.academic_year_id = ?
+    ''', ['S1', 1]),
+}
+
+
+def full_scans(conn, sql, params):
+    """Return the plan lines that scan a table without using an index."""
+    plan = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    details = [row[3] for row in plan]
+    # Scanning a subquery or CTE result is not a table scan; its own plan lines are checked
+    derived = {d.split(' ', 1)[1] for d in details if d.startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+    return details, [
+        d for d in details
+        if d.startswith('SCAN ') and ' USING ' not in d
+        and not d.startswith('SCAN (subquery-') and d[len('SCAN '):] not in derived
+    ]
+
+
+def main():
+    verbose = '-v' in sys.argv[1:]
+    failures = 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.config['DATABASE'] = os.path.join(tmp, 'plans.db')
+        init_db()
+        close_pools()
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        for name, (sql, params) in HOT_QUERIES.items():
+            details, scans = full_scans(conn, sql, params)
+            status = 'FAIL' if scans else 'ok'
+            print(f"[{status:>4}] {name}")
+            if scans or verbose:
+                for detail in details:
+                    print(f"         {detail}")
+            failures += bool(scans)
+        conn.close()
+
+    print(f"\n{len(HOT_QUERIES) - failures}/{len(HOT_QUERIES)} queries use an index")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
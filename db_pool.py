@@ -0,0 +1,156 @@
+"""
+SQLite connection pool for the Lab Database web application.
+
+Connections are opened once per worker, tuned with PRAGMAs and then handed
+out to request contexts instead of reconnecting on every request. A pool
+created with readonly=True opens its connections with a `mode=ro` URI, so
+under WAL its readers never block, or get blocked by, the writer.
+"""
+import os
+import pathlib
+import queue
+import sqlite3
+import threading
+import time
+
+# PRAGMAs applied once to every new connection
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,       # negative value = KiB, i.e. ~16 MB page cache
+    'mmap_size': 268435456,     # 256 MB memory-mapped I/O
+    'busy_timeout': 5000,       # milliseconds to wait on a locked database
+    'temp_store': 'MEMORY',
+}
+
+
+def open_connection(database, pragmas=None, cached_statements=128, readonly=False):
+    """Open a connection tuned with `pragmas` (DEFAULT_PRAGMAS when None)."""
+    pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+    if readonly:
+        database = pathlib.Path(database).absolute().as_uri() + '?mode=ro'
+    conn = sqlite3.connect(
+        database,
+        timeout=pragmas.get('busy_timeout', 5000) / 1000,
+        check_same_thread=False,
+        cached_statements=cached_statements,
+        uri=readonly,
+    )
+    conn.row_factory = sqlite3.Row
+    for name, value in pragmas.items():
+        # WAL is a property of the database file, set by the writer and not available in memory
+        if name == 'journal_mode' and (readonly or database == ':memory:'):
+            continue
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available in time."""
+
+
+class ConnectionPool:
+    def __init__(self, database, size=5, timeout=30.0, pragmas=None, cached_statements=128, readonly=False):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.readonly = readonly
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.pid = os.getpid()
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._stats = {
+            'checkouts': 0,
+            'hits': 0,
+            'misses': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+        }
+
+    def _connect(self):
+        return open_connection(self.database, self.pragmas, self.cached_statements, self.readonly)
+
+    def acquire(self):
+        """Check out a connection, opening a new one while under the pool size."""
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self._stats['checkouts'] += 1
+                self._stats['hits'] += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            with self._lock:
+                self._stats['checkouts'] += 1
+                self._stats['misses'] += 1
+            return conn
+
+        # Pool exhausted: wait for another request to release a connection
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeout(f'No database connection available after {self.timeout} seconds')
+
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['hits'] += 1
+            self._stats['waits'] += 1
+            self._stats['wait_time'] += time.perf_counter() - start
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any uncommitted work."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # A broken connection is dropped rather than handed out again
+            with self._lock:
+                self._created -= 1
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['readonly'] = self.readonly
+            stats['size'] = self.size
+            stats['open'] = self._created
+        stats['idle'] = self._idle.qsize()
+        stats['in_use'] = stats['open'] - stats['idle']
+        stats['hit_ratio'] = round(stats['hits'] / stats['checkouts'], 4) if stats['checkouts'] else 0.0
+        stats['avg_wait_ms'] = round(stats['wait_time'] * 1000 / stats['waits'], 3) if stats['waits'] else 0.0
+        stats['wait_time'] = round(stats['wait_time'], 6)
+        return stats
+
+    def close(self):
+        """Close all idle connections."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
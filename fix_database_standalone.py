@@ -8,6 +8,7 @@ To run this script:
 
 import sqlite3
 import os
+from migrations import migrate, schema_version, standardize_exercise_slots
 
 def main():
     # Check if database exists
@@ -38,57 +39,17 @@ def main():
         except:
             print("Could not read from Grades table")
         
-        # Exercise slot mappings
-        mappings = {
-            'Άσκηση 1': 'Lab1',
-            'Άσκηση 2': 'Lab2',
-            'Άσκηση 3': 'Lab3',
-            'Άσκηση 4': 'Lab4',
-            'Άσκηση 5': 'Lab5',
-            'Άσκηση 6': 'Lab6',
-            'Άσκηση 7': 'Lab7',
-            'Άσκηση 8': 'Lab8',
-            'Άσκηση 9': 'Lab9',
-            'Άσκηση 10': 'Lab10',
-            'Άσκηση 11': 'Lab11',
-            'Άσκηση 12': 'Lab12',
-            'Άσκηση 13': 'Lab13',
-            'Ε1': 'Lab1',
-            'Ε2': 'Lab2',
-            'Ε3': 'Lab3',
-            'Ε4': 'Lab4',
-            'Ε5': 'Lab5',
-            'Ε6': 'Lab6',
-            'Ε7': 'Lab7',
-            'Ε8': 'Lab8',
-            'Ε9': 'Lab9',
-            'Ε10': 'Lab10',
-            'Ε11': 'Lab11',
-            'Ε12': 'Lab12',
-            'Ε13': 'Lab13'
-        }
+        # Bring the schema up to date (this also standardizes slot names once)
+        before = schema_version(conn)
+        after = migrate(conn)
+        print(f"\nSchema version: {before} -> {after}")
         
-        # Update Attendance table
-        print("\nUpdating Attendance table...")
-        for old_value, new_value in mappings.items():
-            try:
-                cursor.execute('UPDATE Attendance SET exercise_slot = ? WHERE exercise_slot = ?', 
-                             (new_value, old_value))
-                if cursor.rowcount > 0:
-                    print(f"  Updated {cursor.rowcount} rows: '{old_value}' -> '{new_value}'")
-            except Exception as e:
-                print(f"  Error updating '{old_value}' in Attendance: {e}")
-        
-        # Update Grades table
-        print("\nUpdating Grades table...")
-        for old_value, new_value in mappings.items():
-            try:
-                cursor.execute('UPDATE Grades SET exercise_slot = ? WHERE exercise_slot = ?', 
-                             (new_value, old_value))
-                if cursor.rowcount > 0:
-                    print(f"  Updated {cursor.rowcount} rows: '{old_value}' -> '{new_value}'")
-            except Exception as e:
-                print(f"  Error updating '{old_value}' in Grades: {e}")
+        # Re-apply the exercise slot mapping for rows written since the migration ran
+        print("\nUpdating Attendance and Grades tables...")
+        try:
+            standardize_exercise_slots(cursor)
+        except Exception as e:
+            print(f"  Error updating exercise slots: {e}")
         
         # Commit changes
         conn.commit()
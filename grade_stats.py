@@ -0,0 +1,94 @@
+"""
+Grade statistics for the grade pages, the grade export and the dashboard.
+
+Count, mean, min, max, standard deviation and the 10-bin histogram are plain
+aggregates, so wherever grades are grouped in SQL (one row per sheet on the
+grades index, one row for the dashboard) SQLite computes them with
+GRADE_AGGREGATES and `from_aggregates()` turns the row into a summary.
+Median and percentiles need every value: `summarize()` computes the full
+summary from the grades of one group as a NumPy array.
+
+NULL grades (students listed on a sheet without a grade) are left out of
+every statistic. Empty groups summarize to zeros, like the pages always
+showed them.
+"""
+import math
+
+import numpy as np
+
+BINS = 10
+PERCENTILES = (25, 75, 90)
+
+# Grade 10 goes in the last bin
+_BIN = f'MIN(MAX(CAST(g.grade AS INTEGER), 0), {BINS - 1})'
+
+# SELECT-list aggregates over a `g.grade` column, for any grouped query
+GRADE_AGGREGATES = ',\n'.join([
+    'COUNT(g.grade) AS graded_count',
+    'AVG(g.grade) AS average_grade',
+    'MIN(g.grade) AS min_grade',
+    'MAX(g.grade) AS max_grade',
+    'AVG(g.grade * g.grade) AS mean_square',
+] + [f'COUNT(CASE WHEN {_BIN} = {i} THEN 1 END) AS bin_{i}' for i in range(BINS)])
+
+
+def _empty():
+    return {
+        'count': 0,
+        'average': 0,
+        'min': 0,
+        'max': 0,
+        'stddev': 0,
+        'distribution': [0] * BINS,
+    }
+
+
+def from_aggregates(row):
+    """Summary (without median/percentiles) from a row selected with GRADE_AGGREGATES.
+
+    Rows with the same columns but no bin_* columns (the Sessions pages) give
+    a summary without 'distribution'.
+    """
+    if not row or not row['graded_count']:
+        return _empty()
+    average = row['average_grade']
+    summary = {
+        'count': row['graded_count'],
+        'average': average,
+        'min': row['min_grade'],
+        'max': row['max_grade'],
+        # Population standard deviation; clamp float noise below zero
+        'stddev': math.sqrt(max(row['mean_square'] - average * average, 0.0)),
+    }
+    if 'bin_0' in row.keys():
+        summary['distribution'] = [row[f'bin_{i}'] for i in range(BINS)]
+    return summary
+
+
+def grade_array(grades):
+    """Float array of the non-NULL grades in `grades` (any iterable, NaN and None dropped)."""
+    values = np.array([np.nan if grade is None else grade for grade in grades], dtype=float)
+    return values[~np.isnan(values)]
+
+
+def summarize(grades):
+    """Full summary of one group of grades: the aggregates plus median and percentiles."""
+    values = grade_array(grades)
+    summary = _empty()
+    summary.update(median=0, percentiles={p: 0 for p in PERCENTILES})
+    if not values.size:
+        return summary
+
+    bins = np.clip(values.astype(int), 0, BINS - 1)
+    median, *percentiles = np.percentile(values, (50,) + PERCENTILES)
+    summary.update(
+        count=int(values.size),
+        average=float(values.mean()),
+        min=float(values.min()),
+        max=float(values.max()),
+        stddev=float(values.std()),
+        distribution=np.bincount(bins, minlength=BINS).tolist(),
+        median=float(median),
+        percentiles={p: float(value) for p, value in zip(PERCENTILES, percentiles)},
+    )
+    return summary
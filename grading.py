@@ -0,0 +1,123 @@
+"""
+Final-grade policy and hand-entered overrides.
+
+Final grades are not stored: the FinalGrades view (migration 7) computes them
+from Grades whenever it is read, so they are current as soon as a grade is
+saved and nothing has to be recalculated. Per student and academic year it
+takes the lab average over every non-exam grade, lets the September exam
+(resit) replace the June exam, and applies the year's GradingPolicies weights,
+or the defaults below for years without a policy. The final grade stays NULL
+until both a lab average and an exam grade exist.
+
+Values entered by hand on the final-grades page are kept in
+FinalGradeOverrides and take precedence over the computed inputs. Only the
+values that differ from the computed ones are stored, so the other inputs
+keep following the grades. The SQL uses named parameters only, so it runs
+unchanged on a sqlite3 connection/cursor and through SQLAlchemy `text()`.
+"""
+JUN_EXAM = 'Exam.Jun'
+SEP_EXAM = 'Exam.Sep'
+EXAM_SLOTS = (JUN_EXAM, SEP_EXAM)
+
+PASS_GRADE = 5.0
+
+
+class GradingPolicy:
+    def __init__(self, lab_weight=0.25, exam_weight=0.75):
+        self.lab_weight = lab_weight
+        self.exam_weight = exam_weight
+
+    @classmethod
+    def from_row(cls, row):
+        """Policy stored for a year, or the default one when `row` is None."""
+        if row is None:
+            return DEFAULT_POLICY
+        return cls(row['lab_weight'], row['exam_weight'])
+
+    def validate(self):
+        """Raise ValueError unless both weights are in [0, 1] and add up to 1."""
+        for weight in (self.lab_weight, self.exam_weight):
+            if not 0 <= weight <= 1:
+                raise ValueError('Weights must be between 0 and 1')
+        if abs(self.lab_weight + self.exam_weight - 1) > 1e-9:
+            raise ValueError('Lab and exam weights must add up to 1')
+
+    def params(self, academic_year_id):
+        return {
+            'academic_year_id': academic_year_id,
+            'lab_weight': self.lab_weight,
+            'exam_weight': self.exam_weight,
+        }
+
+
+# Must match the COALESCE defaults of the FinalGrades view
+DEFAULT_POLICY = GradingPolicy()
+
+GRADING_POLICY_QUERY = '''
+    SELECT lab_weight, exam_weight FROM GradingPolicies WHERE academic_year_id = :academic_year_id
+'''
+
+SET_GRADING_POLICY = '''
+    INSERT INTO GradingPolicies (academic_year_id, lab_weight, exam_weight)
+    VALUES (:academic_year_id, :lab_weight, :exam_weight)
+    ON CONFLICT (academic_year_id) DO UPDATE SET
+        lab_weight = excluded.lab_weight,
+        exam_weight = excluded.exam_weight
+'''
+
+# Values equal to the computed ones (the lab average as displayed, rounded to
+# 2) are stored as NULL, i.e. "follow the grades"
+SAVE_FINAL_GRADE_OVERRIDE = '''
+    INSERT INTO FinalGradeOverrides
+    (student_id, academic_year_id, lab_average, jun_exam_grade, sep_exam_grade)
+    VALUES (
+        :student_id,
+        :academic_year_id,
+        NULLIF(:lab_average, (
+            SELECT ROUND(lab_average, 2) FROM GradeSummary
+            WHERE student_id = :student_id AND academic_year_id = :academic_year_id
+        )),
+        NULLIF(:jun_exam_grade, (
+            SELECT jun_exam_grade FROM GradeSummary
+            WHERE student_id = :student_id AND academic_year_id = :academic_year_id
+        )),
+        NULLIF(:sep_exam_grade, (
+            SELECT sep_exam_grade FROM GradeSummary
+            WHERE student_id = :student_id AND academic_year_id = :academic_year_id
+        ))
+    )
+    ON CONFLICT (student_id, academic_year_id) DO UPDATE SET
+        lab_average = excluded.lab_average,
+        jun_exam_grade = excluded.jun_exam_grade,
+        sep_exam_grade = excluded.sep_exam_grade
+'''
+
+# For callers that compute the final-grade inputs themselves (simple_app.pyw,
+# which reads exams from ExamGrades) and pass NULL for the unchanged values
+SET_FINAL_GRADE_OVERRIDE = '''
+    INSERT INTO FinalGradeOverrides
+    (student_id, academic_year_id, lab_average, jun_exam_grade, sep_exam_grade)
+    VALUES (:student_id, :academic_year_id, :lab_average, :jun_exam_grade, :sep_exam_grade)
+    ON CONFLICT (student_id, academic_year_id) DO UPDATE SET
+        lab_average = excluded.lab_average,
+        jun_exam_grade = excluded.jun_exam_grade,
+        sep_exam_grade = excluded.sep_exam_grade
+'''
+
+# Run after SAVE_FINAL_GRADE_OVERRIDE (or SET_FINAL_GRADE_OVERRIDE) with the same parameters
+PRUNE_FINAL_GRADE_OVERRIDE = '''
+    DELETE FROM FinalGradeOverrides
+    WHERE student_id = :student_id AND academic_year_id = :academic_year_id
+    AND lab_average IS NULL AND jun_exam_grade IS NULL AND sep_exam_grade IS NULL
+'''
+
+
+def override_params(student_id, academic_year_id, lab_average, jun_exam_grade, sep_exam_grade):
+    return {
+        'student_id': student_id,
+        'academic_year_id': academic_year_id,
+        'lab_average': lab_average,
+        'jun_exam_grade': jun_exam_grade,
+        'sep_exam_grade': sep_exam_grade,
+    }
+
@@ -1,7 +1,9 @@
 # main.py
 
+import sqlite3
 import sys
-from PyQt5.QtWidgets import QApplication, QTabWidget, QWidget, QVBoxLayout, QPushButton
+from PyQt5.QtWidgets import QApplication, QTabWidget, QWidget, QVBoxLayout, QPushButton, QMessageBox
+from migrations import migrate
 from Tabs.create_update_db import CreateUpdateDBTab
 from Tabs.import_students import ImportStudentsTab
 from Tabs.assign_teams import AssignTeamsTab
@@ -31,8 +33,21 @@ class MainApp(QTabWidget):
         self.addTab(ExitTab(), "Exit")
 
 
+def upgrade_database():
+    # The tabs' upserts need the natural-key indexes of the migrations, so
+    # bring the schema up to date before any tab touches the database
+    conn = sqlite3.connect('student_register.db')
+    try:
+        migrate(conn)
+    except sqlite3.Error as e:
+        QMessageBox.critical(None, "Error", f"Database update failed: {e}")
+    finally:
+        conn.close()
+
+
 def main():
     app = QApplication(sys.argv)
+    upgrade_database()
     window = MainApp()
     window.show()
     sys.exit(app.exec_())
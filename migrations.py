@@ -0,0 +1,772 @@
+"""
+Versioned schema migrations for student_register.db.
+
+Every migration is registered with the schema version it produces. The
+version a database is at is stored in PRAGMA user_version, so `migrate()`
+only runs the migrations a database has not seen yet, all of them inside a
+single transaction.
+
+Usage: python migrations.py [path/to/student_register.db]
+"""
+import sqlite3
+import sys
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register a migration function that brings the schema to `version`."""
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+def is_view(cursor, name):
+    row = cursor.execute('SELECT type FROM sqlite_master WHERE name = ?', (name,)).fetchone()
+    return row is not None and row[0] == 'view'
+
+
+def table_columns(cursor, table):
+    return {row[1] for row in cursor.execute(f'PRAGMA table_info({table})').fetchall()}
+
+
+@migration(1, 'Create base tables')
+def create_base_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS AcademicYear (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            semester TEXT,
+            year INTEGER
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS LabSlots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            academic_year_id INTEGER,
+            FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Students (
+            student_id TEXT PRIMARY KEY,
+            name TEXT,
+            email TEXT,
+            registration_number TEXT,
+            username TEXT
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Enrollments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id TEXT,
+            lab_slot_id INTEGER,
+            academic_year_id INTEGER,
+            FOREIGN KEY(student_id) REFERENCES Students(student_id),
+            FOREIGN KEY(lab_slot_id) REFERENCES LabSlots(id),
+            FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS StudentTeams (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            team_number INTEGER,
+            student_id TEXT,
+            lab_slot_id INTEGER,
+            FOREIGN KEY(student_id) REFERENCES Students(student_id),
+            FOREIGN KEY(lab_slot_id) REFERENCES LabSlots(id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Attendance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id TEXT,
+            lab_slot_id INTEGER,
+            exercise_slot TEXT,
+            status TEXT,
+            timestamp TEXT,
+            academic_year_id INTEGER,
+            FOREIGN KEY(student_id) REFERENCES Students(student_id),
+            FOREIGN KEY(lab_slot_id) REFERENCES LabSlots(id),
+            FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Grades (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id TEXT,
+            lab_slot_id INTEGER,
+            exercise_slot TEXT,
+            grade REAL,
+            timestamp TEXT,
+            academic_year_id INTEGER,
+            FOREIGN KEY(student_id) REFERENCES Students(student_id),
+            FOREIGN KEY(lab_slot_id) REFERENCES LabSlots(id),
+            FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS FinalGrades (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id TEXT,
+            lab_average REAL,
+            jun_exam_grade REAL,
+            sep_exam_grade REAL,
+            final_grade REAL,
+            academic_year_id INTEGER,
+            FOREIGN KEY(student_id) REFERENCES Students(student_id),
+            FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
+        )
+    ''')
+
+
+@migration(2, 'Add Attendance.replenishment_note')
+def add_replenishment_note(cursor):
+    # Databases created by the desktop app or older web versions lack the column
+    if 'replenishment_note' not in table_columns(cursor, 'Attendance'):
+        cursor.execute('ALTER TABLE Attendance ADD COLUMN replenishment_note TEXT')
+
+
+# Secondary indexes matching the roster, attendance and grade access paths
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_labslots_year ON LabSlots (academic_year_id, name)',
+    'CREATE INDEX IF NOT EXISTS idx_enrollments_lab_year ON Enrollments (lab_slot_id, academic_year_id, student_id)',
+    'CREATE INDEX IF NOT EXISTS idx_enrollments_year ON Enrollments (academic_year_id, student_id, lab_slot_id)',
+    'CREATE INDEX IF NOT EXISTS idx_enrollments_student ON Enrollments (student_id, academic_year_id)',
+    'CREATE INDEX IF NOT EXISTS idx_teams_lab_student ON StudentTeams (lab_slot_id, student_id, team_number)',
+    'CREATE INDEX IF NOT EXISTS idx_teams_student ON StudentTeams (student_id, lab_slot_id)',
+    'CREATE INDEX IF NOT EXISTS idx_attendance_sheet ON Attendance (lab_slot_id, academic_year_id, exercise_slot, student_id)',
+    'CREATE INDEX IF NOT EXISTS idx_attendance_lab_status ON Attendance (lab_slot_id, status)',
+    'CREATE INDEX IF NOT EXISTS idx_attendance_year_status ON Attendance (academic_year_id, status, lab_slot_id)',
+    'CREATE INDEX IF NOT EXISTS idx_attendance_student ON Attendance (student_id, academic_year_id, lab_slot_id, status)',
+    'CREATE INDEX IF NOT EXISTS idx_grades_sheet ON Grades (lab_slot_id, academic_year_id, exercise_slot, student_id)',
+    'CREATE INDEX IF NOT EXISTS idx_grades_student ON Grades (student_id, academic_year_id, exercise_slot, grade)',
+    'CREATE INDEX IF NOT EXISTS idx_finalgrades_student ON FinalGrades (student_id, academic_year_id)',
+    'CREATE INDEX IF NOT EXISTS idx_finalgrades_year ON FinalGrades (academic_year_id, student_id)',
+]
+
+
+@migration(3, 'Create secondary indexes')
+def create_indexes(cursor):
+    # Databases created by older versions of models.init_db already have the
+    # FinalGrades view of migration 7, and views cannot be indexed
+    skip_final_grades = is_view(cursor, 'FinalGrades')
+    for statement in INDEXES:
+        if skip_final_grades and ' ON FinalGrades ' in statement:
+            continue
+        cursor.execute(statement)
+
+
+# Legacy exercise slot names written by early versions of the desktop app
+EXERCISE_SLOT_NAMES = {
+    **{f'Άσκηση {i}': f'Lab{i}' for i in range(1, 14)},
+    **{f'Ε{i}': f'Lab{i}' for i in range(1, 14)},
+}
+
+
+@migration(4, 'Standardize exercise slot names')
+def standardize_exercise_slots(cursor):
+    for table in ('Attendance', 'Grades'):
+        cursor.executemany(
+            f'UPDATE {table} SET exercise_slot = ? WHERE exercise_slot = ?',
+            [(new_value, old_value) for old_value, new_value in EXERCISE_SLOT_NAMES.items()]
+        )
+
+
+# Natural keys: (table, unique index, index it supersedes, columns)
+NATURAL_KEYS = [
+    ('Attendance', 'uq_attendance_sheet', 'idx_attendance_sheet',
+     'lab_slot_id, academic_year_id, exercise_slot, student_id'),
+    ('Grades', 'uq_grades_sheet', 'idx_grades_sheet',
+     'lab_slot_id, academic_year_id, exercise_slot, student_id'),
+    ('FinalGrades', 'uq_finalgrades_student', 'idx_finalgrades_student',
+     'student_id, academic_year_id'),
+    ('StudentTeams', 'uq_teams_student', 'idx_teams_student',
+     'student_id, lab_slot_id'),
+]
+
+
+@migration(5, 'Add natural-key unique indexes')
+def add_natural_keys(cursor):
+    for table, name, supersedes, columns in NATURAL_KEYS:
+        if is_view(cursor, table):
+            continue
+        # Keep the most recently written row of every duplicate group
+        cursor.execute(f'''
+            DELETE FROM {table}
+            WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY {columns})
+        ''')
+        cursor.execute(f'DROP INDEX IF EXISTS {supersedes}')
+        cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+
+
+# Per-lab-slot counts kept current by triggers, so pages that list lab slots
+# read one row per slot instead of aggregating the fact tables
+LAB_SLOT_STATS_TRIGGERS = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_labslots_stats_insert AFTER INSERT ON LabSlots
+    BEGIN
+        INSERT OR IGNORE INTO LabSlotStats (lab_slot_id) VALUES (NEW.id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_labslots_stats_delete AFTER DELETE ON LabSlots
+    BEGIN
+        DELETE FROM LabSlotStats WHERE lab_slot_id = OLD.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_enrollments_stats_insert AFTER INSERT ON Enrollments
+    BEGIN
+        UPDATE LabSlotStats SET student_count = student_count + 1 WHERE lab_slot_id = NEW.lab_slot_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_enrollments_stats_delete AFTER DELETE ON Enrollments
+    BEGIN
+        UPDATE LabSlotStats SET student_count = student_count - 1 WHERE lab_slot_id = OLD.lab_slot_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_enrollments_stats_update AFTER UPDATE OF lab_slot_id ON Enrollments
+    WHEN OLD.lab_slot_id IS NOT NEW.lab_slot_id
+    BEGIN
+        UPDATE LabSlotStats SET student_count = student_count - 1 WHERE lab_slot_id = OLD.lab_slot_id;
+        UPDATE LabSlotStats SET student_count = student_count + 1 WHERE lab_slot_id = NEW.lab_slot_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_attendance_stats_insert AFTER INSERT ON Attendance
+    WHEN NEW.status = 'Absent'
+    BEGIN
+        UPDATE LabSlotStats SET absences_count = absences_count + 1 WHERE lab_slot_id = NEW.lab_slot_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_attendance_stats_delete AFTER DELETE ON Attendance
+    WHEN OLD.status = 'Absent'
+    BEGIN
+        UPDATE LabSlotStats SET absences_count = absences_count - 1 WHERE lab_slot_id = OLD.lab_slot_id;
+    END
+    ''',
+    # Also fires for the DO UPDATE branch of the attendance upserts
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_attendance_stats_update AFTER UPDATE OF status, lab_slot_id ON Attendance
+    WHEN (OLD.status IS 'Absent') != (NEW.status IS 'Absent') OR OLD.lab_slot_id IS NOT NEW.lab_slot_id
+    BEGIN
+        UPDATE LabSlotStats SET absences_count = absences_count - (OLD.status IS 'Absent') WHERE lab_slot_id = OLD.lab_slot_id;
+        UPDATE LabSlotStats SET absences_count = absences_count + (NEW.status IS 'Absent') WHERE lab_slot_id = NEW.lab_slot_id;
+    END
+    ''',
+    # Distinct team numbers cannot be counted incrementally; recount the one slot
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_teams_stats_insert AFTER INSERT ON StudentTeams
+    BEGIN
+        UPDATE LabSlotStats SET
+            team_member_count = team_member_count + 1,
+            team_count = (SELECT COUNT(DISTINCT team_number) FROM StudentTeams WHERE lab_slot_id = NEW.lab_slot_id)
+        WHERE lab_slot_id = NEW.lab_slot_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_teams_stats_delete AFTER DELETE ON StudentTeams
+    BEGIN
+        UPDATE LabSlotStats SET
+            team_member_count = team_member_count - 1,
+            team_count = (SELECT COUNT(DISTINCT team_number) FROM StudentTeams WHERE lab_slot_id = OLD.lab_slot_id)
+        WHERE lab_slot_id = OLD.lab_slot_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_teams_stats_update AFTER UPDATE OF team_number, lab_slot_id ON StudentTeams
+    BEGIN
+        UPDATE LabSlotStats SET
+            team_member_count = team_member_count - 1,
+            team_count = (SELECT COUNT(DISTINCT team_number) FROM StudentTeams WHERE lab_slot_id = OLD.lab_slot_id)
+        WHERE lab_slot_id = OLD.lab_slot_id;
+        UPDATE LabSlotStats SET
+            team_member_count = team_member_count + 1,
+            team_count = (SELECT COUNT(DISTINCT team_number) FROM StudentTeams WHERE lab_slot_id = NEW.lab_slot_id)
+        WHERE lab_slot_id = NEW.lab_slot_id;
+    END
+    ''',
+]
+
+
+def rebuild_lab_slot_stats(cursor):
+    """Recount LabSlotStats from the fact tables."""
+    cursor.execute('DELETE FROM LabSlotStats')
+    cursor.execute('''
+        INSERT INTO LabSlotStats (lab_slot_id, student_count, absences_count, team_count, team_member_count)
+        SELECT
+            l.id,
+            (SELECT COUNT(*) FROM Enrollments e WHERE e.lab_slot_id = l.id),
+            (SELECT COUNT(*) FROM Attendance a WHERE a.lab_slot_id = l.id AND a.status = 'Absent'),
+            (SELECT COUNT(DISTINCT team_number) FROM StudentTeams st WHERE st.lab_slot_id = l.id),
+            (SELECT COUNT(*) FROM StudentTeams st WHERE st.lab_slot_id = l.id)
+        FROM LabSlots l
+    ''')
+
+
+@migration(6, 'Add trigger-maintained LabSlotStats')
+def add_lab_slot_stats(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS LabSlotStats (
+            lab_slot_id INTEGER PRIMARY KEY,
+            student_count INTEGER NOT NULL DEFAULT 0,
+            absences_count INTEGER NOT NULL DEFAULT 0,
+            team_count INTEGER NOT NULL DEFAULT 0,
+            team_member_count INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY(lab_slot_id) REFERENCES LabSlots(id)
+        )
+    ''')
+    for statement in LAB_SLOT_STATS_TRIGGERS:
+        cursor.execute(statement)
+    rebuild_lab_slot_stats(cursor)
+
+
+
+# Final grades are read from views over Grades, so they are current as soon as
+# a grade is saved. Inputs entered by hand on the final-grades page live in
+# FinalGradeOverrides and take precedence over the computed ones; the weights
+# come from the year's GradingPolicies row, or the defaults below.
+# Per-student correlated lookups (rather than one GROUP BY) let SQLite push a
+# student or academic-year filter on the views down to the indexes.
+GRADE_SUMMARY_VIEW = '''
+    CREATE VIEW IF NOT EXISTS GradeSummary AS
+    SELECT
+        k.student_id,
+        k.academic_year_id,
+        (SELECT AVG(g.grade) FROM Grades g
+         WHERE g.student_id = k.student_id AND g.academic_year_id = k.academic_year_id
+         AND g.exercise_slot NOT IN ('Exam.Jun', 'Exam.Sep')) AS lab_average,
+        (SELECT MAX(g.grade) FROM Grades g
+         WHERE g.student_id = k.student_id AND g.academic_year_id = k.academic_year_id
+         AND g.exercise_slot = 'Exam.Jun') AS jun_exam_grade,
+        (SELECT MAX(g.grade) FROM Grades g
+         WHERE g.student_id = k.student_id AND g.academic_year_id = k.academic_year_id
+         AND g.exercise_slot = 'Exam.Sep') AS sep_exam_grade
+    FROM (
+        SELECT DISTINCT student_id, academic_year_id FROM Enrollments
+        UNION ALL
+        SELECT o.student_id, o.academic_year_id FROM FinalGradeOverrides o
+        WHERE NOT EXISTS (
+            SELECT 1 FROM Enrollments e
+            WHERE e.student_id = o.student_id AND e.academic_year_id = o.academic_year_id
+        )
+    ) k
+'''
+
+FINAL_GRADES_VIEW = '''
+    CREATE VIEW IF NOT EXISTS FinalGrades AS
+    SELECT
+        student_id,
+        academic_year_id,
+        ROUND(lab_average, 2) AS lab_average,
+        jun_exam_grade,
+        sep_exam_grade,
+        CASE
+            WHEN lab_average IS NULL OR COALESCE(sep_exam_grade, jun_exam_grade) IS NULL THEN NULL
+            ELSE ROUND(lab_weight * lab_average + exam_weight * COALESCE(sep_exam_grade, jun_exam_grade), 2)
+        END AS final_grade,
+        overridden
+    FROM (
+        SELECT
+            gs.student_id,
+            gs.academic_year_id,
+            COALESCE(o.lab_average, gs.lab_average) AS lab_average,
+            COALESCE(o.jun_exam_grade, gs.jun_exam_grade) AS jun_exam_grade,
+            COALESCE(o.sep_exam_grade, gs.sep_exam_grade) AS sep_exam_grade,
+            COALESCE(p.lab_weight, 0.25) AS lab_weight,
+            COALESCE(p.exam_weight, 0.75) AS exam_weight,
+            o.student_id IS NOT NULL AS overridden
+        FROM GradeSummary gs
+        LEFT JOIN FinalGradeOverrides o
+            ON o.student_id = gs.student_id AND o.academic_year_id = gs.academic_year_id
+        LEFT JOIN GradingPolicies p ON p.academic_year_id = gs.academic_year_id
+    )
+'''
+
+
+@migration(7, 'Replace the FinalGrades table with views over Grades')
+def add_final_grade_views(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS GradingPolicies (
+            academic_year_id INTEGER PRIMARY KEY,
+            lab_weight REAL NOT NULL,
+            exam_weight REAL NOT NULL,
+            FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS FinalGradeOverrides (
+            student_id TEXT NOT NULL,
+            academic_year_id INTEGER NOT NULL,
+            lab_average REAL,
+            jun_exam_grade REAL,
+            sep_exam_grade REAL,
+            PRIMARY KEY (student_id, academic_year_id),
+            FOREIGN KEY(student_id) REFERENCES Students(student_id),
+            FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
+        )
+    ''')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_finalgradeoverrides_year ON FinalGradeOverrides (academic_year_id, student_id)'
+    )
+
+    stored = cursor.execute(
+        "SELECT type FROM sqlite_master WHERE name = 'FinalGrades'"
+    ).fetchone()
+    if stored and stored[0] == 'table':
+        cursor.execute(GRADE_SUMMARY_VIEW)
+        # Keep the stored values that differ from what the grades give: those were entered by hand
+        cursor.execute('''
+            INSERT OR IGNORE INTO FinalGradeOverrides
+            (student_id, academic_year_id, lab_average, jun_exam_grade, sep_exam_grade)
+            SELECT student_id, academic_year_id, lab, jun, sep FROM (
+                SELECT
+                    fg.student_id,
+                    fg.academic_year_id,
+                    CASE WHEN ABS(fg.lab_average - COALESCE(gs.lab_average, -1)) > 0.005 THEN fg.lab_average END AS lab,
+                    CASE WHEN fg.jun_exam_grade IS NOT gs.jun_exam_grade THEN fg.jun_exam_grade END AS jun,
+                    CASE WHEN fg.sep_exam_grade IS NOT gs.sep_exam_grade THEN fg.sep_exam_grade END AS sep
+                FROM FinalGrades fg
+                LEFT JOIN GradeSummary gs
+                    ON gs.student_id = fg.student_id AND gs.academic_year_id = fg.academic_year_id
+            )
+            WHERE lab IS NOT NULL OR jun IS NOT NULL OR sep IS NOT NULL
+        ''')
+        # The blueprint app stored 0.4 lab / 0.6 exam final grades: keep those
+        # weights for the years it computed, so their grades do not change
+        cursor.execute('''
+            INSERT OR IGNORE INTO GradingPolicies (academic_year_id, lab_weight, exam_weight)
+            SELECT academic_year_id, 0.4, 0.6 FROM (
+                SELECT
+                    academic_year_id,
+                    ABS(final_grade - (0.4 * lab_average + 0.6 * exam_grade)) < 0.005 AS blueprint,
+                    ABS(final_grade - (0.25 * lab_average + 0.75 * exam_grade)) < 0.005 AS shared
+                FROM (
+                    SELECT academic_year_id, final_grade, lab_average,
+                           COALESCE(sep_exam_grade, jun_exam_grade, 0) AS exam_grade
+                    FROM FinalGrades
+                    WHERE final_grade IS NOT NULL AND lab_average IS NOT NULL
+                )
+            )
+            GROUP BY academic_year_id
+            HAVING SUM(blueprint AND NOT shared) > 0 AND SUM(shared AND NOT blueprint) = 0
+        ''')
+        cursor.execute('DROP TABLE FinalGrades')
+
+    cursor.execute(GRADE_SUMMARY_VIEW)
+    cursor.execute(FINAL_GRADES_VIEW)
+
+
+# One row per session (academic year, lab slot, exercise slot) with its
+# attendance and grade totals, so the attendance and grade index pages page
+# through Sessions instead of grouping the fact tables. Writes adjust the
+# totals of their session; the few that cannot (a row that moves to another
+# session, or one that alone held a session's minimum, maximum or latest
+# timestamp) recount from the session's sheet, an index range. Sessions left
+# without rows are removed.
+SESSION_KEY = '''academic_year_id = {row}.academic_year_id
+            AND lab_slot_id = {row}.lab_slot_id AND exercise_slot = {row}.exercise_slot'''
+
+SAME_SESSION = '''OLD.academic_year_id IS NEW.academic_year_id
+    AND OLD.lab_slot_id IS NEW.lab_slot_id AND OLD.exercise_slot IS NEW.exercise_slot'''
+
+# Upserts rather than INSERT OR IGNORE: an outer INSERT OR REPLACE would
+# override OR IGNORE inside the trigger, but not an ON CONFLICT clause
+ADD_SESSION = '''
+        INSERT INTO Sessions (academic_year_id, lab_slot_id, exercise_slot)
+        VALUES ({row}.academic_year_id, {row}.lab_slot_id, {row}.exercise_slot)
+        ON CONFLICT (academic_year_id, lab_slot_id, exercise_slot) DO NOTHING;'''
+
+RECOUNT_SESSION_ATTENDANCE = '''
+        UPDATE Sessions SET (attendance_count, present_count, absent_count, attendance_updated) = (
+            SELECT COUNT(*), COUNT(CASE WHEN status = 'Present' THEN 1 END),
+                COUNT(CASE WHEN status = 'Absent' THEN 1 END), COALESCE(MAX(timestamp), '')
+            FROM Attendance WHERE {key}
+        ) WHERE {key};'''
+
+RECOUNT_SESSION_GRADES = '''
+        UPDATE Sessions SET
+            (grade_count, graded_count, grade_sum, grade_square_sum, min_grade, max_grade, grades_updated) = (
+            SELECT COUNT(*), COUNT(grade), COALESCE(SUM(grade), 0), COALESCE(SUM(grade * grade), 0),
+                MIN(grade), MAX(grade), COALESCE(MAX(timestamp), '')
+            FROM Grades WHERE {key}
+        ) WHERE {key};'''
+
+DROP_EMPTY_SESSION = '''
+        DELETE FROM Sessions WHERE {key} AND attendance_count = 0 AND grade_count = 0;'''
+
+
+def session_statements(template, *rows):
+    """Trigger body statements from a template above, once per NEW/OLD row."""
+    return ''.join(template.format(row=row, key=SESSION_KEY.format(row=row)) for row in rows)
+
+
+LATEST = "COALESCE(MAX(timestamp), '')"
+
+
+def _extreme(column, table, value, aggregate, new_wins=None):
+    # A session's latest timestamp or min/max grade once OLD left the session
+    # (and, on updates, NEW joined it). Rescanned only when OLD held the value
+    # alone; a tie, or NEW reaching past it, needs no scan.
+    new_case = f"WHEN {new_wins} THEN NEW.{value}\n                " if new_wins else ''
+    return f'''CASE
+                {new_case}WHEN OLD.{value} = {column} AND NOT EXISTS (
+                    SELECT 1 FROM {table} WHERE {SESSION_KEY.format(row='OLD')} AND {value} = OLD.{value}
+                ) THEN (SELECT {aggregate} FROM {table} WHERE {SESSION_KEY.format(row='OLD')})
+                ELSE {column}
+            END'''
+
+
+SESSION_TRIGGERS = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_attendance_session_insert AFTER INSERT ON Attendance
+    BEGIN
+        INSERT INTO Sessions (
+            academic_year_id, lab_slot_id, exercise_slot,
+            attendance_count, present_count, absent_count, attendance_updated
+        )
+        VALUES (
+            NEW.academic_year_id, NEW.lab_slot_id, NEW.exercise_slot,
+            1, NEW.status IS 'Present', NEW.status IS 'Absent', COALESCE(NEW.timestamp, '')
+        )
+        ON CONFLICT (academic_year_id, lab_slot_id, exercise_slot) DO UPDATE SET
+            attendance_count = attendance_count + 1,
+            present_count = present_count + excluded.present_count,
+            absent_count = absent_count + excluded.absent_count,
+            attendance_updated = MAX(attendance_updated, excluded.attendance_updated);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_attendance_session_delete AFTER DELETE ON Attendance
+    BEGIN
+        UPDATE Sessions SET
+            attendance_count = attendance_count - 1,
+            present_count = present_count - (OLD.status IS 'Present'),
+            absent_count = absent_count - (OLD.status IS 'Absent'),
+            attendance_updated = {_extreme('attendance_updated', 'Attendance', 'timestamp', LATEST)}
+        WHERE {SESSION_KEY.format(row='OLD')};{session_statements(DROP_EMPTY_SESSION, 'OLD')}
+    END
+    ''',
+    # Also fires for the DO UPDATE branch of the attendance upserts
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_attendance_session_update
+    AFTER UPDATE OF status, timestamp, academic_year_id, lab_slot_id, exercise_slot ON Attendance
+    WHEN {SAME_SESSION}
+    BEGIN
+        UPDATE Sessions SET
+            present_count = present_count - (OLD.status IS 'Present') + (NEW.status IS 'Present'),
+            absent_count = absent_count - (OLD.status IS 'Absent') + (NEW.status IS 'Absent'),
+            attendance_updated = {_extreme(
+                'attendance_updated', 'Attendance', 'timestamp', LATEST, 'NEW.timestamp >= attendance_updated'
+            )}
+        WHERE {SESSION_KEY.format(row='NEW')};
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_attendance_session_move
+    AFTER UPDATE OF academic_year_id, lab_slot_id, exercise_slot ON Attendance
+    WHEN NOT ({SAME_SESSION})
+    BEGIN{session_statements(ADD_SESSION, 'NEW')}{session_statements(RECOUNT_SESSION_ATTENDANCE, 'OLD', 'NEW')}{session_statements(DROP_EMPTY_SESSION, 'OLD')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_grades_session_insert AFTER INSERT ON Grades
+    BEGIN
+        INSERT INTO Sessions (
+            academic_year_id, lab_slot_id, exercise_slot, grade_count, graded_count,
+            grade_sum, grade_square_sum, min_grade, max_grade, grades_updated
+        )
+        VALUES (
+            NEW.academic_year_id, NEW.lab_slot_id, NEW.exercise_slot, 1, NEW.grade IS NOT NULL,
+            COALESCE(NEW.grade, 0), COALESCE(NEW.grade * NEW.grade, 0), NEW.grade, NEW.grade,
+            COALESCE(NEW.timestamp, '')
+        )
+        ON CONFLICT (academic_year_id, lab_slot_id, exercise_slot) DO UPDATE SET
+            grade_count = grade_count + 1,
+            graded_count = graded_count + excluded.graded_count,
+            grade_sum = grade_sum + excluded.grade_sum,
+            grade_square_sum = grade_square_sum + excluded.grade_square_sum,
+            min_grade = COALESCE(MIN(min_grade, excluded.min_grade), min_grade, excluded.min_grade),
+            max_grade = COALESCE(MAX(max_grade, excluded.max_grade), max_grade, excluded.max_grade),
+            grades_updated = MAX(grades_updated, excluded.grades_updated);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_grades_session_delete AFTER DELETE ON Grades
+    BEGIN
+        UPDATE Sessions SET
+            grade_count = grade_count - 1,
+            graded_count = graded_count - (OLD.grade IS NOT NULL),
+            grade_sum = grade_sum - COALESCE(OLD.grade, 0),
+            grade_square_sum = grade_square_sum - COALESCE(OLD.grade * OLD.grade, 0),
+            min_grade = {_extreme('min_grade', 'Grades', 'grade', 'MIN(grade)')},
+            max_grade = {_extreme('max_grade', 'Grades', 'grade', 'MAX(grade)')},
+            grades_updated = {_extreme('grades_updated', 'Grades', 'timestamp', LATEST)}
+        WHERE {SESSION_KEY.format(row='OLD')};{session_statements(DROP_EMPTY_SESSION, 'OLD')}
+    END
+    ''',
+    # Also fires for the DO UPDATE branch of the grade upserts
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_grades_session_update
+    AFTER UPDATE OF grade, timestamp, academic_year_id, lab_slot_id, exercise_slot ON Grades
+    WHEN {SAME_SESSION}
+    BEGIN
+        UPDATE Sessions SET
+            graded_count = graded_count - (OLD.grade IS NOT NULL) + (NEW.grade IS NOT NULL),
+            grade_sum = grade_sum - COALESCE(OLD.grade, 0) + COALESCE(NEW.grade, 0),
+            grade_square_sum = grade_square_sum - COALESCE(OLD.grade * OLD.grade, 0) + COALESCE(NEW.grade * NEW.grade, 0),
+            min_grade = {_extreme('min_grade', 'Grades', 'grade', 'MIN(grade)', 'NEW.grade <= min_grade OR min_grade IS NULL')},
+            max_grade = {_extreme('max_grade', 'Grades', 'grade', 'MAX(grade)', 'NEW.grade >= max_grade OR max_grade IS NULL')},
+            grades_updated = {_extreme('grades_updated', 'Grades', 'timestamp', LATEST, 'NEW.timestamp >= grades_updated')}
+        WHERE {SESSION_KEY.format(row='NEW')};
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_grades_session_move
+    AFTER UPDATE OF academic_year_id, lab_slot_id, exercise_slot ON Grades
+    WHEN NOT ({SAME_SESSION})
+    BEGIN{session_statements(ADD_SESSION, 'NEW')}{session_statements(RECOUNT_SESSION_GRADES, 'OLD', 'NEW')}{session_statements(DROP_EMPTY_SESSION, 'OLD')}
+    END
+    ''',
+]
+
+# The index pages read these backwards, newest session first; each partial
+# index only holds the sessions that have rows of its kind
+SESSION_INDEXES = [
+    '''
+    CREATE INDEX IF NOT EXISTS idx_sessions_attendance
+    ON Sessions (attendance_updated, academic_year_id, lab_slot_id, exercise_slot) WHERE attendance_count > 0
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_sessions_grades
+    ON Sessions (grades_updated, academic_year_id, lab_slot_id, exercise_slot) WHERE grade_count > 0
+    ''',
+]
+
+
+def rebuild_sessions(cursor):
+    """Recount Sessions from Attendance and Grades."""
+    cursor.execute('DELETE FROM Sessions')
+    cursor.execute('''
+        INSERT INTO Sessions (academic_year_id, lab_slot_id, exercise_slot)
+        SELECT academic_year_id, lab_slot_id, exercise_slot FROM Attendance
+        UNION
+        SELECT academic_year_id, lab_slot_id, exercise_slot FROM Grades
+    ''')
+    key = SESSION_KEY.format(row='Sessions')
+    cursor.execute(RECOUNT_SESSION_ATTENDANCE.format(key=key))
+    cursor.execute(RECOUNT_SESSION_GRADES.format(key=key))
+
+
+@migration(8, 'Add trigger-maintained Sessions')
+def add_sessions(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Sessions (
+            academic_year_id INTEGER NOT NULL,
+            lab_slot_id INTEGER NOT NULL,
+            exercise_slot TEXT NOT NULL,
+            attendance_count INTEGER NOT NULL DEFAULT 0,
+            present_count INTEGER NOT NULL DEFAULT 0,
+            absent_count INTEGER NOT NULL DEFAULT 0,
+            attendance_updated TEXT NOT NULL DEFAULT '',
+            grade_count INTEGER NOT NULL DEFAULT 0,
+            graded_count INTEGER NOT NULL DEFAULT 0,
+            grade_sum REAL NOT NULL DEFAULT 0,
+            grade_square_sum REAL NOT NULL DEFAULT 0,
+            min_grade REAL,
+            max_grade REAL,
+            grades_updated TEXT NOT NULL DEFAULT '',
+            PRIMARY KEY (academic_year_id, lab_slot_id, exercise_slot),
+            FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id),
+            FOREIGN KEY(lab_slot_id) REFERENCES LabSlots(id)
+        )
+    ''')
+    for statement in SESSION_TRIGGERS + SESSION_INDEXES:
+        cursor.execute(statement)
+    rebuild_sessions(cursor)
+
+
+CURRENT_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, verbose=False):
+    """Apply all pending migrations in one transaction and return the new version."""
+    current = schema_version(conn)
+    pending = [m for m in MIGRATIONS if m[0] > current]
+    if not pending:
+        return current
+
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        # Another process may have migrated while we waited for the write lock
+        current = schema_version(conn)
+        for version, description, func in pending:
+            if version <= current:
+                continue
+            if verbose:
+                print(f"Applying migration {version}: {description}")
+            func(cursor)
+        cursor.execute(f'PRAGMA user_version = {CURRENT_VERSION}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return CURRENT_VERSION
+
+
+class SchemaCapabilities:
+    """Snapshot of the columns each table has, read once with PRAGMA table_info."""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    @classmethod
+    def inspect(cls, conn):
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        ).fetchall()]
+        cursor = conn.cursor()
+        return cls({table: frozenset(table_columns(cursor, table)) for table in tables})
+
+    def has_table(self, table):
+        return table in self.columns
+
+    def has_column(self, table, column):
+        return column in self.columns.get(table, ())
+
+    def column_or_null(self, table, alias, column):
+        """SQL select expression for an optional column, NULL when it is missing."""
+        if self.has_column(table, column):
+            return f'{alias}.{column}'
+        return f'NULL AS {column}'
+
+    @property
+    def replenishment_notes(self):
+        return self.has_column('Attendance', 'replenishment_note')
+
+
+if __name__ == '__main__':
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'student_register.db'
+    conn = sqlite3.connect(db_path)
+    before = schema_version(conn)
+    after = migrate(conn, verbose=True)
+    conn.close()
+    print(f"Schema version: {before} -> {after}")
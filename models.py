@@ -1,7 +1,11 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, create_engine
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index, create_engine
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, scoped_session, sessionmaker
+from contextlib import closing
 from datetime import datetime
+import sqlite3
+from migrations import migrate
 
 # Create engine and session
 engine = create_engine('sqlite:///student_register.db')
@@ -82,6 +86,7 @@ class Enrollment(Base):
 
 class StudentTeam(Base):
     __tablename__ = 'StudentTeams'
+    __table_args__ = (Index('uq_teams_student', 'student_id', 'lab_slot_id', unique=True),)
     id = Column(Integer, primary_key=True, autoincrement=True)
     team_number = Column(Integer)
     student_id = Column(String(20), ForeignKey('Students.student_id'))
@@ -89,6 +94,9 @@ class StudentTeam(Base):
 
 class Attendance(Base):
     __tablename__ = 'Attendance'
+    __table_args__ = (
+        Index('uq_attendance_sheet', 'lab_slot_id', 'academic_year_id', 'exercise_slot', 'student_id', unique=True),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     student_id = Column(String(20), ForeignKey('Students.student_id'))
     lab_slot_id = Column(Integer, ForeignKey('LabSlots.id'))
@@ -99,6 +107,9 @@ class Attendance(Base):
 
 class Grade(Base):
     __tablename__ = 'Grades'
+    __table_args__ = (
+        Index('uq_grades_sheet', 'lab_slot_id', 'academic_year_id', 'exercise_slot', 'student_id', unique=True),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     student_id = Column(String(20), ForeignKey('Students.student_id'))
     lab_slot_id = Column(Integer, ForeignKey('LabSlots.id'))
@@ -108,17 +119,48 @@ class Grade(Base):
     academic_year_id = Column(Integer, ForeignKey('AcademicYear.id'))
 
 class FinalGrade(Base):
+    # Read-only: the FinalGrades view computes these from Grades (see grading.py)
     __tablename__ = 'FinalGrades'
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    student_id = Column(String(20), ForeignKey('Students.student_id'))
+    __table_args__ = {'info': {'is_view': True}}
+    student_id = Column(String(20), ForeignKey('Students.student_id'), primary_key=True)
+    academic_year_id = Column(Integer, ForeignKey('AcademicYear.id'), primary_key=True)
     lab_average = Column(Float)
     jun_exam_grade = Column(Float)
     sep_exam_grade = Column(Float)
     final_grade = Column(Float)
-    academic_year_id = Column(Integer, ForeignKey('AcademicYear.id'))
+    overridden = Column(Integer)
+
+class FinalGradeOverride(Base):
+    __tablename__ = 'FinalGradeOverrides'
+    __table_args__ = (Index('idx_finalgradeoverrides_year', 'academic_year_id', 'student_id'),)
+    student_id = Column(String(20), ForeignKey('Students.student_id'), primary_key=True)
+    academic_year_id = Column(Integer, ForeignKey('AcademicYear.id'), primary_key=True)
+    lab_average = Column(Float)
+    jun_exam_grade = Column(Float)
+    sep_exam_grade = Column(Float)
+
+class GradingPolicy(Base):
+    __tablename__ = 'GradingPolicies'
+    academic_year_id = Column(Integer, ForeignKey('AcademicYear.id'), primary_key=True)
+    lab_weight = Column(Float, nullable=False)
+    exam_weight = Column(Float, nullable=False)
+
+def upsert(model, rows, key, update):
+    """INSERT ... ON CONFLICT (key) DO UPDATE for a batch of row dicts."""
+    if not rows:
+        return
+    stmt = sqlite_insert(model).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=key,
+        set_={column: stmt.excluded[column] for column in update}
+    )
+    db_session.execute(stmt)
 
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    # The schema, its views, summary tables and triggers come from the shared
+    # versioned migrations, like the other apps using this database
+    with closing(sqlite3.connect(engine.url.database)) as conn:
+        migrate(conn)
 
 def shutdown_session():
     db_session.remove() 
\ No newline at end of file
@@ -0,0 +1,366 @@
+"""
+Named SQL statements for the Lab Database web application.
+
+Handlers run statements by name through `named_query`, `named_modify` and
+`named_many` in simple_app.py, so every query shape exists once, is reused
+from each connection's statement cache and has its latency recorded under
+its name (see /api/db/query_stats/).
+"""
+import threading
+
+from grade_stats import GRADE_AGGREGATES
+from grading import GRADING_POLICY_QUERY, SET_GRADING_POLICY, SAVE_FINAL_GRADE_OVERRIDE, PRUNE_FINAL_GRADE_OVERRIDE
+
+# One row per (academic year, lab slot) with the counts the dashboard shows,
+# read from the trigger-maintained LabSlotStats table
+_DASHBOARD_LAB_SLOTS = '''
+    SELECT
+        y.id AS academic_year_id,
+        y.semester,
+        y.year,
+        l.id,
+        l.name,
+        COALESCE(ls.student_count, 0) AS student_count,
+        COALESCE(ls.absences_count, 0) AS absences_count,
+        COALESCE(ls.team_count, 0) AS team_count
+    FROM AcademicYear y
+    LEFT JOIN LabSlots l ON l.academic_year_id = y.id
+    LEFT JOIN LabSlotStats ls ON ls.lab_slot_id = l.id
+    {year_filter}
+    ORDER BY y.year, y.semester, l.name
+'''
+
+# One keyset page of the trigger-maintained Sessions rows that have
+# attendance or grades, newest first; the _before variants continue after the
+# last row of the previous page
+_SESSION_PAGE = '''
+    SELECT
+        s.academic_year_id,
+        s.lab_slot_id,
+        s.exercise_slot,
+        s.{kind}_updated AS timestamp,
+        ac.semester || ' ' || ac.year AS academic_year_name,
+        l.name AS lab_slot_name,
+        {columns}
+    FROM Sessions s
+    JOIN AcademicYear ac ON s.academic_year_id = ac.id
+    JOIN LabSlots l ON s.lab_slot_id = l.id
+    WHERE s.{count} > 0 {after}
+    ORDER BY s.{kind}_updated DESC, s.academic_year_id DESC, s.lab_slot_id DESC, s.exercise_slot DESC
+    LIMIT :limit
+'''
+
+_SESSION_AFTER = '''AND (s.{kind}_updated, s.academic_year_id, s.lab_slot_id, s.exercise_slot)
+        < (:before_updated, :before_academic_year_id, :before_lab_slot_id, :before_exercise_slot)'''
+
+_ATTENDANCE_SESSION_COLUMNS = 's.present_count, s.absent_count'
+
+# Same names as the GRADE_AGGREGATES columns, without the histogram
+_GRADE_SESSION_COLUMNS = '''s.graded_count,
+        s.grade_sum / s.graded_count AS average_grade,
+        s.min_grade,
+        s.max_grade,
+        s.grade_square_sum / s.graded_count AS mean_square'''
+
+
+def _session_page(kind, count, columns, after=False):
+    return _SESSION_PAGE.format(
+        kind=kind, count=count, columns=columns,
+        after=_SESSION_AFTER.format(kind=kind) if after else ''
+    )
+
+
+QUERIES = {
+    # Lookups
+    'academic_year': 'SELECT id, semester, year FROM AcademicYear WHERE id = ?',
+    'academic_years': 'SELECT id, semester, year FROM AcademicYear ORDER BY year, semester',
+    'lab_slot': 'SELECT id, name FROM LabSlots WHERE id = ?',
+    'lab_slots_for_year': 'SELECT id, name FROM LabSlots WHERE academic_year_id = ? ORDER BY name',
+    'lab_slot_stats': '''
+        SELECT student_count, absences_count, team_count, team_member_count
+        FROM LabSlotStats WHERE lab_slot_id = ?
+    ''',
+
+    # Rosters; params: lab_slot_id, academic_year_id
+    'lab_roster': '''
+        SELECT s.student_id
+        FROM Students s
+        JOIN Enrollments e ON s.student_id = e.student_id
+        WHERE e.lab_slot_id = ? AND e.academic_year_id = ?
+        ORDER BY s.name
+    ''',
+    # params: academic_year_id
+    'year_roster': '''
+        SELECT DISTINCT s.student_id
+        FROM Students s
+        JOIN Enrollments e ON s.student_id = e.student_id
+        WHERE e.academic_year_id = ?
+    ''',
+    # params: lab_slot_id, lab_slot_id, academic_year_id
+    'lab_roster_with_teams': '''
+        SELECT
+            s.student_id,
+            s.name,
+            s.email,
+            s.username,
+            st.team_number
+        FROM
+            Students s
+        JOIN
+            Enrollments e ON s.student_id = e.student_id
+        LEFT JOIN
+            StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
+        WHERE
+            e.lab_slot_id = ? AND e.academic_year_id = ?
+        ORDER BY
+            st.team_number, s.name
+    ''',
+    # Roster x grades of one lab slot, one row per (student, grade); named params
+    'grade_matrix': '''
+        SELECT
+            s.student_id,
+            s.name,
+            s.email,
+            s.username,
+            st.team_number,
+            COALESCE(ab.absences, 0) AS absences,
+            g.exercise_slot,
+            g.grade,
+            g.timestamp
+        FROM
+            Students s
+        JOIN
+            Enrollments e ON s.student_id = e.student_id
+        LEFT JOIN
+            StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = e.lab_slot_id
+        LEFT JOIN (
+            SELECT student_id, COUNT(*) AS absences
+            FROM Attendance
+            WHERE lab_slot_id = :lab_slot_id AND academic_year_id = :academic_year_id AND status = 'Absent'
+            GROUP BY student_id
+        ) ab ON ab.student_id = s.student_id
+        -- Unary + keeps the planner on idx_grades_student (one student's grades)
+        -- instead of rescanning the whole sheet index for every student
+        LEFT JOIN
+            Grades g ON g.student_id = s.student_id
+            AND +g.lab_slot_id = e.lab_slot_id AND g.academic_year_id = e.academic_year_id
+        WHERE
+            e.lab_slot_id = :lab_slot_id AND e.academic_year_id = :academic_year_id
+        ORDER BY
+            st.team_number, s.name
+    ''',
+
+    # Sheets; params: lab_slot_id, lab_slot_id, exercise_slot, academic_year_id, lab_slot_id, academic_year_id
+    'attendance_sheet': '''
+        SELECT
+            s.student_id,
+            s.name,
+            st.team_number,
+            COALESCE(a.status, 'Present') as status
+        FROM
+            Students s
+        JOIN
+            Enrollments e ON s.student_id = e.student_id
+        LEFT JOIN
+            StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
+        LEFT JOIN
+            Attendance a ON s.student_id = a.student_id AND a.lab_slot_id = ? AND a.exercise_slot = ? AND a.academic_year_id = ?
+        WHERE
+            e.lab_slot_id = ? AND e.academic_year_id = ?
+        ORDER BY
+            st.team_number, s.name
+    ''',
+    'grade_sheet': '''
+        SELECT
+            s.student_id,
+            s.name,
+            st.team_number,
+            g.grade
+        FROM
+            Students s
+        JOIN
+            Enrollments e ON s.student_id = e.student_id
+        LEFT JOIN
+            StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
+        LEFT JOIN
+            Grades g ON s.student_id = g.student_id AND g.lab_slot_id = ? AND g.exercise_slot = ? AND g.academic_year_id = ?
+        WHERE
+            e.lab_slot_id = ? AND e.academic_year_id = ?
+        ORDER BY
+            st.team_number, s.name
+    ''',
+    # Stored value per student; params: lab_slot_id, exercise_slot, academic_year_id
+    'attendance_sheet_values': '''
+        SELECT student_id, status AS value FROM Attendance
+        WHERE lab_slot_id = ? AND exercise_slot = ? AND academic_year_id = ?
+    ''',
+    'session_attendance_counts': '''
+        SELECT present_count, absent_count FROM Sessions
+        WHERE academic_year_id = ? AND lab_slot_id = ? AND exercise_slot = ?
+    ''',
+    'grade_sheet_values': '''
+        SELECT student_id, grade AS value FROM Grades
+        WHERE lab_slot_id = ? AND exercise_slot = ? AND academic_year_id = ?
+    ''',
+
+    # Dashboard
+    'dashboard_lab_slots': _DASHBOARD_LAB_SLOTS.format(year_filter=''),
+    # params: academic_year_id
+    'dashboard_lab_slots_for_year': _DASHBOARD_LAB_SLOTS.format(year_filter='WHERE y.id = ?'),
+    'dashboard_students': 'SELECT COUNT(*) AS count FROM Students',
+    # params: academic_year_id
+    'dashboard_students_for_year': '''
+        SELECT COUNT(DISTINCT student_id) AS count FROM Enrollments WHERE academic_year_id = ?
+    ''',
+    'dashboard_grades': f'''
+        SELECT {GRADE_AGGREGATES} FROM Grades g
+    ''',
+    'dashboard_grades_for_year': f'''
+        SELECT {GRADE_AGGREGATES} FROM Grades g WHERE g.academic_year_id = ?
+    ''',
+    # Attendance and grade index pages
+    'attendance_sessions': _session_page('attendance', 'attendance_count', _ATTENDANCE_SESSION_COLUMNS),
+    'attendance_sessions_before': _session_page(
+        'attendance', 'attendance_count', _ATTENDANCE_SESSION_COLUMNS, after=True
+    ),
+    'grade_sessions': _session_page('grades', 'grade_count', _GRADE_SESSION_COLUMNS),
+    'grade_sessions_before': _session_page('grades', 'grade_count', _GRADE_SESSION_COLUMNS, after=True),
+
+    # Analytics; one row per (academic year, lab slot, exercise slot) that has attendance or grades
+    'exercise_trends': '''
+        WITH attendance_cells AS (
+            SELECT
+                academic_year_id, lab_slot_id, exercise_slot,
+                COUNT(*) AS records,
+                SUM(status = 'Absent') AS absences
+            FROM Attendance
+            GROUP BY academic_year_id, lab_slot_id, exercise_slot
+        ),
+        grade_cells AS (
+            SELECT
+                academic_year_id, lab_slot_id, exercise_slot,
+                COUNT(grade) AS graded,
+                SUM(grade) AS grade_total
+            FROM Grades
+            GROUP BY academic_year_id, lab_slot_id, exercise_slot
+        ),
+        cells AS (
+            SELECT academic_year_id, lab_slot_id, exercise_slot FROM attendance_cells
+            UNION
+            SELECT academic_year_id, lab_slot_id, exercise_slot FROM grade_cells
+        )
+        SELECT
+            y.id AS academic_year_id,
+            y.semester,
+            y.year,
+            c.lab_slot_id,
+            l.name AS lab_slot_name,
+            c.exercise_slot,
+            COALESCE(a.records, 0) AS records,
+            COALESCE(a.absences, 0) AS absences,
+            COALESCE(g.graded, 0) AS graded,
+            COALESCE(g.grade_total, 0) AS grade_total
+        FROM cells c
+        JOIN AcademicYear y ON y.id = c.academic_year_id
+        LEFT JOIN LabSlots l ON l.id = c.lab_slot_id
+        LEFT JOIN attendance_cells a
+            ON a.academic_year_id = c.academic_year_id AND a.lab_slot_id = c.lab_slot_id AND a.exercise_slot = c.exercise_slot
+        LEFT JOIN grade_cells g
+            ON g.academic_year_id = c.academic_year_id AND g.lab_slot_id = c.lab_slot_id AND g.exercise_slot = c.exercise_slot
+    ''',
+
+    # Final grades from the FinalGrades view (always current, overrides applied)
+    'final_grade_sheet': '''
+        SELECT
+            s.student_id,
+            s.name,
+            fg.lab_average,
+            fg.jun_exam_grade,
+            fg.sep_exam_grade,
+            fg.final_grade,
+            fg.overridden
+        FROM FinalGrades fg
+        JOIN Students s ON s.student_id = fg.student_id
+        WHERE fg.academic_year_id = ?
+        ORDER BY s.name
+    ''',
+    'final_grade': '''
+        SELECT lab_average, jun_exam_grade, sep_exam_grade, final_grade, overridden
+        FROM FinalGrades
+        WHERE student_id = ? AND academic_year_id = ?
+    ''',
+    # Named params, see grading.py
+    'grading_policy': GRADING_POLICY_QUERY,
+
+    # Writes
+    'upsert_attendance': '''
+        INSERT INTO Attendance
+        (student_id, lab_slot_id, exercise_slot, status, timestamp, academic_year_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (student_id, lab_slot_id, exercise_slot, academic_year_id)
+        DO UPDATE SET status = excluded.status, timestamp = excluded.timestamp
+    ''',
+    'update_replenishment_note': 'UPDATE Attendance SET replenishment_note = ? WHERE id = ?',
+    'upsert_grade': '''
+        INSERT INTO Grades
+        (student_id, lab_slot_id, exercise_slot, grade, timestamp, academic_year_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (student_id, lab_slot_id, exercise_slot, academic_year_id)
+        DO UPDATE SET grade = excluded.grade, timestamp = excluded.timestamp
+    ''',
+    'delete_grade': '''
+        DELETE FROM Grades
+        WHERE student_id = ? AND lab_slot_id = ? AND exercise_slot = ? AND academic_year_id = ?
+    ''',
+    'set_grading_policy': SET_GRADING_POLICY,
+    'save_final_grade_override': SAVE_FINAL_GRADE_OVERRIDE,
+    'prune_final_grade_override': PRUNE_FINAL_GRADE_OVERRIDE,
+    'insert_team': 'INSERT INTO StudentTeams (team_number, student_id, lab_slot_id) VALUES (?, ?, ?)',
+    'upsert_team': '''
+        INSERT INTO StudentTeams (team_number, student_id, lab_slot_id) VALUES (?, ?, ?)
+        ON CONFLICT (student_id, lab_slot_id) DO UPDATE SET team_number = excluded.team_number
+    ''',
+    'delete_team': 'DELETE FROM StudentTeams WHERE student_id = ? AND lab_slot_id = ?',
+    'delete_lab_teams': 'DELETE FROM StudentTeams WHERE lab_slot_id = ?',
+}
+
+# Room for every registered statement plus the remaining inline queries
+CACHED_STATEMENTS = max(128, 2 * len(QUERIES))
+
+
+class QueryStats:
+    """Per-worker latency totals for named queries."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name, seconds):
+        with self._lock:
+            entry = self._stats.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+            entry['count'] += 1
+            entry['total'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+
+    def snapshot(self):
+        """Latency per query name, slowest total first."""
+        with self._lock:
+            items = [(name, dict(entry)) for name, entry in self._stats.items()]
+        items.sort(key=lambda item: item[1]['total'], reverse=True)
+        return [
+            {
+                'name': name,
+                'count': entry['count'],
+                'total_ms': round(entry['total'] * 1000, 3),
+                'avg_ms': round(entry['total'] * 1000 / entry['count'], 3),
+                'max_ms': round(entry['max'] * 1000, 3),
+            }
+            for name, entry in items
+        ]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+query_stats = QueryStats()
@@ -0,0 +1,143 @@
+"""
+Read-side queries for the routes/* blueprints.
+
+Each function loads everything one page needs with a fixed number of SQL
+statements (joined queries grouped in Python, or selectinload for
+relationships) instead of querying once per year, team, student or
+exercise slot.
+"""
+from collections import OrderedDict
+
+from sqlalchemy.orm import selectinload
+
+from models import db_session, AcademicYear, LabSlot, Student, Enrollment, StudentTeam, Attendance, Grade
+
+
+def lab_slots_by_year(academic_year_id=None):
+    """{'<semester> <year>': [LabSlot, ...]} for one academic year or all of them (2 statements)."""
+    query = AcademicYear.query.options(selectinload(AcademicYear.lab_slots))
+    if academic_year_id:
+        query = query.filter(AcademicYear.id == academic_year_id)
+    return OrderedDict((str(year), year.lab_slots) for year in query.all())
+
+
+def lab_slots_by_id(lab_slot_ids):
+    """Lab slots keyed by id, in the order of `lab_slot_ids`; unknown ids are skipped."""
+    if not lab_slot_ids:
+        return OrderedDict()
+    found = {slot.id: slot for slot in LabSlot.query.filter(LabSlot.id.in_(lab_slot_ids)).all()}
+    return OrderedDict((lab_id, found[lab_id]) for lab_id in lab_slot_ids if lab_id in found)
+
+
+def enrolled_students(academic_year_id, lab_slot_ids):
+    """{lab_slot_id: [Student, ...]} ordered by name, for several lab slots in one statement."""
+    students = {lab_id: [] for lab_id in lab_slot_ids}
+    if not lab_slot_ids:
+        return students
+    rows = db_session.query(Enrollment.lab_slot_id, Student).join(
+        Student,
+        Student.student_id == Enrollment.student_id
+    ).filter(
+        Enrollment.academic_year_id == academic_year_id,
+        Enrollment.lab_slot_id.in_(lab_slot_ids)
+    ).order_by(
+        Student.name
+    ).all()
+    for lab_id, student in rows:
+        students[lab_id].append(student)
+    return students
+
+
+def teams_by_lab(lab_slot_ids):
+    """{lab_slot_id: [(team_number, [Student, ...]), ...]} ordered by team and name (1 statement)."""
+    teams = {lab_id: OrderedDict() for lab_id in lab_slot_ids}
+    if not lab_slot_ids:
+        return teams
+    rows = db_session.query(StudentTeam.lab_slot_id, StudentTeam.team_number, Student).join(
+        Student,
+        Student.student_id == StudentTeam.student_id
+    ).filter(
+        StudentTeam.lab_slot_id.in_(lab_slot_ids)
+    ).order_by(
+        StudentTeam.team_number,
+        Student.name
+    ).all()
+    for lab_id, team_number, student in rows:
+        teams[lab_id].setdefault(team_number, []).append(student)
+    return {lab_id: list(lab_teams.items()) for lab_id, lab_teams in teams.items()}
+
+
+def grade_sheets(academic_year_id, lab_slot_ids):
+    """Per lab slot, the graded exercise slots and (Student, {slot: grade}, average) rows (2 statements).
+
+    The exercise slots are every slot graded in the lab slot and year, also
+    those whose only grades belong to students no longer enrolled there. The
+    roster is outer-joined to its grades, so the whole student x exercise
+    matrix arrives in one result and the averages are summed in the same pass.
+    """
+    exercise_slots = {lab_id: set() for lab_id in lab_slot_ids}
+    students = {lab_id: OrderedDict() for lab_id in lab_slot_ids}
+    if lab_slot_ids:
+        for lab_id, exercise_slot in db_session.query(Grade.lab_slot_id, Grade.exercise_slot).filter(
+            Grade.academic_year_id == academic_year_id,
+            Grade.lab_slot_id.in_(lab_slot_ids)
+        ).distinct().all():
+            exercise_slots[lab_id].add(exercise_slot)
+
+        rows = db_session.query(Enrollment.lab_slot_id, Student, Grade.exercise_slot, Grade.grade).join(
+            Student,
+            Student.student_id == Enrollment.student_id
+        ).outerjoin(
+            Grade,
+            (Grade.student_id == Enrollment.student_id) &
+            (Grade.lab_slot_id == Enrollment.lab_slot_id) &
+            (Grade.academic_year_id == Enrollment.academic_year_id)
+        ).filter(
+            Enrollment.academic_year_id == academic_year_id,
+            Enrollment.lab_slot_id.in_(lab_slot_ids)
+        ).order_by(
+            Student.name
+        ).all()
+        for lab_id, student, exercise_slot, grade in rows:
+            # [student, {slot: grade}, sum, count]
+            entry = students[lab_id].setdefault(student.student_id, [student, {}, 0.0, 0])
+            if exercise_slot is None:
+                continue
+            entry[1][exercise_slot] = grade
+            if grade is not None:
+                entry[2] += grade
+                entry[3] += 1
+
+    return {
+        lab_id: {
+            'exercise_slots': sorted(exercise_slots[lab_id]),
+            'students': [
+                (student, grades, total / count if count else None)
+                for student, grades, total, count in students[lab_id].values()
+            ]
+        }
+        for lab_id in lab_slot_ids
+    }
+
+
+def attendance_sheets(academic_year_id, lab_slot_ids, exercise_slots):
+    """Per lab slot, (Student, {slot: status}, absences) rows for the given exercise slots (2 statements)."""
+    students = enrolled_students(academic_year_id, lab_slot_ids)
+    statuses = {lab_id: {} for lab_id in lab_slot_ids}
+    if lab_slot_ids and exercise_slots:
+        for record in Attendance.query.filter(
+            Attendance.academic_year_id == academic_year_id,
+            Attendance.lab_slot_id.in_(lab_slot_ids),
+            Attendance.exercise_slot.in_(exercise_slots)
+        ).all():
+            statuses[record.lab_slot_id].setdefault(record.student_id, {})[record.exercise_slot] = record.status
+
+    sheets = {}
+    for lab_id in lab_slot_ids:
+        rows = []
+        for student in students[lab_id]:
+            attendance_by_slot = statuses[lab_id].get(student.student_id, {})
+            absences = sum(1 for status in attendance_by_slot.values() if status == 'Absent')
+            rows.append((student, attendance_by_slot, absences))
+        sheets[lab_id] = rows
+    return sheets
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
-from models import db_session, db, AcademicYear, LabSlot, Student, Enrollment, StudentTeam, Attendance
+from models import db_session, db, upsert, AcademicYear, LabSlot, Student, Enrollment, StudentTeam, Attendance
 from datetime import datetime
+import repository
 
 attendance_blueprint = Blueprint('attendance', __name__)
 
@@ -47,31 +48,24 @@ def record(academic_year_id):
         # Save attendance
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        for student_id, status in zip(student_ids, statuses):
-            # Check if attendance record already exists
-            attendance = Attendance.query.filter_by(
-                student_id=student_id,
-                lab_slot_id=selected_lab_id,
-                exercise_slot=exercise_slot,
-                academic_year_id=academic_year_id
-            ).first()
-            
-            if attendance:
-                # Update existing record
-                attendance.status = status
-                attendance.timestamp = timestamp
-            else:
-                # Create new record
-                attendance = Attendance(
-                    student_id=student_id,
-                    lab_slot_id=selected_lab_id,
-                    exercise_slot=exercise_slot,
-                    status=status,
-                    timestamp=timestamp,
-                    academic_year_id=academic_year_id
-                )
-                db.session.add(attendance)
+        rows = [
+            {
+                'student_id': student_id,
+                'lab_slot_id': selected_lab_id,
+                'exercise_slot': exercise_slot,
+                'status': status,
+                'timestamp': timestamp,
+                'academic_year_id': academic_year_id
+            }
+            for student_id, status in zip(student_ids, statuses)
+        ]
         
+        # Insert or update the whole sheet in one statement
+        upsert(
+            Attendance, rows,
+            key=['student_id', 'lab_slot_id', 'exercise_slot', 'academic_year_id'],
+            update=['status', 'timestamp']
+        )
         db.session.commit()
         flash('Attendance records saved successfully', 'success')
         return redirect(url_for(
@@ -145,50 +139,10 @@ def show(academic_year_id):
     if not selected_exercise_slots:
         selected_exercise_slots = exercise_slots
     
-    # Get attendance records
-    attendance_data = {}
-    
-    for lab_id in selected_lab_ids:
-        lab_slot = LabSlot.query.get(lab_id)
-        
-        if lab_slot:
-            # Get students for this lab slot
-            students = db.session.query(
-                Student
-            ).join(
-                Enrollment,
-                Student.student_id == Enrollment.student_id
-            ).filter(
-                Enrollment.academic_year_id == academic_year_id,
-                Enrollment.lab_slot_id == lab_id
-            ).order_by(
-                Student.name
-            ).all()
-            
-            # Get attendance for each student
-            students_with_attendance = []
-            
-            for student in students:
-                # Get attendance records for this student
-                attendance_records = Attendance.query.filter(
-                    Attendance.student_id == student.student_id,
-                    Attendance.academic_year_id == academic_year_id,
-                    Attendance.lab_slot_id == lab_id,
-                    Attendance.exercise_slot.in_(selected_exercise_slots)
-                ).all()
-                
-                # Create a dictionary of exercise_slot -> status
-                attendance_by_slot = {
-                    record.exercise_slot: record.status
-                    for record in attendance_records
-                }
-                
-                # Count absences
-                absences = sum(1 for record in attendance_records if record.status == 'Absent')
-                
-                students_with_attendance.append((student, attendance_by_slot, absences))
-            
-            attendance_data[lab_slot.name] = students_with_attendance
+    # Get attendance (exercise_slot -> status) and absences of every student for each lab slot
+    selected_labs = repository.lab_slots_by_id(selected_lab_ids)
+    sheets = repository.attendance_sheets(academic_year_id, list(selected_labs), selected_exercise_slots)
+    attendance_data = {lab_slot.name: sheets[lab_id] for lab_id, lab_slot in selected_labs.items()}
     
     return render_template(
         'attendance/show.html',
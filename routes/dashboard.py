@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, request
 from models import db_session, db, AcademicYear, LabSlot, Student, Enrollment, StudentTeam, Attendance, Grade
 from sqlalchemy import func
 import sqlite3
+import repository
 
 dashboard_blueprint = Blueprint('dashboard', __name__)
 
@@ -63,16 +64,7 @@ def index():
     absences_by_lab = absences_query.group_by(LabSlot.name).all()
     
     # Lab slots breakdown by academic year
-    lab_slots_by_academic_year = {}
-    
-    if academic_year_id:
-        year = AcademicYear.query.get(academic_year_id)
-        lab_slots = LabSlot.query.filter_by(academic_year_id=year.id).all()
-        lab_slots_by_academic_year[str(year)] = lab_slots
-    else:
-        for year in academic_years:
-            lab_slots = LabSlot.query.filter_by(academic_year_id=year.id).all()
-            lab_slots_by_academic_year[str(year)] = lab_slots
+    lab_slots_by_academic_year = repository.lab_slots_by_year(academic_year_id)
     
     return render_template(
         'dashboard/index.html',
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
-from models import db_session, db, AcademicYear, LabSlot, Student, Enrollment, Grade, FinalGrade
+from models import db_session, db, upsert, AcademicYear, LabSlot, Student, Enrollment, Grade, FinalGrade
 from datetime import datetime
+import repository
 from sqlalchemy import text
 
 grades_blueprint = Blueprint('grades', __name__)
@@ -48,38 +49,28 @@ def insert(academic_year_id):
         # Save grades
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
+        rows = []
         for student_id, grade_value in zip(student_ids, grades):
             if grade_value.strip():  # Only save if grade is not empty
                 try:
-                    grade_value = float(grade_value)
-                    
-                    # Check if grade record already exists
-                    grade = Grade.query.filter_by(
-                        student_id=student_id,
-                        lab_slot_id=selected_lab_id,
-                        exercise_slot=exercise_slot,
-                        academic_year_id=academic_year_id
-                    ).first()
-                    
-                    if grade:
-                        # Update existing record
-                        grade.grade = grade_value
-                        grade.timestamp = timestamp
-                    else:
-                        # Create new record
-                        grade = Grade(
-                            student_id=student_id,
-                            lab_slot_id=selected_lab_id,
-                            exercise_slot=exercise_slot,
-                            grade=grade_value,
-                            timestamp=timestamp,
-                            academic_year_id=academic_year_id
-                        )
-                        db.session.add(grade)
+                    rows.append({
+                        'student_id': student_id,
+                        'lab_slot_id': selected_lab_id,
+                        'exercise_slot': exercise_slot,
+                        'grade': float(grade_value),
+                        'timestamp': timestamp,
+                        'academic_year_id': academic_year_id
+                    })
                 except ValueError:
                     flash(f'Invalid grade for student {student_id}: {grade_value}', 'danger')
                     continue
         
+        # Insert or update the whole sheet in one statement
+        upsert(
+            Grade, rows,
+            key=['student_id', 'lab_slot_id', 'exercise_slot', 'academic_year_id'],
+            update=['grade', 'timestamp']
+        )
         db.session.commit()
         flash('Grades saved successfully', 'success')
         return redirect(url_for(
@@ -146,69 +137,10 @@ def show(academic_year_id):
     if not selected_lab_ids and lab_slots:
         selected_lab_ids = [lab_slots[0].id]
     
-    # Get grades for each lab slot
-    grades_data = {}
-    
-    for lab_id in selected_lab_ids:
-        lab_slot = LabSlot.query.get(lab_id)
-        
-        if lab_slot:
-            # Get all exercise slots that have grades for this lab slot
-            exercise_slots = db.session.query(
-                Grade.exercise_slot
-            ).filter(
-                Grade.lab_slot_id == lab_id,
-                Grade.academic_year_id == academic_year_id
-            ).distinct().order_by(
-                Grade.exercise_slot
-            ).all()
-            
-            exercise_slots = [slot[0] for slot in exercise_slots]
-            
-            # Get students for this lab slot
-            students = db.session.query(
-                Student
-            ).join(
-                Enrollment,
-                Student.student_id == Enrollment.student_id
-            ).filter(
-                Enrollment.academic_year_id == academic_year_id,
-                Enrollment.lab_slot_id == lab_id
-            ).order_by(
-                Student.name
-            ).all()
-            
-            # Get grades for each student
-            students_with_grades = []
-            
-            for student in students:
-                # Get grades for all exercise slots
-                grades = {}
-                total_grades = 0
-                grade_count = 0
-                
-                for slot in exercise_slots:
-                    grade = Grade.query.filter_by(
-                        student_id=student.student_id,
-                        lab_slot_id=lab_id,
-                        exercise_slot=slot,
-                        academic_year_id=academic_year_id
-                    ).first()
-                    
-                    if grade:
-                        grades[slot] = grade.grade
-                        total_grades += grade.grade
-                        grade_count += 1
-                
-                # Calculate average
-                average = total_grades / grade_count if grade_count > 0 else None
-                
-                students_with_grades.append((student, grades, average))
-            
-            grades_data[lab_slot.name] = {
-                'exercise_slots': exercise_slots,
-                'students': students_with_grades
-            }
+    # Get the graded exercise slots and every student's grades for each lab slot
+    selected_labs = repository.lab_slots_by_id(selected_lab_ids)
+    sheets = repository.grade_sheets(academic_year_id, list(selected_labs))
+    grades_data = {lab_slot.name: sheets[lab_id] for lab_id, lab_slot in selected_labs.items()}
     
     return render_template(
         'grades/show.html',
@@ -220,80 +152,8 @@ def show(academic_year_id):
 
 @grades_blueprint.route('/calculate_final/<int:academic_year_id>', methods=['GET', 'POST'])
 def calculate_final(academic_year_id):
-    academic_year = AcademicYear.query.get_or_404(academic_year_id)
-    
-    if request.method == 'POST':
-        # Get all students for this academic year
-        students = db.session.query(
-            Student
-        ).join(
-            Enrollment,
-            Student.student_id == Enrollment.student_id
-        ).filter(
-            Enrollment.academic_year_id == academic_year_id
-        ).distinct().all()
-        
-        for student in students:
-            # Get lab average
-            lab_average = db.session.query(
-                db.func.avg(Grade.grade)
-            ).filter(
-                Grade.student_id == student.student_id,
-                Grade.academic_year_id == academic_year_id,
-                ~Grade.exercise_slot.in_(["Exam.Jun", "Exam.Sep"])
-            ).scalar() or 0
-            
-            # Get exam grades
-            jun_exam_grade = db.session.query(
-                Grade.grade
-            ).filter(
-                Grade.student_id == student.student_id,
-                Grade.academic_year_id == academic_year_id,
-                Grade.exercise_slot == "Exam.Jun"
-            ).scalar()
-            
-            sep_exam_grade = db.session.query(
-                Grade.grade
-            ).filter(
-                Grade.student_id == student.student_id,
-                Grade.academic_year_id == academic_year_id,
-                Grade.exercise_slot == "Exam.Sep"
-            ).scalar()
-            
-            # Calculate final grade (40% lab, 60% exam)
-            exam_grade = sep_exam_grade if sep_exam_grade is not None else (jun_exam_grade if jun_exam_grade is not None else 0)
-            final_grade = 0.4 * lab_average + 0.6 * exam_grade if exam_grade is not None else None
-            
-            # Update or create final grade record
-            final_grade_record = FinalGrade.query.filter_by(
-                student_id=student.student_id,
-                academic_year_id=academic_year_id
-            ).first()
-            
-            if final_grade_record:
-                final_grade_record.lab_average = lab_average
-                final_grade_record.jun_exam_grade = jun_exam_grade
-                final_grade_record.sep_exam_grade = sep_exam_grade
-                final_grade_record.final_grade = final_grade
-            else:
-                final_grade_record = FinalGrade(
-                    student_id=student.student_id,
-                    academic_year_id=academic_year_id,
-                    lab_average=lab_average,
-                    jun_exam_grade=jun_exam_grade,
-                    sep_exam_grade=sep_exam_grade,
-                    final_grade=final_grade
-                )
-                db.session.add(final_grade_record)
-        
-        db.session.commit()
-        flash('Final grades calculated successfully', 'success')
-        return redirect(url_for('grades.final', academic_year_id=academic_year_id))
-    
-    return render_template(
-        'grades/calculate.html',
-        academic_year=academic_year
-    )
+    # Final grades come from the FinalGrades view and are always current
+    return redirect(url_for('grades.final', academic_year_id=academic_year_id))
 
 @grades_blueprint.route('/final/<int:academic_year_id>')
 def final(academic_year_id):
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
-from models import db_session, db, AcademicYear, LabSlot, Student, Enrollment, StudentTeam
+from models import db_session, db, upsert, AcademicYear, LabSlot, Student, Enrollment, StudentTeam
 import pandas as pd
+import repository
 from datetime import datetime
 import os
 
@@ -41,26 +42,14 @@ def assign(academic_year_id):
                 flash('Please select a team number and at least one student', 'danger')
                 return redirect(url_for('teams.assign', academic_year_id=academic_year_id, lab_slot_id=selected_lab_id))
             
-            # Assign students to team
-            for student_id in student_ids:
-                # Check if student is already in a team
-                existing_team = StudentTeam.query.filter_by(
-                    student_id=student_id,
-                    lab_slot_id=selected_lab_id
-                ).first()
-                
-                if existing_team:
-                    # Update team number
-                    existing_team.team_number = team_number
-                else:
-                    # Create new team assignment
-                    team = StudentTeam(
-                        student_id=student_id,
-                        lab_slot_id=selected_lab_id,
-                        team_number=team_number
-                    )
-                    db.session.add(team)
-            
+            # Assign students to team, moving those already in another team
+            upsert(
+                StudentTeam,
+                [{'student_id': student_id, 'lab_slot_id': selected_lab_id, 'team_number': team_number}
+                 for student_id in student_ids],
+                key=['student_id', 'lab_slot_id'],
+                update=['team_number']
+            )
             db.session.commit()
             flash(f'Successfully assigned {len(student_ids)} students to Team {team_number}', 'success')
             
@@ -143,40 +132,10 @@ def show(academic_year_id):
     if not selected_lab_ids and lab_slots:
         selected_lab_ids = [lab_slots[0].id]
     
-    # Get teams for the selected lab slots
-    teams_by_lab = {}
-    
-    for lab_id in selected_lab_ids:
-        lab_slot = LabSlot.query.get(lab_id)
-        
-        if lab_slot:
-            teams = db.session.query(
-                StudentTeam.team_number,
-                db.func.count(StudentTeam.id).label('student_count')
-            ).filter(
-                StudentTeam.lab_slot_id == lab_id
-            ).group_by(
-                StudentTeam.team_number
-            ).order_by(
-                StudentTeam.team_number
-            ).all()
-            
-            # Get students for each team
-            teams_with_students = []
-            for team_number, student_count in teams:
-                students = db.session.query(Student).join(
-                    StudentTeam,
-                    Student.student_id == StudentTeam.student_id
-                ).filter(
-                    StudentTeam.lab_slot_id == lab_id,
-                    StudentTeam.team_number == team_number
-                ).order_by(
-                    Student.name
-                ).all()
-                
-                teams_with_students.append((team_number, students))
-            
-            teams_by_lab[lab_slot.name] = teams_with_students
+    # Get teams for the selected lab slots, with the students of every team
+    selected_labs = repository.lab_slots_by_id(selected_lab_ids)
+    teams = repository.teams_by_lab(list(selected_labs))
+    teams_by_lab = {lab_slot.name: teams[lab_id] for lab_id, lab_slot in selected_labs.items()}
     
     return render_template(
         'teams/show.html',
@@ -208,29 +167,8 @@ def export(academic_year_id):
     # Get teams and students for this lab slot
     team_data = []
     
-    # Get all team numbers for this lab slot
-    team_numbers = db.session.query(
-        StudentTeam.team_number
-    ).filter(
-        StudentTeam.lab_slot_id == selected_lab_id
-    ).distinct().order_by(
-        StudentTeam.team_number
-    ).all()
-    
-    # For each team, get the students
-    for team_number, in team_numbers:
-        students = db.session.query(
-            Student
-        ).join(
-            StudentTeam,
-            Student.student_id == StudentTeam.student_id
-        ).filter(
-            StudentTeam.lab_slot_id == selected_lab_id,
-            StudentTeam.team_number == team_number
-        ).order_by(
-            Student.name
-        ).all()
-        
+    # Get every team of this lab slot with its students
+    for team_number, students in repository.teams_by_lab([selected_lab_id])[selected_lab_id]:
         # Add to team data
         for idx, student in enumerate(students):
             team_data.append({
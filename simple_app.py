@@ -1,38 +1,290 @@
+import hashlib
+import json
 import os
 import sqlite3
+import time
 import pandas as pd
-from flask import Flask, render_template, redirect, url_for, request, flash, jsonify, g, send_file
+from contextlib import contextmanager
+from flask import Flask, render_template, redirect, url_for, request, flash, jsonify, g, send_file, has_request_context
 from datetime import datetime
+from concurrent.futures import Future
+from db_pool import ConnectionPool
+from migrations import migrate, schema_version, CURRENT_VERSION, SchemaCapabilities
+from queries import QUERIES, CACHED_STATEMENTS, query_stats
+from write_queue import WriteQueue
+from grade_stats import from_aggregates, summarize
+from grading import GradingPolicy, PASS_GRADE, override_params
+from versioned_cache import DataVersionWatcher, VersionedCache
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.urandom(24)
 app.config['DATABASE'] = 'student_register.db'
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 8))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+app.config['DB_CACHED_STATEMENTS'] = int(os.environ.get('DB_CACHED_STATEMENTS', CACHED_STATEMENTS))
+app.config['DB_READ_POOL_SIZE'] = int(os.environ.get('DB_READ_POOL_SIZE', 8))
+# Opt-in: route all writes through one writer thread per worker with group commit
+app.config['DB_WRITE_QUEUE'] = os.environ.get('DB_WRITE_QUEUE', '0') == '1'
 
 # Database helper functions
+def get_pool(readonly=False):
+    # One writer and one read-only pool per worker; rebuilt after a fork or a DATABASE change
+    key = 'db_read_pool' if readonly else 'db_pool'
+    pool = app.extensions.get(key)
+    if pool is None or pool.pid != os.getpid() or pool.database != app.config['DATABASE']:
+        if pool is not None and pool.pid == os.getpid():
+            pool.close()
+        if not readonly:
+            app.extensions.pop('schema_version', None)
+            app.extensions.pop('schema_capabilities', None)
+        pool = app.extensions[key] = ConnectionPool(
+            app.config['DATABASE'],
+            size=app.config['DB_READ_POOL_SIZE' if readonly else 'DB_POOL_SIZE'],
+            timeout=app.config['DB_POOL_TIMEOUT'],
+            cached_statements=app.config['DB_CACHED_STATEMENTS'],
+            readonly=readonly
+        )
+    return pool
+
+def get_write_queue():
+    # Single writer thread per worker, or None when DB_WRITE_QUEUE is off
+    if not app.config['DB_WRITE_QUEUE']:
+        return None
+    write_queue = app.extensions.get('db_write_queue')
+    if write_queue is None or write_queue.pid != os.getpid() or write_queue.database != app.config['DATABASE']:
+        if write_queue is not None and write_queue.pid == os.getpid():
+            write_queue.close()
+        write_queue = app.extensions['db_write_queue'] = WriteQueue(
+            app.config['DATABASE'],
+            timeout=app.config['DB_POOL_TIMEOUT']
+        )
+    return write_queue
+
+def get_result_cache():
+    # Query results cached per worker until the next commit, or None for in-memory databases
+    if app.config['DATABASE'] == ':memory:':
+        return None
+    cache = app.extensions.get('result_cache')
+    if cache is None or cache.watcher.pid != os.getpid() or cache.watcher.database != app.config['DATABASE']:
+        if cache is not None and cache.watcher.pid == os.getpid():
+            cache.watcher.close()
+        cache = app.extensions['result_cache'] = VersionedCache(DataVersionWatcher(app.config['DATABASE']))
+    return cache
+
+def close_pools():
+    for key in ('db_pool', 'db_read_pool', 'db_write_queue'):
+        pool = app.extensions.get(key)
+        if pool is not None:
+            pool.close()
+    app.extensions.pop('db_write_queue', None)
+    cache = app.extensions.pop('result_cache', None)
+    if cache is not None:
+        cache.watcher.close()
+
+def cached_result(key, compute):
+    # compute() once per data version for `key`; uncached for in-memory databases
+    cache = get_result_cache()
+    if cache is None:
+        return compute()
+    return cache.get(key, compute)
+
 def get_db():
+    # Read/write connection, used for every write and for reads outside GET requests
+    db = getattr(g, '_transaction_db', None)
+    if db is not None:
+        return db
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(app.config['DATABASE'])
-        db.row_factory = sqlite3.Row
+        pool = get_pool()
+        db = g._database = pool.acquire()
+        g._database_pool = pool
+    return db
+
+def get_read_db():
+    # GET and HEAD requests read through the read-only pool, unless this
+    # request already holds the writer (so it keeps seeing its own writes)
+    if (not has_request_context() or request.method not in ('GET', 'HEAD') or in_transaction()
+            or app.config['DATABASE'] == ':memory:' or getattr(g, '_database', None) is not None):
+        return get_db()
+    db = getattr(g, '_read_database', None)
+    if db is None:
+        pool = get_pool(readonly=True)
+        db = g._read_database = pool.acquire()
+        g._read_database_pool = pool
     return db
 
+def get_schema():
+    # Columns are introspected once per worker and refreshed after a migration
+    schema = app.extensions.get('schema_capabilities')
+    if schema is None:
+        schema = app.extensions['schema_capabilities'] = SchemaCapabilities.inspect(get_read_db())
+    return schema
+
 def query_db(query, args=(), one=False):
-    cur = get_db().execute(query, args)
+    cur = get_read_db().execute(query, args)
     rv = cur.fetchall()
     cur.close()
     return (rv[0] if rv else None) if one else rv
 
+def in_transaction():
+    return getattr(g, '_transaction_depth', 0) > 0
+
+@contextmanager
+def transaction():
+    # Unit of work: everything written inside the block is committed once.
+    # Nested blocks join the outermost transaction.
+    depth = getattr(g, '_transaction_depth', 0)
+    if depth > 0:
+        g._transaction_depth = depth + 1
+        try:
+            yield g._transaction_db
+        finally:
+            g._transaction_depth = depth
+        return
+
+    # With the write queue on, the block borrows the writer thread's connection
+    write_queue = get_write_queue()
+    db = write_queue.acquire() if write_queue is not None else get_db()
+    g._transaction_db = db
+    g._transaction_depth = 1
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except Exception:
+            db.rollback()
+            raise
+        db.commit()
+    finally:
+        g._transaction_depth = 0
+        g._transaction_db = None
+        if write_queue is not None:
+            write_queue.release(db)
+
+def submit_write(query, args=(), many=False):
+    # Queue a write and return a Future of its rowcount. Without the write
+    # queue (or inside a transaction) the write runs now and the Future is done.
+    write_queue = get_write_queue()
+    if write_queue is not None and not in_transaction():
+        return write_queue.submit(query, args, many)
+    future = Future()
+    try:
+        future.set_result(modify_many(query, args) if many else modify_db(query, args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
 def modify_db(query, args=()):
+    write_queue = get_write_queue()
+    if write_queue is not None and not in_transaction():
+        # Wait for the group commit so the caller reads its own write
+        return write_queue.submit(query, args).result()
+    db = get_db()
+    cur = db.execute(query, args)
+    if not in_transaction():
+        db.commit()
+    return cur.rowcount
+
+def modify_many(query, rows):
+    # Bulk variant of modify_db: one executemany, one commit
+    if not rows:
+        return 0
+    write_queue = get_write_queue()
+    if write_queue is not None and not in_transaction():
+        return write_queue.submit(query, rows, many=True).result()
     db = get_db()
-    db.execute(query, args)
-    db.commit()
+    cur = db.executemany(query, rows)
+    if not in_transaction():
+        db.commit()
+    return cur.rowcount
+
+@contextmanager
+def timed_query(name):
+    # Record the latency of a named statement in the per-worker query stats
+    start = time.perf_counter()
+    try:
+        yield QUERIES[name]
+    finally:
+        query_stats.record(name, time.perf_counter() - start)
+
+def named_query(name, args=(), one=False):
+    with timed_query(name) as query:
+        return query_db(query, args, one)
+
+def named_modify(name, args=()):
+    with timed_query(name) as query:
+        return modify_db(query, args)
+
+def named_many(name, rows):
+    if not rows:
+        return 0
+    with timed_query(name) as query:
+        return modify_many(query, rows)
+
+def sheet_values(name, lab_slot_id, exercise_slot, academic_year_id):
+    # Get the stored value per student for one attendance/grade sheet
+    rows = named_query(name, [lab_slot_id, exercise_slot, academic_year_id])
+    return {row['student_id']: row['value'] for row in rows}
+
+SESSIONS_PAGE_SIZE = 20
+
+def session_page(name):
+    """One keyset page of Sessions rows for an index page, plus the cursor of the next page.
+
+    The cursor (the `before` argument) is the sort key of the last row shown:
+    "timestamp|academic_year_id|lab_slot_id|exercise_slot".
+    """
+    params = {'limit': SESSIONS_PAGE_SIZE + 1}
+    before = request.args.get('before', '')
+    try:
+        updated, academic_year_id, lab_slot_id, exercise_slot = before.split('|', 3)
+        params.update(
+            before_updated=updated,
+            before_academic_year_id=int(academic_year_id),
+            before_lab_slot_id=int(lab_slot_id),
+            before_exercise_slot=exercise_slot,
+        )
+        name = f'{name}_before'
+    except ValueError:
+        # No cursor (or a malformed one): first page
+        pass
+    
+    rows = named_query(name, params)
+    next_before = None
+    if len(rows) > SESSIONS_PAGE_SIZE:
+        rows = rows[:SESSIONS_PAGE_SIZE]
+        last = rows[-1]
+        next_before = f"{last['timestamp']}|{last['academic_year_id']}|{last['lab_slot_id']}|{last['exercise_slot']}"
+    return rows, next_before
 
 @app.teardown_appcontext
 def close_connection(exception):
     db = getattr(g, '_database', None)
     if db is not None:
-        db.close()
+        g._database_pool.release(db)
+        g._database = None
+    db = getattr(g, '_read_database', None)
+    if db is not None:
+        g._read_database_pool.release(db)
+        g._read_database = None
+
+@app.route('/api/db/pool_stats/')
+def api_pool_stats():
+    stats = {'write': get_pool().stats(), 'read': get_pool(readonly=True).stats()}
+    write_queue = get_write_queue()
+    if write_queue is not None:
+        stats['write_queue'] = write_queue.stats()
+    return jsonify(stats)
+
+@app.route('/api/db/query_stats/')
+def api_query_stats():
+    return jsonify(query_stats.snapshot())
+
+@app.route('/api/db/cache_stats/')
+def api_cache_stats():
+    cache = get_result_cache()
+    return jsonify({'results': cache.stats() if cache is not None else None})
 
 # Home route
 @app.route('/')
@@ -40,161 +292,206 @@ def index():
     return redirect(url_for('dashboard'))
 
 # Dashboard route
-@app.route('/dashboard')
-def dashboard():
-    # Get filter parameters
-    academic_year_id = request.args.get('academic_year_id', type=int)
-    
-    # Get basic statistics
-    stats = {}
-    
-    # Apply filters to database queries if academic_year_id is provided
+def dashboard_stats(academic_year_id=None):
+    """Everything the dashboard shows, for one academic year or for all of them.
+
+    Built from the LabSlotStats rows of the lab slots plus a student count, so
+    Attendance is not aggregated on page load; the grade statistics are one
+    aggregate pass over Grades.
+    """
+    if academic_year_id:
+        rows = named_query('dashboard_lab_slots_for_year', [academic_year_id])
+        total_students = named_query('dashboard_students_for_year', [academic_year_id], one=True)['count']
+        grades = named_query('dashboard_grades_for_year', [academic_year_id], one=True)
+    else:
+        rows = named_query('dashboard_lab_slots')
+        total_students = named_query('dashboard_students', one=True)['count']
+        grades = named_query('dashboard_grades', one=True)
+
+    lab_slots_by_year = {}
+    team_counts = {}
+    lab_slots = []
+    for row in rows:
+        slots = lab_slots_by_year.setdefault(f"{row['semester']} {row['year']}", [])
+        if row['id'] is None:
+            # Academic year without lab slots
+            continue
+        lab_slot = {
+            'id': row['id'],
+            'name': row['name'],
+            'student_count': row['student_count'],
+            'absences_count': row['absences_count'],
+        }
+        slots.append(lab_slot)
+        lab_slots.append(lab_slot)
+        if row['team_count']:
+            # Lab slots of different years share names; chart them under one bar
+            team_counts[row['name']] = max(team_counts.get(row['name'], 0), row['team_count'])
+
+    absences_by_lab = sorted(
+        (slot for slot in lab_slots if slot['absences_count']),
+        key=lambda slot: slot['absences_count'],
+        reverse=True
+    )[:10]
+
+    return {
+        'total_students': total_students,
+        'total_lab_slots': len(lab_slots),
+        'absences': sum(slot['absences_count'] for slot in lab_slots),
+        'lab_slots_by_year': lab_slots_by_year,
+        'team_counts': [{'name': name, 'count': count} for name, count in sorted(team_counts.items())],
+        'absences_by_lab': [
+            {'lab_name': slot['name'], 'absent_count': slot['absences_count']} for slot in absences_by_lab
+        ],
+        'grades': from_aggregates(grades),
+    }
+
+def dashboard_context(academic_year_id=None):
+    # Everything the dashboard template needs from the database
     if academic_year_id:
         # Get the selected academic year
-        selected_academic_year = query_db('SELECT id, semester, year FROM AcademicYear WHERE id = ?', 
-                                        [academic_year_id], one=True)
-        
-        # Count students, lab slots, and absences for the selected academic year
-        stats['total_students'] = query_db(
-            'SELECT COUNT(DISTINCT s.student_id) as count FROM Students s JOIN Enrollments e ON s.student_id = e.student_id WHERE e.academic_year_id = ?', 
-            [academic_year_id], 
-            one=True
-        )['count']
-        
-        stats['total_lab_slots'] = query_db(
-            'SELECT COUNT(*) as count FROM LabSlots WHERE academic_year_id = ?', 
-            [academic_year_id], 
-            one=True
-        )['count']
-        
-        stats['absences'] = query_db(
-            'SELECT COUNT(*) as count FROM Attendance WHERE status = "Absent" AND academic_year_id = ?', 
-            [academic_year_id], 
-            one=True
-        )['count']
-        
-        # Get lab slots for the selected academic year
-        lab_slots = query_db('''
-            SELECT 
-                LabSlots.id, 
-                LabSlots.name, 
-                (SELECT COUNT(*) FROM Enrollments WHERE Enrollments.lab_slot_id = LabSlots.id) as student_count,
-                (SELECT COUNT(*) FROM Attendance WHERE Attendance.lab_slot_id = LabSlots.id AND Attendance.status = 'Absent') as absences_count
-            FROM LabSlots
-            WHERE LabSlots.academic_year_id = ?
-        ''', [academic_year_id])
-        
-        year_key = f"{selected_academic_year['semester']} {selected_academic_year['year']}"
-        lab_slots_by_year = {year_key: lab_slots}
-        
-        # Get team distribution for the selected academic year
-        team_counts = query_db('''
-            SELECT LabSlots.name, COUNT(DISTINCT StudentTeams.team_number) as count
-            FROM StudentTeams
-            JOIN LabSlots ON StudentTeams.lab_slot_id = LabSlots.id
-            WHERE LabSlots.academic_year_id = ?
-            GROUP BY LabSlots.name
-        ''', [academic_year_id])
-        
-        # Get absences by lab slot for chart for the selected academic year
-        absences_by_lab = query_db('''
-            SELECT 
-                l.name as lab_name, 
-                COUNT(*) as absent_count
-            FROM 
-                Attendance a
-            JOIN 
-                LabSlots l ON a.lab_slot_id = l.id
-            WHERE 
-                a.status = 'Absent'
-                AND a.academic_year_id = ?
-            GROUP BY 
-                l.id
-            ORDER BY 
-                absent_count DESC
-            LIMIT 10
-        ''', [academic_year_id])
+        selected_academic_year = named_query('academic_year', [academic_year_id], one=True)
     else:
-        # No filter, get all statistics
         selected_academic_year = None
-        
-        # Count students, lab slots, and absences
-        stats['total_students'] = query_db('SELECT COUNT(*) as count FROM Students', one=True)['count']
-        stats['total_lab_slots'] = query_db('SELECT COUNT(*) as count FROM LabSlots', one=True)['count']
-        stats['absences'] = query_db('SELECT COUNT(*) as count FROM Attendance WHERE status = "Absent"', one=True)['count']
-        
-        # Get academic years
-        academic_years = query_db('SELECT id, semester, year FROM AcademicYear ORDER BY year, semester')
-        
-        # Get lab slots by academic year
-        lab_slots_by_year = {}
-        for year in academic_years:
-            lab_slots = query_db('''
-                SELECT 
-                    LabSlots.id, 
-                    LabSlots.name, 
-                    (SELECT COUNT(*) FROM Enrollments WHERE Enrollments.lab_slot_id = LabSlots.id) as student_count,
-                    (SELECT COUNT(*) FROM Attendance WHERE Attendance.lab_slot_id = LabSlots.id AND Attendance.status = 'Absent') as absences_count
-                FROM LabSlots
-                WHERE LabSlots.academic_year_id = ?
-            ''', [year['id']])
-            
-            year_key = f"{year['semester']} {year['year']}"
-            lab_slots_by_year[year_key] = lab_slots
-        
-        # Get team distribution
-        team_counts = query_db('''
-            SELECT LabSlots.name, COUNT(DISTINCT StudentTeams.team_number) as count
-            FROM StudentTeams
-            JOIN LabSlots ON StudentTeams.lab_slot_id = LabSlots.id
-            GROUP BY LabSlots.name
-        ''')
-        
-        # Get absences by lab slot for chart
-        absences_by_lab = query_db('''
-            SELECT 
-                l.name as lab_name, 
-                COUNT(*) as absent_count
-            FROM 
-                Attendance a
-            JOIN 
-                LabSlots l ON a.lab_slot_id = l.id
-            WHERE 
-                a.status = 'Absent'
-            GROUP BY 
-                l.id
-            ORDER BY 
-                absent_count DESC
-            LIMIT 10
-        ''')
     
-    # Get all academic years for the filter dropdown
-    academic_years = query_db('SELECT id, semester, year FROM AcademicYear ORDER BY year, semester')
+    stats = dashboard_stats(academic_year_id)
     
-    return render_template(
-        'dashboard/index.html',
-        academic_years=academic_years,
+    return dict(
+        # Get all academic years for the filter dropdown
+        academic_years=named_query('academic_years'),
         selected_academic_year=selected_academic_year,
         total_students=stats['total_students'],
         total_lab_slots=stats['total_lab_slots'],
         absences=stats['absences'],
-        team_counts=team_counts,
-        lab_slots_by_academic_year=lab_slots_by_year,
-        absences_by_lab=absences_by_lab
+        team_counts=stats['team_counts'],
+        lab_slots_by_academic_year=stats['lab_slots_by_year'],
+        absences_by_lab=stats['absences_by_lab'],
+        grade_summary=stats['grades']
+    )
+
+@app.route('/dashboard')
+def dashboard():
+    # Get filter parameters
+    academic_year_id = request.args.get('academic_year_id', type=int)
+    
+    # Served from the cache until the next commit to the database; the page
+    # itself is rendered per request since it carries the flashed messages
+    context = cached_result(('dashboard', academic_year_id), lambda: dashboard_context(academic_year_id))
+    
+    return render_template('dashboard/index.html', **context)
+
+def dashboard_stats_payload(academic_year_id=None):
+    # Compact JSON body and its ETag; hashing the body keeps the tag stable across workers
+    stats = dict(dashboard_stats(academic_year_id), academic_year_id=academic_year_id)
+    body = json.dumps(stats, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return body, hashlib.sha1(body).hexdigest()
+
+@app.route('/api/dashboard/stats')
+def api_dashboard_stats():
+    academic_year_id = request.args.get('academic_year_id', type=int)
+    
+    # Recomputed only after a commit; polls in between answer 304 from the cache
+    body, etag = cached_result(('dashboard_api', academic_year_id), lambda: dashboard_stats_payload(academic_year_id))
+    
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# Cross-year analytics
+TREND_COLUMNS = ['academic_year_id', 'semester', 'year', 'lab_slot_id', 'lab_slot_name', 'exercise_slot',
+                 'records', 'absences', 'graded', 'grade_total']
+
+def exercise_slot_order(exercise_slot):
+    # Lab1..Lab13, then replacements, then exams and anything else
+    prefix = exercise_slot.rstrip('0123456789')
+    number = exercise_slot[len(prefix):]
+    return ({'Lab': 0, 'Replacement': 1}.get(prefix, 2), prefix, int(number) if number else 0)
+
+def trend_frame():
+    # Year x lab x exercise aggregates, one grouped query per data version
+    return cached_result(
+        ('trend_frame',),
+        lambda: pd.DataFrame([tuple(row) for row in named_query('exercise_trends')], columns=TREND_COLUMNS)
     )
 
+def exercise_trends(lab_slot_name=None):
+    """Absence rate and average grade per exercise slot across academic years.
+
+    Lab slots that share a name in different years are compared by passing
+    `lab_slot_name`; otherwise every lab slot of a year is pooled.
+    """
+    df = trend_frame()
+    lab_slot_names = sorted(df['lab_slot_name'].dropna().unique().tolist())
+    if lab_slot_name:
+        df = df[df['lab_slot_name'] == lab_slot_name]
+
+    years = df[['academic_year_id', 'semester', 'year']].drop_duplicates().sort_values(['year', 'semester'])
+    exercise_slots = sorted(df['exercise_slot'].dropna().unique().tolist(), key=exercise_slot_order)
+
+    totals = df.groupby(['academic_year_id', 'exercise_slot'])[['records', 'absences', 'graded', 'grade_total']].sum()
+    by_year = totals.groupby(level='academic_year_id').sum().reindex(years['academic_year_id'])
+
+    def pivot(numerator, denominator):
+        # Ratio per (year, exercise slot), years as rows; empty cells stay NaN
+        ratio = (totals[numerator] / totals[denominator].where(totals[denominator] > 0)).unstack('exercise_slot')
+        return ratio.reindex(index=years['academic_year_id'], columns=exercise_slots)
+
+    def series(frame):
+        frame = frame.round(4)
+        return frame.astype(object).where(frame.notna(), None)
+
+    absence_rate = series(pivot('absences', 'records'))
+    average_grade = series(pivot('grade_total', 'graded'))
+    absences = totals['absences'].unstack('exercise_slot').reindex(
+        index=years['academic_year_id'], columns=exercise_slots
+    ).fillna(0).astype(int)
+
+    return {
+        'lab_slot_name': lab_slot_name,
+        'lab_slot_names': lab_slot_names,
+        'years': [
+            {'id': int(year_id), 'label': f'{semester} {year}'}
+            for year_id, semester, year in years.itertuples(index=False)
+        ],
+        'exercise_slots': exercise_slots,
+        'absence_rate': absence_rate.to_dict(orient='list'),
+        'average_grade': average_grade.to_dict(orient='list'),
+        'absences': absences.to_dict(orient='list'),
+        'year_totals': {
+            'absence_rate': series(by_year['absences'] / by_year['records'].where(by_year['records'] > 0)).tolist(),
+            'average_grade': series(by_year['grade_total'] / by_year['graded'].where(by_year['graded'] > 0)).tolist(),
+        },
+    }
+
+@app.route('/analytics/')
+def analytics_trends():
+    # The all-lab-slots result the page's first API call reads, cached under the same key
+    lab_slot_names = cached_result(('exercise_trends', None), exercise_trends)['lab_slot_names']
+    return render_template('analytics/trends.html',
+                          lab_slot_names=lab_slot_names,
+                          selected_lab_slot_name=request.args.get('lab_slot_name', ''))
+
+@app.route('/api/analytics/trends')
+def api_analytics_trends():
+    lab_slot_name = request.args.get('lab_slot_name') or None
+    return jsonify(cached_result(('exercise_trends', lab_slot_name), lambda: exercise_trends(lab_slot_name)))
+
 # Update the URL routes for dashboard in base.html
 @app.context_processor
 def inject_globals():
     return {
-        'request': request
+        'request': request,
+        # The templates are shared by simple_app.py and simple_app.pyw, which
+        # do not have all the same routes
+        'has_endpoint': lambda endpoint: endpoint in app.view_functions
     }
 
 # Academic Year routes
 @app.route('/academic/')
 def academic_year_index():
     # Get all academic years
-    academic_years = query_db('SELECT id, semester, year FROM AcademicYear ORDER BY year, semester')
+    academic_years = named_query('academic_years')
     return render_template('academic/index.html', academic_years=academic_years)
 
 @app.route('/academic/create/', methods=['GET', 'POST'])
@@ -290,36 +587,29 @@ def students_import():
             # Create 'Student_Name' by combining 'Επώνυμο' and 'Όνομα'
             df['Student_Name'] = df['Επώνυμο'] + ' ' + df['Όνομα']
             
-            # Check if lab slot exists
-            lab_slot = query_db(
-                'SELECT id FROM LabSlots WHERE name=? AND academic_year_id=?',
-                [lab_slot_name, academic_year_id],
-                one=True
-            )
-            
-            if lab_slot:
-                # Ask if user wants to replace data
-                replace = request.form.get('replace_data') == 'on'
+            # Write the lab slot, students and enrollments in one transaction
+            with transaction():
+                # Check if lab slot exists
+                lab_slot = query_db(
+                    'SELECT id FROM LabSlots WHERE name=? AND academic_year_id=?',
+                    [lab_slot_name, academic_year_id],
+                    one=True
+                )
                 
-                if replace:
+                if lab_slot:
+                    # Ask if user wants to replace data
+                    replace = request.form.get('replace_data') == 'on'
+                    
+                    if not replace:
+                        flash(f'Lab slot {lab_slot_name} already exists. Please check "Replace existing data" if you want to replace it.', 'warning')
+                        return redirect(request.url)
+                    
                     # Delete existing enrollments for this lab slot
                     modify_db('DELETE FROM Enrollments WHERE lab_slot_id=?', [lab_slot['id']])
                     
                     # Delete the lab slot
                     modify_db('DELETE FROM LabSlots WHERE id=?', [lab_slot['id']])
-                    
-                    # Create new lab slot
-                    modify_db(
-                        'INSERT INTO LabSlots (name, academic_year_id) VALUES (?, ?)',
-                        [lab_slot_name, academic_year_id]
-                    )
-                    lab_slot_id = query_db(
-                        'SELECT last_insert_rowid() as id', one=True
-                    )['id']
-                else:
-                    flash(f'Lab slot {lab_slot_name} already exists. Please check "Replace existing data" if you want to replace it.', 'warning')
-                    return redirect(request.url)
-            else:
+                
                 # Create new lab slot
                 modify_db(
                     'INSERT INTO LabSlots (name, academic_year_id) VALUES (?, ?)',
@@ -328,42 +618,50 @@ def students_import():
                 lab_slot_id = query_db(
                     'SELECT last_insert_rowid() as id', one=True
                 )['id']
-            
-            # Insert students and enrollments
-            for index, row in df.iterrows():
-                student_id = str(row['Αριθμός μητρώου'])
-                name = row['Student_Name']
-                email = row['E-mail']
-                username = row['Όνομα χρήστη (username)']
-                
-                # Insert student if not exists
-                student = query_db(
-                    'SELECT student_id FROM Students WHERE student_id=?',
-                    [student_id],
-                    one=True
-                )
                 
-                if not student:
-                    modify_db(
-                        'INSERT INTO Students (student_id, name, email, username) VALUES (?, ?, ?, ?)',
-                        [student_id, name, email, username]
+                # Look up existing students and this year's enrollments once
+                file_student_ids = [str(student_id) for student_id in df['Αριθμός μητρώου']]
+                placeholders = ','.join(['?' for _ in file_student_ids])
+                existing_students = {
+                    row['student_id'] for row in query_db(
+                        f'SELECT student_id FROM Students WHERE student_id IN ({placeholders})',
+                        file_student_ids
                     )
-                else:
-                    # Check if student is already enrolled in this academic year
-                    enrollment = query_db(
-                        'SELECT id FROM Enrollments WHERE student_id=? AND academic_year_id=?',
-                        [student_id, academic_year_id],
-                        one=True
+                } if file_student_ids else set()
+                enrolled_students = {
+                    row['student_id'] for row in query_db(
+                        'SELECT student_id FROM Enrollments WHERE academic_year_id=?',
+                        [academic_year_id]
                     )
+                }
+                
+                new_students = []
+                new_enrollments = []
+                for index, row in df.iterrows():
+                    student_id = str(row['Αριθμός μητρώου'])
                     
-                    if enrollment:
+                    if student_id not in existing_students:
+                        new_students.append((
+                            student_id,
+                            row['Student_Name'],
+                            row['E-mail'],
+                            row['Όνομα χρήστη (username)']
+                        ))
+                        existing_students.add(student_id)
+                    elif student_id in enrolled_students:
                         flash(f'Student ID {student_id} is already enrolled in this academic year.', 'warning')
                         continue
+                    
+                    new_enrollments.append((student_id, lab_slot_id, academic_year_id))
+                    enrolled_students.add(student_id)
                 
-                # Insert enrollment
-                modify_db(
+                modify_many(
+                    'INSERT INTO Students (student_id, name, email, username) VALUES (?, ?, ?, ?)',
+                    new_students
+                )
+                modify_many(
                     'INSERT INTO Enrollments (student_id, lab_slot_id, academic_year_id) VALUES (?, ?, ?)',
-                    [student_id, lab_slot_id, academic_year_id]
+                    new_enrollments
                 )
             
             flash(f'Successfully imported {len(df)} students to lab slot {lab_slot_name}', 'success')
@@ -374,18 +672,14 @@ def students_import():
             return redirect(request.url)
     
     # Get all academic years for the form
-    academic_years = query_db('SELECT id, semester, year FROM AcademicYear ORDER BY year, semester')
+    academic_years = named_query('academic_years')
     
     return render_template('students/import.html', academic_years=academic_years)
 
 @app.route('/students/show/<int:academic_year_id>/')
 def students_show(academic_year_id):
     # Get academic year
-    academic_year = query_db(
-        'SELECT id, semester, year FROM AcademicYear WHERE id=?',
-        [academic_year_id],
-        one=True
-    )
+    academic_year = named_query('academic_year', [academic_year_id], one=True)
     
     if not academic_year:
         flash('Academic year not found', 'danger')
@@ -430,100 +724,49 @@ def students_show(academic_year_id):
         selected_lab_ids=selected_lab_ids
     )
 
+GRADE_MATRIX_ROSTER = ['student_id', 'name', 'email', 'username', 'team_number', 'absences']
+GRADE_MATRIX_GRADES = ['student_id', 'exercise_slot', 'grade', 'timestamp']
+
+def grade_matrix(academic_year_id, lab_slot_id):
+    """Roster and grades of one lab slot from a single query.
+    
+    Returns (students, grades): one row per student in team/name order with
+    the roster columns, one column per graded exercise slot and 'Average',
+    and the (student_id, exercise_slot, grade, timestamp) rows.
+    """
+    rows = named_query('grade_matrix', {'lab_slot_id': lab_slot_id, 'academic_year_id': academic_year_id})
+    df = pd.DataFrame([dict(row) for row in rows], columns=GRADE_MATRIX_ROSTER + GRADE_MATRIX_GRADES[1:])
+    
+    roster = df[GRADE_MATRIX_ROSTER].drop_duplicates('student_id')
+    grades = df.dropna(subset=['exercise_slot'])[GRADE_MATRIX_GRADES]
+    
+    # Grades are unique per (student, exercise slot) on the sheet's natural key
+    matrix = grades.pivot(index='student_id', columns='exercise_slot', values='grade').astype(float)
+    matrix['Average'] = matrix.mean(axis=1)
+    students = roster.merge(matrix, left_on='student_id', right_index=True, how='left')
+    return students.reset_index(drop=True), grades.reset_index(drop=True)
+
 # Export data function
 @app.route('/export/<int:academic_year_id>/<int:lab_slot_id>/')
 def export_data(academic_year_id, lab_slot_id):
     # Get academic year and lab slot
-    academic_year = query_db(
-        'SELECT id, semester, year FROM AcademicYear WHERE id=?',
-        [academic_year_id],
-        one=True
-    )
+    academic_year = named_query('academic_year', [academic_year_id], one=True)
     
-    lab_slot = query_db(
-        'SELECT id, name FROM LabSlots WHERE id=?',
-        [lab_slot_id],
-        one=True
-    )
+    lab_slot = named_query('lab_slot', [lab_slot_id], one=True)
     
     if not academic_year or not lab_slot:
         flash('Academic year or lab slot not found', 'danger')
         return redirect(url_for('academic_year_index'))
     
     try:
-        # Get students with their team numbers and attendance
-        students = query_db('''
-            SELECT 
-                s.student_id, 
-                s.name, 
-                s.email, 
-                s.username,
-                st.team_number,
-                (SELECT COUNT(*) FROM Attendance a 
-                WHERE a.student_id = s.student_id 
-                AND a.lab_slot_id = ? 
-                AND a.academic_year_id = ? 
-                AND a.status = 'Absent') as absences
-            FROM 
-                Students s
-            INNER JOIN 
-                Enrollments e ON s.student_id = e.student_id
-            LEFT JOIN 
-                StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
-            WHERE 
-                e.lab_slot_id = ? AND e.academic_year_id = ?
-            ORDER BY 
-                st.team_number, s.name
-        ''', [lab_slot_id, academic_year_id, lab_slot_id, lab_slot_id, academic_year_id])
-        
-        # Convert to pandas DataFrame
-        data = []
-        for student in students:
-            student_dict = dict(student)
-            data.append(student_dict)
+        # Students with their team numbers, absences and one column per graded exercise
+        students, grades = grade_matrix(academic_year_id, lab_slot_id)
         
-        if not data:
+        if students.empty:
             flash('No student data found for this lab slot', 'warning')
             return redirect(url_for('students_show', academic_year_id=academic_year_id))
-            
-        df = pd.DataFrame(data)
         
-        # Get grades for each student
-        grades = query_db('''
-            SELECT 
-                g.student_id,
-                g.exercise_slot,
-                g.grade
-            FROM 
-                Grades g
-            WHERE 
-                g.lab_slot_id = ? AND g.academic_year_id = ?
-        ''', [lab_slot_id, academic_year_id])
-        
-        # Create a pivot table for grades
-        if grades:
-            grades_data = []
-            for grade in grades:
-                grades_data.append(dict(grade))
-            
-            grades_df = pd.DataFrame(grades_data)
-            if not grades_df.empty:
-                grades_pivot = pd.pivot_table(
-                    grades_df, 
-                    values='grade', 
-                    index='student_id',
-                    columns='exercise_slot', 
-                    aggfunc='first'
-                )
-                
-                # Merge with the main DataFrame
-                df = pd.merge(
-                    df, 
-                    grades_pivot, 
-                    left_on='student_id', 
-                    right_index=True, 
-                    how='left'
-                )
+        df = students.drop(columns=['Average']) if not grades.empty else students[GRADE_MATRIX_ROSTER]
         
         # Generate filename and export to Excel
         timestamp = datetime.now().strftime("%Y.%m.%d.%H.%M.%S")
@@ -547,10 +790,7 @@ def api_lab_slots():
     if not academic_year_id:
         return jsonify({'error': 'Academic year ID is required'}), 400
     
-    lab_slots = query_db(
-        'SELECT id, name FROM LabSlots WHERE academic_year_id = ? ORDER BY name',
-        [academic_year_id]
-    )
+    lab_slots = named_query('lab_slots_for_year', [academic_year_id])
     
     lab_slots_data = []
     for slot in lab_slots:
@@ -599,9 +839,9 @@ def api_lab_slots_for_transfer():
 # Teams management routes
 @app.route('/teams/')
 def teams_index():
-    academic_years = query_db('SELECT id, semester, year FROM AcademicYear ORDER BY year, semester')
+    academic_years = named_query('academic_years')
     
-    # Get lab slots with team info
+    # Get lab slots with team info (counts kept current by triggers)
     lab_slots_with_teams = query_db('''
         SELECT 
             l.id, 
@@ -609,16 +849,14 @@ def teams_index():
             l.academic_year_id,
             a.semester as academic_year_semester,
             a.year as academic_year_year,
-            COUNT(DISTINCT st.team_number) as team_count,
-            COUNT(DISTINCT st.student_id) as student_count
+            COALESCE(ls.team_count, 0) as team_count,
+            COALESCE(ls.team_member_count, 0) as student_count
         FROM 
             LabSlots l
         LEFT JOIN 
-            StudentTeams st ON l.id = st.lab_slot_id
+            LabSlotStats ls ON l.id = ls.lab_slot_id
         JOIN 
             AcademicYear a ON l.academic_year_id = a.id
-        GROUP BY 
-            l.id
         ORDER BY 
             a.year DESC, a.semester, l.name
     ''')
@@ -636,42 +874,21 @@ def teams_assign():
         flash('Please select an academic year and lab slot', 'danger')
         return redirect(url_for('teams_index'))
     
-    academic_year = query_db('SELECT id, semester, year FROM AcademicYear WHERE id = ?', 
-                           [academic_year_id], one=True)
-    lab_slot = query_db('SELECT id, name FROM LabSlots WHERE id = ?', 
-                      [lab_slot_id], one=True)
+    academic_year = named_query('academic_year', [academic_year_id], one=True)
+    lab_slot = named_query('lab_slot', [lab_slot_id], one=True)
     
     if not academic_year or not lab_slot:
         flash('Academic year or lab slot not found', 'danger')
         return redirect(url_for('teams_index'))
     
-    # Get students with their team assignments (if any)
-    students = query_db('''
-        SELECT 
-            s.student_id, 
-            s.name, 
-            s.email,
-            st.team_number
-        FROM 
-            Students s
-        JOIN 
-            Enrollments e ON s.student_id = e.student_id
-        LEFT JOIN 
-            StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
-        WHERE 
-            e.lab_slot_id = ? AND e.academic_year_id = ?
-        ORDER BY 
-            s.name
-    ''', [lab_slot_id, lab_slot_id, academic_year_id])
+    # Get students with their team assignments (if any), listed by name
+    students = named_query('lab_roster_with_teams', [lab_slot_id, lab_slot_id, academic_year_id])
+    students = sorted(students, key=lambda student: student['name'])
     
     # Count existing teams
-    teams_count = query_db('''
-        SELECT COUNT(DISTINCT team_number) as count
-        FROM StudentTeams
-        WHERE lab_slot_id = ?
-    ''', [lab_slot_id], one=True)
+    lab_slot_stats = named_query('lab_slot_stats', [lab_slot_id], one=True)
     
-    teams_count = teams_count['count'] if teams_count and teams_count['count'] else 5
+    teams_count = lab_slot_stats['team_count'] if lab_slot_stats and lab_slot_stats['team_count'] else 5
     
     return render_template('teams/assign.html',
                           academic_year=academic_year,
@@ -690,17 +907,8 @@ def teams_assign_process():
         flash('Invalid request parameters', 'danger')
         return redirect(url_for('teams_index'))
     
-    # Delete existing team assignments for this lab slot
-    modify_db('DELETE FROM StudentTeams WHERE lab_slot_id = ?', [lab_slot_id])
-    
     # Get students for this lab slot
-    students = query_db('''
-        SELECT s.student_id
-        FROM Students s
-        JOIN Enrollments e ON s.student_id = e.student_id
-        WHERE e.lab_slot_id = ? AND e.academic_year_id = ?
-        ORDER BY s.name
-    ''', [lab_slot_id, academic_year_id])
+    students = named_query('lab_roster', [lab_slot_id, academic_year_id])
     
     if assignment_method == 'auto':
         # Randomly assign students to teams
@@ -710,6 +918,8 @@ def teams_assign_process():
         
         total_students = len(student_ids)
         if total_students == 0:
+            # Delete existing team assignments for this lab slot
+            named_modify('delete_lab_teams', [lab_slot_id])
             flash('No students to assign', 'warning')
             return redirect(url_for('teams_show', 
                                   academic_year_id=academic_year_id, 
@@ -719,7 +929,8 @@ def teams_assign_process():
         students_per_team = total_students // num_teams if num_teams > 0 else 0
         extra_students = total_students % num_teams if num_teams > 0 else 0
         
-        # Assign teams
+        # Build the assignments
+        assignments = []
         current_index = 0
         for team_num in range(1, num_teams+1):
             # If there are extra students, add one more to the first 'extra_students' teams
@@ -727,18 +938,22 @@ def teams_assign_process():
             
             for i in range(team_size):
                 if current_index < total_students:
-                    try:
-                        modify_db(
-                            'INSERT INTO StudentTeams (team_number, student_id, lab_slot_id) VALUES (?, ?, ?)',
-                            [team_num, student_ids[current_index], lab_slot_id]
-                        )
-                        current_index += 1
-                    except Exception as e:
-                        print(f"Error assigning student {student_ids[current_index]} to team {team_num}: {e}")
-                        flash(f"Error assigning some students to teams: {e}", "danger")
-        
-        flash(f'Successfully assigned {total_students} students to {num_teams} teams', 'success')
+                    assignments.append((team_num, student_ids[current_index], lab_slot_id))
+                    current_index += 1
+        
+        # Replace the lab slot's teams in a single transaction
+        try:
+            with transaction():
+                named_modify('delete_lab_teams', [lab_slot_id])
+                named_many('insert_team', assignments)
+            flash(f'Successfully assigned {total_students} students to {num_teams} teams', 'success')
+        except Exception as e:
+            print(f"Error assigning students to teams: {e}")
+            flash(f"Error assigning some students to teams: {e}", "danger")
     else:
+        # Delete existing team assignments for this lab slot
+        named_modify('delete_lab_teams', [lab_slot_id])
+        
         # For manual assignment, just set up for manual assignment in the next page
         flash('Please assign students to teams manually', 'info')
     
@@ -755,32 +970,15 @@ def teams_show():
         flash('Please select an academic year and lab slot', 'danger')
         return redirect(url_for('teams_index'))
     
-    academic_year = query_db('SELECT id, semester, year FROM AcademicYear WHERE id = ?', 
-                           [academic_year_id], one=True)
-    lab_slot = query_db('SELECT id, name FROM LabSlots WHERE id = ?', 
-                      [lab_slot_id], one=True)
+    academic_year = named_query('academic_year', [academic_year_id], one=True)
+    lab_slot = named_query('lab_slot', [lab_slot_id], one=True)
     
     if not academic_year or not lab_slot:
         flash('Academic year or lab slot not found', 'danger')
         return redirect(url_for('teams_index'))
     
     # Get students with their teams
-    students = query_db('''
-        SELECT 
-            s.student_id, 
-            s.name,
-            st.team_number
-        FROM 
-            Students s
-        JOIN 
-            Enrollments e ON s.student_id = e.student_id
-        LEFT JOIN 
-            StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
-        WHERE 
-            e.lab_slot_id = ? AND e.academic_year_id = ?
-        ORDER BY 
-            st.team_number, s.name
-    ''', [lab_slot_id, lab_slot_id, academic_year_id])
+    students = named_query('lab_roster_with_teams', [lab_slot_id, lab_slot_id, academic_year_id])
     
     # Organize students by team
     teams = {}
@@ -813,26 +1011,24 @@ def teams_manual_assign():
         return redirect(url_for('teams_index'))
     
     # Get all students for this lab slot
-    students = query_db('''
-        SELECT s.student_id
-        FROM Students s
-        JOIN Enrollments e ON s.student_id = e.student_id
-        WHERE e.lab_slot_id = ? AND e.academic_year_id = ?
-    ''', [lab_slot_id, academic_year_id])
+    students = named_query('lab_roster', [lab_slot_id, academic_year_id])
     
-    # Delete existing team assignments for this lab slot
-    modify_db('DELETE FROM StudentTeams WHERE lab_slot_id = ?', [lab_slot_id])
-    
-    # Insert new team assignments
+    # Collect the new team assignments and the students left without a team
+    assignments = []
+    unassigned = []
     for student in students:
         student_id = student['student_id']
         team_num = request.form.get(f'team_{student_id}', '')
         
         if team_num.strip():
-            modify_db(
-                'INSERT INTO StudentTeams (team_number, student_id, lab_slot_id) VALUES (?, ?, ?)',
-                [int(team_num), student_id, lab_slot_id]
-            )
+            assignments.append((int(team_num), student_id, lab_slot_id))
+        else:
+            unassigned.append((student_id, lab_slot_id))
+    
+    # Upsert on (student_id, lab_slot_id) in one transaction
+    with transaction():
+        named_many('upsert_team', assignments)
+        named_many('delete_team', unassigned)
     
     flash('Team assignments saved successfully', 'success')
     return redirect(url_for('teams_show', 
@@ -851,35 +1047,15 @@ def update_base_links():
 # Attendance management routes
 @app.route('/attendance/')
 def attendance_index():
-    academic_years = query_db('SELECT id, semester, year FROM AcademicYear ORDER BY year, semester')
+    academic_years = named_query('academic_years')
     
-    # Get recent attendance records
-    recent_records = query_db('''
-        SELECT 
-            a.academic_year_id,
-            a.lab_slot_id,
-            a.exercise_slot,
-            MAX(a.timestamp) as timestamp,
-            ac.semester || ' ' || ac.year as academic_year_name,
-            l.name as lab_slot_name,
-            SUM(CASE WHEN a.status = 'Present' THEN 1 ELSE 0 END) as present_count,
-            SUM(CASE WHEN a.status = 'Absent' THEN 1 ELSE 0 END) as absent_count
-        FROM 
-            Attendance a
-        JOIN 
-            AcademicYear ac ON a.academic_year_id = ac.id
-        JOIN 
-            LabSlots l ON a.lab_slot_id = l.id
-        GROUP BY 
-            a.academic_year_id, a.lab_slot_id, a.exercise_slot
-        ORDER BY 
-            timestamp DESC
-        LIMIT 10
-    ''')
+    # Recent sessions, one keyset page of the trigger-maintained Sessions table
+    recent_records, next_before = session_page('attendance_sessions')
     
     return render_template('attendance/index.html', 
                           academic_years=academic_years,
-                          recent_records=recent_records)
+                          recent_records=recent_records,
+                          next_before=next_before)
 
 @app.route('/attendance/record/')
 def attendance_record():
@@ -891,35 +1067,15 @@ def attendance_record():
         flash('Please provide all required parameters', 'danger')
         return redirect(url_for('attendance_index'))
     
-    academic_year = query_db('SELECT id, semester, year FROM AcademicYear WHERE id = ?', 
-                           [academic_year_id], one=True)
-    lab_slot = query_db('SELECT id, name FROM LabSlots WHERE id = ?', 
-                      [lab_slot_id], one=True)
+    academic_year = named_query('academic_year', [academic_year_id], one=True)
+    lab_slot = named_query('lab_slot', [lab_slot_id], one=True)
     
     if not academic_year or not lab_slot:
         flash('Academic year or lab slot not found', 'danger')
         return redirect(url_for('attendance_index'))
     
     # Get students with their status (if recorded before)
-    students = query_db('''
-        SELECT 
-            s.student_id, 
-            s.name,
-            st.team_number,
-            COALESCE(a.status, 'Present') as status
-        FROM 
-            Students s
-        JOIN 
-            Enrollments e ON s.student_id = e.student_id
-        LEFT JOIN 
-            StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
-        LEFT JOIN 
-            Attendance a ON s.student_id = a.student_id AND a.lab_slot_id = ? AND a.exercise_slot = ? AND a.academic_year_id = ?
-        WHERE 
-            e.lab_slot_id = ? AND e.academic_year_id = ?
-        ORDER BY 
-            st.team_number, s.name
-    ''', [lab_slot_id, lab_slot_id, exercise_slot, academic_year_id, lab_slot_id, academic_year_id])
+    students = named_query('attendance_sheet', [lab_slot_id, lab_slot_id, exercise_slot, academic_year_id, lab_slot_id, academic_year_id])
     
     return render_template('attendance/record.html',
                           academic_year=academic_year,
@@ -927,6 +1083,26 @@ def attendance_record():
                           exercise_slot=exercise_slot,
                           students=students)
 
+ATTENDANCE_STATUSES = ('Present', 'Absent')
+
+def attendance_changes(academic_year_id, lab_slot_id, exercise_slot, statuses, fill_absent=True):
+    """Roster student IDs and the upsert_attendance rows that apply {student_id: status}.
+
+    With `fill_absent`, roster students missing from `statuses` are recorded
+    Absent, like an unanswered form row; otherwise they are left as they are.
+    IDs outside the roster are ignored. Only rows whose status changed are
+    returned, so the others keep their timestamp and replenishment note.
+    """
+    roster = [row['student_id'] for row in named_query('lab_roster', [lab_slot_id, academic_year_id])]
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    current = sheet_values('attendance_sheet_values', lab_slot_id, exercise_slot, academic_year_id)
+    rows = []
+    for student_id in roster:
+        status = statuses.get(student_id, 'Absent' if fill_absent else None)
+        if status is not None and current.get(student_id) != status:
+            rows.append((student_id, lab_slot_id, exercise_slot, status, timestamp, academic_year_id))
+    return roster, rows
+
 @app.route('/attendance/save/', methods=['POST'])
 def attendance_save():
     academic_year_id = request.form.get('academic_year_id', type=int)
@@ -937,38 +1113,17 @@ def attendance_save():
         flash('Invalid request parameters', 'danger')
         return redirect(url_for('attendance_index'))
     
-    # Get all students for this lab slot
-    students = query_db('''
-        SELECT s.student_id
-        FROM Students s
-        JOIN Enrollments e ON s.student_id = e.student_id
-        WHERE e.lab_slot_id = ? AND e.academic_year_id = ?
-    ''', [lab_slot_id, academic_year_id])
+    statuses = {
+        key[len('status_'):]: value for key, value in request.form.items() if key.startswith('status_')
+    }
     
-    # Delete existing attendance records for this slot and exercise
     try:
-        modify_db('''
-            DELETE FROM Attendance 
-            WHERE lab_slot_id = ? AND exercise_slot = ? AND academic_year_id = ?
-        ''', [lab_slot_id, exercise_slot, academic_year_id])
+        roster, rows = attendance_changes(academic_year_id, lab_slot_id, exercise_slot, statuses)
+        if rows:
+            with transaction():
+                named_many('upsert_attendance', rows)
         
-        # Insert new attendance records
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        count = 0
-        
-        for student in students:
-            student_id = student['student_id']
-            status = request.form.get(f'status_{student_id}', 'Absent')  # Default to absent if not specified
-            
-            modify_db(
-                '''INSERT INTO Attendance 
-                (student_id, lab_slot_id, exercise_slot, status, timestamp, academic_year_id) 
-                VALUES (?, ?, ?, ?, ?, ?)''',
-                [student_id, lab_slot_id, exercise_slot, status, timestamp, academic_year_id]
-            )
-            count += 1
-        
-        flash(f'Attendance recorded for {count} students', 'success')
+        flash(f'Attendance recorded for {len(roster)} students ({len(rows)} changed)', 'success')
     except Exception as e:
         flash(f'Error saving attendance: {str(e)}', 'danger')
         print(f"Error saving attendance: {str(e)}")
@@ -978,6 +1133,49 @@ def attendance_save():
                           lab_slot_id=lab_slot_id,
                           exercise_slot=exercise_slot))
 
+@app.route('/api/attendance/save', methods=['POST'])
+def api_attendance_save():
+    # The record page saves the whole session in place: {"statuses": {student_id: status}, ...}.
+    # Only the students sent are written; the page sends every roster student
+    data = request.get_json(silent=True) or {}
+    academic_year_id = data.get('academic_year_id')
+    lab_slot_id = data.get('lab_slot_id')
+    exercise_slot = data.get('exercise_slot')
+    statuses = data.get('statuses')
+    
+    if not academic_year_id or not lab_slot_id or not exercise_slot or not isinstance(statuses, dict):
+        return jsonify({
+            'success': False,
+            'error': 'Academic year ID, lab slot ID, exercise slot and statuses are required'
+        }), 400
+    
+    invalid = sorted(student_id for student_id, status in statuses.items() if status not in ATTENDANCE_STATUSES)
+    if invalid:
+        return jsonify({'success': False, 'error': f"Invalid status for: {', '.join(invalid)}"}), 400
+    
+    try:
+        roster, rows = attendance_changes(academic_year_id, lab_slot_id, exercise_slot, statuses, fill_absent=False)
+        unknown = sorted(set(statuses) - set(roster))
+        if unknown:
+            return jsonify({'success': False, 'error': f"Not enrolled in this lab slot: {', '.join(unknown)}"}), 400
+        
+        if rows:
+            with transaction():
+                named_many('upsert_attendance', rows)
+        
+        # Counts of the session as stored, from its trigger-maintained Sessions row
+        counts = named_query('session_attendance_counts', [academic_year_id, lab_slot_id, exercise_slot], one=True)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    return jsonify({
+        'success': True,
+        'changed': len(rows),
+        'total': len(roster),
+        'present': counts['present_count'] if counts else 0,
+        'absent': counts['absent_count'] if counts else 0,
+    })
+
 @app.route('/attendance/view/')
 def attendance_view():
     academic_year_id = request.args.get('academic_year_id', type=int)
@@ -988,74 +1186,34 @@ def attendance_view():
         flash('Please provide all required parameters', 'danger')
         return redirect(url_for('attendance_index'))
     
-    academic_year = query_db('SELECT id, semester, year FROM AcademicYear WHERE id = ?', 
-                           [academic_year_id], one=True)
-    lab_slot = query_db('SELECT id, name FROM LabSlots WHERE id = ?', 
-                      [lab_slot_id], one=True)
+    academic_year = named_query('academic_year', [academic_year_id], one=True)
+    lab_slot = named_query('lab_slot', [lab_slot_id], one=True)
     
     if not academic_year or not lab_slot:
         flash('Academic year or lab slot not found', 'danger')
         return redirect(url_for('attendance_index'))
     
-    # Check if replenishment_note column exists
-    column_exists = True
-    try:
-        # Try a test query
-        get_db().execute('SELECT replenishment_note FROM Attendance LIMIT 1')
-    except sqlite3.OperationalError:
-        column_exists = False
-    
-    # Get attendance records with student details
-    if column_exists:
-        # Use query with replenishment_note
-        attendance_records = query_db('''
-            SELECT 
-                s.student_id, 
-                s.name,
-                st.team_number,
-                a.status,
-                a.timestamp,
-                a.replenishment_note
-            FROM 
-                Attendance a
-            JOIN 
-                Students s ON a.student_id = s.student_id
-            LEFT JOIN 
-                StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
-            WHERE 
-                a.lab_slot_id = ? AND a.exercise_slot = ? AND a.academic_year_id = ?
-            ORDER BY 
-                st.team_number, s.name
-        ''', [lab_slot_id, lab_slot_id, exercise_slot, academic_year_id])
-    else:
-        # Use query without replenishment_note
-        attendance_basic = query_db('''
-            SELECT 
-                s.student_id, 
-                s.name,
-                st.team_number,
-                a.status,
-                a.timestamp
-            FROM 
-                Attendance a
-            JOIN 
-                Students s ON a.student_id = s.student_id
-            LEFT JOIN 
-                StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
-            WHERE 
-                a.lab_slot_id = ? AND a.exercise_slot = ? AND a.academic_year_id = ?
-            ORDER BY 
-                st.team_number, s.name
-        ''', [lab_slot_id, lab_slot_id, exercise_slot, academic_year_id])
-        
-        # Convert Row objects to dictionaries first
-        attendance_basic = [dict(record) for record in attendance_basic]
-        
-        # Add empty replenishment_note field
-        attendance_records = []
-        for record in attendance_basic:
-            record['replenishment_note'] = None
-            attendance_records.append(record)
+    # Get attendance records with student details (note is NULL on unmigrated databases)
+    replenishment_note = get_schema().column_or_null('Attendance', 'a', 'replenishment_note')
+    attendance_records = query_db(f'''
+        SELECT 
+            s.student_id, 
+            s.name,
+            st.team_number,
+            a.status,
+            a.timestamp,
+            {replenishment_note}
+        FROM 
+            Attendance a
+        JOIN 
+            Students s ON a.student_id = s.student_id
+        LEFT JOIN 
+            StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
+        WHERE 
+            a.lab_slot_id = ? AND a.exercise_slot = ? AND a.academic_year_id = ?
+        ORDER BY 
+            st.team_number, s.name
+    ''', [lab_slot_id, lab_slot_id, exercise_slot, academic_year_id])
     
     # Calculate attendance statistics
     total_students = len(attendance_records)
@@ -1078,34 +1236,16 @@ def attendance_view():
 # Grades management routes
 @app.route('/grades/')
 def grades_index():
-    academic_years = query_db('SELECT id, semester, year FROM AcademicYear ORDER BY year, semester')
+    academic_years = named_query('academic_years')
     
-    # Get grade statistics
-    grade_records = query_db('''
-        SELECT 
-            g.academic_year_id,
-            g.lab_slot_id,
-            g.exercise_slot,
-            MAX(g.timestamp) as timestamp,
-            ac.semester || ' ' || ac.year as academic_year_name,
-            l.name as lab_slot_name,
-            COUNT(g.id) as students_count,
-            AVG(g.grade) as average_grade
-        FROM 
-            Grades g
-        JOIN 
-            AcademicYear ac ON g.academic_year_id = ac.id
-        JOIN 
-            LabSlots l ON g.lab_slot_id = l.id
-        GROUP BY 
-            g.academic_year_id, g.lab_slot_id, g.exercise_slot
-        ORDER BY 
-            timestamp DESC
-    ''')
+    # Graded sessions with their statistics, one keyset page of the Sessions table
+    rows, next_before = session_page('grade_sessions')
+    grade_records = [dict(row, stats=from_aggregates(row)) for row in rows]
     
     return render_template('grades/index.html', 
                           academic_years=academic_years,
-                          grade_records=grade_records)
+                          grade_records=grade_records,
+                          next_before=next_before)
 
 @app.route('/grades/insert/')
 def grades_insert():
@@ -1117,35 +1257,15 @@ def grades_insert():
         flash('Please provide all required parameters', 'danger')
         return redirect(url_for('grades_index'))
     
-    academic_year = query_db('SELECT id, semester, year FROM AcademicYear WHERE id = ?', 
-                           [academic_year_id], one=True)
-    lab_slot = query_db('SELECT id, name FROM LabSlots WHERE id = ?', 
-                      [lab_slot_id], one=True)
+    academic_year = named_query('academic_year', [academic_year_id], one=True)
+    lab_slot = named_query('lab_slot', [lab_slot_id], one=True)
     
     if not academic_year or not lab_slot:
         flash('Academic year or lab slot not found', 'danger')
         return redirect(url_for('grades_index'))
     
     # Get students with their grades (if entered before)
-    students = query_db('''
-        SELECT 
-            s.student_id, 
-            s.name,
-            st.team_number,
-            g.grade
-        FROM 
-            Students s
-        JOIN 
-            Enrollments e ON s.student_id = e.student_id
-        LEFT JOIN 
-            StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
-        LEFT JOIN 
-            Grades g ON s.student_id = g.student_id AND g.lab_slot_id = ? AND g.exercise_slot = ? AND g.academic_year_id = ?
-        WHERE 
-            e.lab_slot_id = ? AND e.academic_year_id = ?
-        ORDER BY 
-            st.team_number, s.name
-    ''', [lab_slot_id, lab_slot_id, exercise_slot, academic_year_id, lab_slot_id, academic_year_id])
+    students = named_query('grade_sheet', [lab_slot_id, lab_slot_id, exercise_slot, academic_year_id, lab_slot_id, academic_year_id])
     
     return render_template('grades/insert.html',
                           academic_year=academic_year,
@@ -1164,23 +1284,14 @@ def grades_save():
         return redirect(url_for('grades_index'))
     
     # Get all students for this lab slot
-    students = query_db('''
-        SELECT s.student_id
-        FROM Students s
-        JOIN Enrollments e ON s.student_id = e.student_id
-        WHERE e.lab_slot_id = ? AND e.academic_year_id = ?
-    ''', [lab_slot_id, academic_year_id])
+    students = named_query('lab_roster', [lab_slot_id, academic_year_id])
     
     try:
-        # Delete existing grade records for this slot and exercise
-        modify_db('''
-            DELETE FROM Grades 
-            WHERE lab_slot_id = ? AND exercise_slot = ? AND academic_year_id = ?
-        ''', [lab_slot_id, exercise_slot, academic_year_id])
-        
-        # Insert new grade records
+        # Collect the grades that changed and the ones that were cleared
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        count = 0
+        current = sheet_values('grade_sheet_values', lab_slot_id, exercise_slot, academic_year_id)
+        rows = []
+        cleared = []
         
         for student in students:
             student_id = student['student_id']
@@ -1189,17 +1300,22 @@ def grades_save():
             if grade_value.strip():
                 try:
                     grade = float(grade_value)
-                    modify_db(
-                        '''INSERT INTO Grades 
-                        (student_id, lab_slot_id, exercise_slot, grade, timestamp, academic_year_id) 
-                        VALUES (?, ?, ?, ?, ?, ?)''',
-                        [student_id, lab_slot_id, exercise_slot, grade, timestamp, academic_year_id]
-                    )
-                    count += 1
                 except ValueError:
                     flash(f'Invalid grade value for student {student_id}', 'warning')
-        
-        flash(f'Grades recorded for {count} students', 'success')
+                    continue
+                if current.get(student_id) != grade:
+                    rows.append((student_id, lab_slot_id, exercise_slot, grade, timestamp, academic_year_id))
+            elif student_id in current:
+                cleared.append((student_id, lab_slot_id, exercise_slot, academic_year_id))
+        
+        # Upsert the changed grades on the sheet's natural key in one transaction
+        if rows or cleared:
+            with transaction():
+                named_many('upsert_grade', rows)
+                named_many('delete_grade', cleared)
+        count = len(rows) + len(cleared)
+        
+        flash(f'Grades saved ({count} changed)', 'success')
     except Exception as e:
         flash(f'Error saving grades: {str(e)}', 'danger')
         print(f"Error saving grades: {str(e)}")
@@ -1209,6 +1325,116 @@ def grades_save():
                           lab_slot_id=lab_slot_id,
                           exercise_slot=exercise_slot))
 
+# Accepted header names (case-insensitive) for the grade import; the grade
+# export's per-exercise sheets use the first ones
+GRADE_IMPORT_COLUMNS = {
+    'student_id': ('Student ID', 'student_id', 'Αριθμός μητρώου'),
+    'grade': ('Grade', 'Βαθμός'),
+}
+
+def read_grade_sheet(file):
+    """Student IDs and grades of an uploaded .xlsx/.xls/.csv sheet, as stripped strings."""
+    if file.filename.lower().endswith('.csv'):
+        df = pd.read_csv(file.stream, dtype=str)
+    else:
+        df = pd.read_excel(file.stream, dtype=str)
+    
+    columns = {}
+    for column in df.columns:
+        for target, names in GRADE_IMPORT_COLUMNS.items():
+            if str(column).strip().lower() in [name.lower() for name in names]:
+                columns.setdefault(target, column)
+    missing = [names[0] for target, names in GRADE_IMPORT_COLUMNS.items() if target not in columns]
+    if missing:
+        raise ValueError(f"missing column(s): {', '.join(missing)}")
+    
+    sheet = pd.DataFrame({target: df[column].str.strip() for target, column in columns.items()})
+    # Skip rows without a student ID (blank lines, totals)
+    return sheet[sheet['student_id'].fillna('') != '']
+
+def validate_grade_sheet(sheet, roster):
+    """Parse the grades of a sheet against the roster; returns (grades, problems).
+
+    `grades` has a float 'value' column and keeps only the rows with a grade;
+    blank grades are skipped, not cleared. `problems` lists what makes the
+    sheet unusable: unknown or repeated student IDs and grades that are not
+    numbers in 0-10.
+    """
+    blank = sheet['grade'].fillna('') == ''
+    # Decimal commas are common in Greek spreadsheets
+    values = pd.to_numeric(sheet['grade'].str.replace(',', '.', regex=False), errors='coerce')
+    
+    checks = [
+        ('not enrolled in this lab slot', ~sheet['student_id'].isin(roster)),
+        ('listed more than once', sheet['student_id'].duplicated(keep=False)),
+        ('grade is not a number from 0 to 10', ~blank & ~values.between(0, 10)),
+    ]
+    problems = []
+    for message, mask in checks:
+        if mask.any():
+            student_ids = sheet.loc[mask, 'student_id'].unique()
+            listed = ', '.join(student_ids[:10]) + (' ...' if len(student_ids) > 10 else '')
+            problems.append(f'{message}: {listed}')
+    
+    return sheet.assign(value=values)[~blank], problems
+
+@app.route('/grades/import/', methods=['POST'])
+def grades_import():
+    academic_year_id = request.form.get('academic_year_id', type=int)
+    lab_slot_id = request.form.get('lab_slot_id', type=int)
+    exercise_slot = request.form.get('exercise_slot')
+    
+    if not academic_year_id or not lab_slot_id or not exercise_slot:
+        flash('Invalid request parameters', 'danger')
+        return redirect(url_for('grades_index'))
+    
+    sheet_url = url_for('grades_insert',
+                        academic_year_id=academic_year_id,
+                        lab_slot_id=lab_slot_id,
+                        exercise_slot=exercise_slot)
+    file = request.files.get('file')
+    if not file or file.filename == '':
+        flash('No file selected', 'danger')
+        return redirect(sheet_url)
+    
+    try:
+        sheet = read_grade_sheet(file)
+    except Exception as e:
+        flash(f'Error reading grade file: {str(e)}', 'danger')
+        return redirect(sheet_url)
+    
+    # Validate the whole sheet before writing any of it
+    roster = [row['student_id'] for row in named_query('lab_roster', [lab_slot_id, academic_year_id])]
+    grades, problems = validate_grade_sheet(sheet, roster)
+    if problems:
+        for problem in problems:
+            flash(f'Grades not imported, {problem}', 'danger')
+        return redirect(sheet_url)
+    
+    try:
+        # Upsert the grades that changed in one transaction
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        current = sheet_values('grade_sheet_values', lab_slot_id, exercise_slot, academic_year_id)
+        rows = [
+            (student_id, lab_slot_id, exercise_slot, grade, timestamp, academic_year_id)
+            for student_id, grade in zip(grades['student_id'], grades['value'].tolist())
+            if current.get(student_id) != grade
+        ]
+        if rows:
+            with transaction():
+                named_many('upsert_grade', rows)
+        
+        flash(f'Imported {len(grades)} grades ({len(rows)} changed)', 'success')
+    except Exception as e:
+        flash(f'Error importing grades: {str(e)}', 'danger')
+        print(f"Error importing grades: {str(e)}")
+        return redirect(sheet_url)
+    
+    return redirect(url_for('grades_view', 
+                          academic_year_id=academic_year_id, 
+                          lab_slot_id=lab_slot_id,
+                          exercise_slot=exercise_slot))
+
 @app.route('/grades/view/')
 def grades_view():
     academic_year_id = request.args.get('academic_year_id', type=int)
@@ -1219,10 +1445,8 @@ def grades_view():
         flash('Please provide all required parameters', 'danger')
         return redirect(url_for('grades_index'))
     
-    academic_year = query_db('SELECT id, semester, year FROM AcademicYear WHERE id = ?', 
-                           [academic_year_id], one=True)
-    lab_slot = query_db('SELECT id, name FROM LabSlots WHERE id = ?', 
-                      [lab_slot_id], one=True)
+    academic_year = named_query('academic_year', [academic_year_id], one=True)
+    lab_slot = named_query('lab_slot', [lab_slot_id], one=True)
     
     if not academic_year or not lab_slot:
         flash('Academic year or lab slot not found', 'danger')
@@ -1248,33 +1472,9 @@ def grades_view():
             st.team_number, s.name
     ''', [lab_slot_id, lab_slot_id, exercise_slot, academic_year_id])
     
-    # Calculate grade statistics
-    total_students = len(grade_records)
-    if total_students > 0:
-        total_grade = sum(record['grade'] for record in grade_records if record['grade'] is not None)
-        average_grade = total_grade / total_students
-        max_grade = max((record['grade'] for record in grade_records if record['grade'] is not None), default=0)
-        min_grade = min((record['grade'] for record in grade_records if record['grade'] is not None), default=0)
-        
-        # Calculate grade distribution
-        distribution = [0] * 10  # 10 bins for grades 0-10
-        for record in grade_records:
-            if record['grade'] is not None:
-                bin_index = min(int(record['grade']), 9)  # Grade 10 goes in bin 9
-                distribution[bin_index] += 1
-    else:
-        average_grade = 0
-        max_grade = 0
-        min_grade = 0
-        distribution = [0] * 10  # Empty distribution
-    
-    grade_stats = {
-        'total': total_students,
-        'average': average_grade,
-        'max': max_grade,
-        'min': min_grade,
-        'distribution': distribution
-    }
+    # Statistics over the graded rows only (NULL grades are not zeros)
+    grade_stats = dict(summarize(record['grade'] for record in grade_records),
+                       total=len(grade_records))
     
     return render_template('grades/view.html',
                           academic_year=academic_year,
@@ -1286,68 +1486,74 @@ def grades_view():
 @app.route('/grades/final/')
 def grades_final():
     academic_year_id = request.args.get('academic_year_id', type=int)
+    academic_years = named_query('academic_years')
     
     if not academic_year_id:
-        flash('Please select an academic year', 'danger')
-        return redirect(url_for('grades_index'))
+        return render_template('grades/final.html',
+                              academic_years=academic_years,
+                              selected_year_id=None)
     
-    academic_year = query_db('SELECT id, semester, year FROM AcademicYear WHERE id = ?', 
-                           [academic_year_id], one=True)
+    academic_year = named_query('academic_year', [academic_year_id], one=True)
     
     if not academic_year:
-        flash('Academic year not found', 'danger')
-        return redirect(url_for('grades_index'))
-    
-    # Get all lab slots for this academic year
-    lab_slots = query_db('''
-        SELECT id, name 
-        FROM LabSlots 
-        WHERE academic_year_id = ?
-        ORDER BY name
-    ''', [academic_year_id])
-    
-    # Get students with their final grades
-    students = query_db('''
-        SELECT 
-            s.student_id, 
-            s.name,
-            fg.lab_average,
-            fg.jun_exam_grade,
-            fg.sep_exam_grade,
-            fg.final_grade
-        FROM 
-            Students s
-        JOIN 
-            Enrollments e ON s.student_id = e.student_id
-        LEFT JOIN 
-            FinalGrades fg ON s.student_id = fg.student_id AND fg.academic_year_id = ?
-        WHERE 
-            e.academic_year_id = ?
-        GROUP BY 
-            s.student_id
-        ORDER BY 
-            s.name
-    ''', [academic_year_id, academic_year_id])
+        flash('Academic year not found', 'danger')
+        return redirect(url_for('grades_final'))
     
-    # For each student, calculate average lab grade if not already set
-    for student in students:
-        if student['lab_average'] is None:
-            # Calculate average lab grade
-            avg_grades = query_db('''
-                SELECT AVG(grade) as avg_grade
-                FROM Grades
-                WHERE student_id = ? AND academic_year_id = ?
-            ''', [student['student_id'], academic_year_id], one=True)
-            
-            if avg_grades and avg_grades['avg_grade']:
-                student['calculated_lab_average'] = round(avg_grades['avg_grade'], 2)
-            else:
-                student['calculated_lab_average'] = 0
+    # Read from the FinalGrades view, so the grades are always current
+    final_grades = named_query('final_grade_sheet', [academic_year_id])
+    policy = GradingPolicy.from_row(
+        named_query('grading_policy', {'academic_year_id': academic_year_id}, one=True)
+    )
+    
+    graded = [student['final_grade'] for student in final_grades if student['final_grade'] is not None]
+    distribution = [0] * 10
+    for grade in graded:
+        distribution[min(max(int(grade), 0), 9)] += 1
+    grade_stats = {
+        'total': len(final_grades),
+        'passed': sum(1 for grade in graded if grade >= PASS_GRADE),
+        'failed': sum(1 for grade in graded if grade < PASS_GRADE),
+        'average': sum(graded) / len(graded) if graded else 0,
+        'distribution': distribution
+    }
     
     return render_template('grades/final.html',
-                          academic_year=academic_year,
-                          lab_slots=lab_slots,
-                          students=students)
+                          academic_years=academic_years,
+                          selected_year_id=academic_year_id,
+                          selected_year=academic_year,
+                          final_grades=final_grades,
+                          grade_stats=grade_stats,
+                          final_grade_requires_exam=True,
+                          policy=policy)
+
+@app.route('/grades/final/policy/', methods=['POST'])
+def grades_final_policy():
+    academic_year_id = request.form.get('academic_year_id', type=int)
+    lab_weight = request.form.get('lab_weight', type=float)
+    exam_weight = request.form.get('exam_weight', type=float)
+    
+    if not academic_year_id or lab_weight is None or exam_weight is None:
+        flash('Invalid request parameters', 'danger')
+        return redirect(url_for('grades_final'))
+    
+    policy = GradingPolicy(lab_weight, exam_weight)
+    try:
+        policy.validate()
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('grades_final', academic_year_id=academic_year_id))
+    
+    # The FinalGrades view picks up the new weights on its next read
+    named_modify('set_grading_policy', policy.params(academic_year_id))
+    flash('Grading policy saved', 'success')
+    
+    return redirect(url_for('grades_final', academic_year_id=academic_year_id))
+
+def parse_grade(value):
+    """Float for a submitted grade, None for a blank one; raises ValueError otherwise."""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    return float(value)
 
 @app.route('/grades/final/save/', methods=['POST'])
 def grades_final_save():
@@ -1358,56 +1564,28 @@ def grades_final_save():
         return redirect(url_for('grades_index'))
     
     # Get all students for this academic year
-    students = query_db('''
-        SELECT DISTINCT s.student_id
-        FROM Students s
-        JOIN Enrollments e ON s.student_id = e.student_id
-        WHERE e.academic_year_id = ?
-    ''', [academic_year_id])
+    students = named_query('year_roster', [academic_year_id])
     
     try:
-        count = 0
+        rows = []
         for student in students:
             student_id = student['student_id']
             
-            lab_average = request.form.get(f'lab_average_{student_id}', '')
-            jun_exam = request.form.get(f'jun_exam_{student_id}', '')
-            sep_exam = request.form.get(f'sep_exam_{student_id}', '')
-            
-            # Calculate final grade - take best of Jun or Sep exam
             try:
-                lab_avg = float(lab_average) if lab_average.strip() else 0
-                jun_grade = float(jun_exam) if jun_exam.strip() else 0
-                sep_grade = float(sep_exam) if sep_exam.strip() else 0
-                
-                best_exam = max(jun_grade, sep_grade)
-                final_grade = 0.5 * lab_avg + 0.5 * best_exam if best_exam > 0 else 0
+                lab_avg = parse_grade(request.form.get(f'lab_average_{student_id}', ''))
+                jun_grade = parse_grade(request.form.get(f'jun_exam_{student_id}', ''))
+                sep_grade = parse_grade(request.form.get(f'sep_exam_{student_id}', ''))
             except ValueError:
                 flash(f'Invalid grade value for student {student_id}', 'warning')
                 continue
             
-            # Check if record exists
-            existing = query_db('''
-                SELECT id FROM FinalGrades
-                WHERE student_id = ? AND academic_year_id = ?
-            ''', [student_id, academic_year_id], one=True)
-            
-            if existing:
-                # Update existing record
-                modify_db('''
-                    UPDATE FinalGrades
-                    SET lab_average = ?, jun_exam_grade = ?, sep_exam_grade = ?, final_grade = ?
-                    WHERE student_id = ? AND academic_year_id = ?
-                ''', [lab_avg, jun_grade, sep_grade, final_grade, student_id, academic_year_id])
-            else:
-                # Insert new record
-                modify_db('''
-                    INSERT INTO FinalGrades
-                    (student_id, lab_average, jun_exam_grade, sep_exam_grade, final_grade, academic_year_id)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', [student_id, lab_avg, jun_grade, sep_grade, final_grade, academic_year_id])
-            
-            count += 1
+            rows.append(override_params(student_id, academic_year_id, lab_avg, jun_grade, sep_grade))
+        
+        # Only values that differ from the computed ones are kept as overrides
+        with transaction():
+            named_many('save_final_grade_override', rows)
+            named_many('prune_final_grade_override', rows)
+        count = len(rows)
         
         flash(f'Final grades saved for {count} students', 'success')
     except Exception as e:
@@ -1416,6 +1594,38 @@ def grades_final_save():
     
     return redirect(url_for('grades_final', academic_year_id=academic_year_id))
 
+@app.route('/api/final_grades/update', methods=['POST'])
+def api_final_grades_update():
+    data = request.get_json(silent=True) or {}
+    academic_year_id = data.get('academic_year_id')
+    student_id = data.get('student_id')
+    
+    if not academic_year_id or not student_id:
+        return jsonify({'success': False, 'error': 'Academic year ID and student ID are required'}), 400
+    
+    current = named_query('final_grade', [student_id, academic_year_id], one=True)
+    if not current:
+        return jsonify({'success': False, 'error': 'Student is not enrolled in this academic year'}), 404
+    
+    try:
+        # Inputs the page does not send keep their current value
+        row = override_params(
+            student_id,
+            academic_year_id,
+            parse_grade(data.get('lab_average', current['lab_average'])),
+            parse_grade(data.get('jun_exam_grade', current['jun_exam_grade'])),
+            parse_grade(data.get('sep_exam_grade', current['sep_exam_grade']))
+        )
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Invalid grade value'}), 400
+    
+    with transaction():
+        named_many('save_final_grade_override', [row])
+        named_many('prune_final_grade_override', [row])
+    
+    updated = named_query('final_grade', [student_id, academic_year_id], one=True)
+    return jsonify({'success': True, **dict(updated)})
+
 # Enhanced student management
 @app.route('/students/detail/<string:student_id>/')
 def student_detail(student_id):
@@ -1569,15 +1779,16 @@ def student_delete(student_id):
         return redirect(url_for('students_index'))
     
     try:
-        # Delete related records first
-        modify_db('DELETE FROM Enrollments WHERE student_id = ?', [student_id])
-        modify_db('DELETE FROM StudentTeams WHERE student_id = ?', [student_id])
-        modify_db('DELETE FROM Attendance WHERE student_id = ?', [student_id])
-        modify_db('DELETE FROM Grades WHERE student_id = ?', [student_id])
-        modify_db('DELETE FROM FinalGrades WHERE student_id = ?', [student_id])
-        
-        # Delete student
-        modify_db('DELETE FROM Students WHERE student_id = ?', [student_id])
+        with transaction():
+            # Delete related records first
+            modify_db('DELETE FROM Enrollments WHERE student_id = ?', [student_id])
+            modify_db('DELETE FROM StudentTeams WHERE student_id = ?', [student_id])
+            modify_db('DELETE FROM Attendance WHERE student_id = ?', [student_id])
+            modify_db('DELETE FROM Grades WHERE student_id = ?', [student_id])
+            modify_db('DELETE FROM FinalGradeOverrides WHERE student_id = ?', [student_id])
+            
+            # Delete student
+            modify_db('DELETE FROM Students WHERE student_id = ?', [student_id])
         
         flash('Student and all related records deleted successfully', 'success')
     except Exception as e:
@@ -1649,23 +1860,25 @@ def transfer_student(student_id):
             flash('Student is not enrolled in the selected academic year', 'danger')
             return redirect(url_for('transfer_student', student_id=student_id))
         
-        # Update enrollment with the new lab slot
-        modify_db(
-            'UPDATE Enrollments SET lab_slot_id = ? WHERE student_id = ? AND academic_year_id = ?',
-            [new_lab_slot_id, student_id, academic_year_id]
-        )
+        # Move the enrollment, attendance and grades together
+        with transaction():
+            # Update enrollment with the new lab slot
+            modify_db(
+                'UPDATE Enrollments SET lab_slot_id = ? WHERE student_id = ? AND academic_year_id = ?',
+                [new_lab_slot_id, student_id, academic_year_id]
+            )
         
-        # Update attendance records to the new lab slot
-        modify_db(
-            'UPDATE Attendance SET lab_slot_id = ? WHERE student_id = ? AND academic_year_id = ?',
-            [new_lab_slot_id, student_id, academic_year_id]
-        )
+            # Update attendance records to the new lab slot
+            modify_db(
+                'UPDATE Attendance SET lab_slot_id = ? WHERE student_id = ? AND academic_year_id = ?',
+                [new_lab_slot_id, student_id, academic_year_id]
+            )
         
-        # Update grades to the new lab slot
-        modify_db(
-            'UPDATE Grades SET lab_slot_id = ? WHERE student_id = ? AND academic_year_id = ?',
-            [new_lab_slot_id, student_id, academic_year_id]
-        )
+            # Update grades to the new lab slot
+            modify_db(
+                'UPDATE Grades SET lab_slot_id = ? WHERE student_id = ? AND academic_year_id = ?',
+                [new_lab_slot_id, student_id, academic_year_id]
+            )
         
         # Get the new lab slot name
         new_lab_slot = query_db(
@@ -1692,10 +1905,7 @@ def transfer_student(student_id):
     lab_slots = []
     
     if selected_academic_year_id:
-        lab_slots = query_db(
-            'SELECT id, name FROM LabSlots WHERE academic_year_id = ? ORDER BY name',
-            [selected_academic_year_id]
-        )
+        lab_slots = named_query('lab_slots_for_year', [selected_academic_year_id])
     
     return render_template(
         'students/transfer.html',
@@ -1821,139 +2031,16 @@ def init_test_data_route():
 # Helper function to initialize the database if it doesn't exist
 def init_db():
     with app.app_context():
-        db = get_db()
-        cursor = db.cursor()
-        
-        # Create AcademicYear table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS AcademicYear (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                semester TEXT,
-                year INTEGER
-            )
-        ''')
-
-        # Create LabSlots table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS LabSlots (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                academic_year_id INTEGER,
-                FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
-            )
-        ''')
-
-        # Create Students table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Students (
-                student_id TEXT PRIMARY KEY,
-                name TEXT,
-                email TEXT,
-                registration_number TEXT,
-                username TEXT
-            )
-        ''')
-
-        # Create Enrollments table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Enrollments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id TEXT,
-                lab_slot_id INTEGER,
-                academic_year_id INTEGER,
-                FOREIGN KEY(student_id) REFERENCES Students(student_id),
-                FOREIGN KEY(lab_slot_id) REFERENCES LabSlots(id),
-                FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
-            )
-        ''')
-
-        # Create StudentTeams table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS StudentTeams (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                team_number INTEGER,
-                student_id TEXT,
-                lab_slot_id INTEGER,
-                FOREIGN KEY(student_id) REFERENCES Students(student_id),
-                FOREIGN KEY(lab_slot_id) REFERENCES LabSlots(id)
-            )
-        ''')
-
-        # Create Attendance table with lab_slot_id column
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Attendance (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id TEXT,
-                lab_slot_id INTEGER,
-                exercise_slot TEXT,
-                status TEXT,
-                timestamp TEXT,
-                academic_year_id INTEGER,
-                replenishment_note TEXT,
-                FOREIGN KEY(student_id) REFERENCES Students(student_id),
-                FOREIGN KEY(lab_slot_id) REFERENCES LabSlots(id),
-                FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
-            )
-        ''')
-
-        # Check if replenishment_note column exists in Attendance table
-        column_exists = False
-        try:
-            cursor.execute('SELECT replenishment_note FROM Attendance LIMIT 1')
-            column_exists = True
-        except sqlite3.OperationalError:
-            column_exists = False
-        
-        # Add replenishment_note column if it doesn't exist
-        if not column_exists:
-            try:
-                cursor.execute('ALTER TABLE Attendance ADD COLUMN replenishment_note TEXT')
-                print("Added replenishment_note column to Attendance table")
-            except sqlite3.OperationalError as e:
-                print(f"Error adding replenishment_note column: {e}")
-
-        # Create Grades table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Grades (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id TEXT,
-                lab_slot_id INTEGER,
-                exercise_slot TEXT,
-                grade REAL,
-                timestamp TEXT,
-                academic_year_id INTEGER,
-                FOREIGN KEY(student_id) REFERENCES Students(student_id),
-                FOREIGN KEY(lab_slot_id) REFERENCES LabSlots(id),
-                FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
-            )
-        ''')
-
-        # Create FinalGrades table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS FinalGrades (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id TEXT,
-                lab_average REAL,
-                jun_exam_grade REAL,
-                sep_exam_grade REAL,
-                final_grade REAL,
-                academic_year_id INTEGER,
-                FOREIGN KEY(student_id) REFERENCES Students(student_id),
-                FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
-            )
-        ''')
-
-        db.commit()
-        print("Database schema initialized successfully.")
+        # Bring the schema up to date through the versioned migrations
+        version = migrate(get_db(), verbose=True)
+        app.extensions['schema_version'] = version
+        app.extensions['schema_capabilities'] = SchemaCapabilities.inspect(get_db())
+        print(f"Database schema initialized successfully (version {version}).")
 
 @app.route('/export_all_data/<int:academic_year_id>/')
 def export_all_data(academic_year_id):
     # Get academic year
-    academic_year = query_db(
-        'SELECT id, semester, year FROM AcademicYear WHERE id=?',
-        [academic_year_id],
-        one=True
-    )
+    academic_year = named_query('academic_year', [academic_year_id], one=True)
     
     if not academic_year:
         flash('Academic year not found', 'danger')
@@ -1971,11 +2058,7 @@ def export_all_data(academic_year_id):
         # Get lab slot names
         lab_slots_info = {}
         for lab_slot_id in selected_lab_ids:
-            lab_slot = query_db(
-                'SELECT id, name FROM LabSlots WHERE id=?',
-                [lab_slot_id],
-                one=True
-            )
+            lab_slot = named_query('lab_slot', [lab_slot_id], one=True)
             if lab_slot:
                 lab_slots_info[lab_slot_id] = lab_slot['name']
         
@@ -2161,94 +2244,52 @@ def attendance_absences():
     
     if not academic_year_id:
         # Get all academic years for the dropdown
-        academic_years = query_db('SELECT id, semester, year FROM AcademicYear ORDER BY year, semester')
+        academic_years = named_query('academic_years')
         
         return render_template('attendance/absences.html',
                              academic_years=academic_years)
     
     # Get academic year
-    academic_year = query_db('SELECT id, semester, year FROM AcademicYear WHERE id = ?', 
-                           [academic_year_id], one=True)
+    academic_year = named_query('academic_year', [academic_year_id], one=True)
     
     if not academic_year:
         flash('Academic year not found', 'danger')
         return redirect(url_for('attendance_index'))
     
     # Get all lab slots for this academic year (for replenishment scheduling)
-    lab_slots = query_db(
-        'SELECT id, name FROM LabSlots WHERE academic_year_id = ? ORDER BY name',
-        [academic_year_id]
-    )
+    lab_slots = named_query('lab_slots_for_year', [academic_year_id])
     
     # Get all absences for this academic year
     try:
-        # Check if replenishment_note column exists
-        column_exists = True
-        try:
-            # Try a test query
-            get_db().execute('SELECT replenishment_note FROM Attendance LIMIT 1')
-        except sqlite3.OperationalError:
-            column_exists = False
+        schema = get_schema()
+        if not schema.replenishment_notes:
             # Show a flash message suggesting upgrade
             flash('Database schema needs to be upgraded to support replenishment scheduling. Please use the "Upgrade Database" option from the menu.', 'warning')
         
-        if column_exists:
-            # Use query with replenishment_note
-            absences = query_db('''
-                SELECT 
-                    a.id,
-                    s.student_id, 
-                    s.name as student_name,
-                    s.email as student_email,
-                    l.name as lab_slot_name,
-                    a.exercise_slot,
-                    a.timestamp,
-                    a.replenishment_note
-                FROM 
-                    Attendance a
-                JOIN 
-                    Students s ON a.student_id = s.student_id
-                JOIN 
-                    LabSlots l ON a.lab_slot_id = l.id
-                WHERE 
-                    a.academic_year_id = ? AND a.status = 'Absent'
-                ORDER BY 
-                    l.name, a.exercise_slot, s.name
-            ''', [academic_year_id])
-            
-            # Convert Row objects to dictionaries
-            absences = [dict(absence) for absence in absences]
-        else:
-            # Use query without replenishment_note
-            absences_basic = query_db('''
-                SELECT 
-                    a.id,
-                    s.student_id, 
-                    s.name as student_name,
-                    s.email as student_email,
-                    l.name as lab_slot_name,
-                    a.exercise_slot,
-                    a.timestamp
-                FROM 
-                    Attendance a
-                JOIN 
-                    Students s ON a.student_id = s.student_id
-                JOIN 
-                    LabSlots l ON a.lab_slot_id = l.id
-                WHERE 
-                    a.academic_year_id = ? AND a.status = 'Absent'
-                ORDER BY 
-                    l.name, a.exercise_slot, s.name
-            ''', [academic_year_id])
-            
-            # Convert Row objects to dictionaries first
-            absences_basic = [dict(absence) for absence in absences_basic]
-            
-            # Add empty replenishment_note field
-            absences = []
-            for absence in absences_basic:
-                absence['replenishment_note'] = None
-                absences.append(absence)
+        absences = query_db(f'''
+            SELECT 
+                a.id,
+                s.student_id, 
+                s.name as student_name,
+                s.email as student_email,
+                l.name as lab_slot_name,
+                a.exercise_slot,
+                a.timestamp,
+                {schema.column_or_null('Attendance', 'a', 'replenishment_note')}
+            FROM 
+                Attendance a
+            JOIN 
+                Students s ON a.student_id = s.student_id
+            JOIN 
+                LabSlots l ON a.lab_slot_id = l.id
+            WHERE 
+                a.academic_year_id = ? AND a.status = 'Absent'
+            ORDER BY 
+                l.name, a.exercise_slot, s.name
+        ''', [academic_year_id])
+        
+        # Convert Row objects to dictionaries
+        absences = [dict(absence) for absence in absences]
                 
         # Count absences per student and mark those with 2+ absences as failed
         students_absent_count = {}
@@ -2277,11 +2318,7 @@ def attendance_absences():
 @app.route('/attendance/export_absences/<int:academic_year_id>/')
 def export_absences(academic_year_id):
     # Get academic year
-    academic_year = query_db(
-        'SELECT id, semester, year FROM AcademicYear WHERE id=?',
-        [academic_year_id],
-        one=True
-    )
+    academic_year = named_query('academic_year', [academic_year_id], one=True)
     
     if not academic_year:
         flash('Academic year not found', 'danger')
@@ -2289,7 +2326,7 @@ def export_absences(academic_year_id):
     
     try:
         # Get all absences for this academic year
-        absences = query_db('''
+        absences = query_db(f'''
             SELECT 
                 s.student_id, 
                 s.name as student_name,
@@ -2297,7 +2334,7 @@ def export_absences(academic_year_id):
                 l.name as lab_slot_name,
                 a.exercise_slot,
                 a.timestamp,
-                a.replenishment_note
+                {get_schema().column_or_null('Attendance', 'a', 'replenishment_note')}
             FROM 
                 Attendance a
             JOIN 
@@ -2472,50 +2509,20 @@ def attendance_save_note():
     if not attendance_id:
         return jsonify({'status': 'error', 'message': 'Attendance ID is required'}), 400
     
+    if not get_schema().replenishment_notes:
+        return jsonify({
+            'status': 'error',
+            'message': 'Database schema needs to be upgraded to support replenishment notes'
+        }), 409
+    
     try:
-        # Check if replenishment_note column exists first
-        db = get_db()
-        column_exists = True
+        # Update the attendance record with the replenishment note
+        named_modify('update_replenishment_note', [replenishment_note, attendance_id])
         
-        try:
-            # Try a test query
-            db.execute('SELECT replenishment_note FROM Attendance LIMIT 1')
-        except sqlite3.OperationalError:
-            column_exists = False
-            
-        if not column_exists:
-            # Try to add the column
-            try:
-                print("Adding replenishment_note column to Attendance table...")
-                db.execute('ALTER TABLE Attendance ADD COLUMN replenishment_note TEXT')
-                db.commit()
-                print("Successfully added replenishment_note column.")
-                column_exists = True
-            except sqlite3.OperationalError as e:
-                error_msg = f"Could not add 'replenishment_note' column: {e}"
-                print(error_msg)
-                return jsonify({
-                    'status': 'error', 
-                    'message': 'Database needs to be upgraded. Please use the "Upgrade Database" option from the menu.'
-                }), 500
-        
-        if column_exists:
-            # Update the attendance record with the replenishment note
-            db.execute(
-                'UPDATE Attendance SET replenishment_note = ? WHERE id = ?',
-                [replenishment_note, attendance_id]
-            )
-            db.commit()
-            
-            return jsonify({
-                'status': 'success', 
-                'message': 'Replenishment scheduled successfully'
-            })
-        else:
-            return jsonify({
-                'status': 'error', 
-                'message': 'Could not save note - database needs to be upgraded'
-            }), 500
+        return jsonify({
+            'status': 'success', 
+            'message': 'Replenishment scheduled successfully'
+        })
             
     except Exception as e:
         error_msg = f"Error saving replenishment note: {str(e)}"
@@ -2525,83 +2532,36 @@ def attendance_save_note():
 @app.route('/attendance/export_view/<int:academic_year_id>/<int:lab_slot_id>/<path:exercise_slot>')
 def export_attendance_view(academic_year_id, lab_slot_id, exercise_slot):
     # Get academic year and lab slot
-    academic_year = query_db(
-        'SELECT id, semester, year FROM AcademicYear WHERE id=?',
-        [academic_year_id],
-        one=True
-    )
+    academic_year = named_query('academic_year', [academic_year_id], one=True)
     
-    lab_slot = query_db(
-        'SELECT id, name FROM LabSlots WHERE id=?',
-        [lab_slot_id],
-        one=True
-    )
+    lab_slot = named_query('lab_slot', [lab_slot_id], one=True)
     
     if not academic_year or not lab_slot:
         flash('Academic year or lab slot not found', 'danger')
         return redirect(url_for('attendance_index'))
     
     try:
-        # Check if replenishment_note column exists
-        column_exists = True
-        try:
-            # Try a test query
-            get_db().execute('SELECT replenishment_note FROM Attendance LIMIT 1')
-        except sqlite3.OperationalError:
-            column_exists = False
-        
         # Get attendance records with student details
-        if column_exists:
-            attendance_records = query_db('''
-                SELECT 
-                    s.student_id, 
-                    s.name,
-                    s.email,
-                    st.team_number,
-                    a.status,
-                    a.timestamp,
-                    a.replenishment_note
-                FROM 
-                    Attendance a
-                JOIN 
-                    Students s ON a.student_id = s.student_id
-                LEFT JOIN 
-                    StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
-                WHERE 
-                    a.lab_slot_id = ? AND a.exercise_slot = ? AND a.academic_year_id = ?
-                ORDER BY 
-                    st.team_number, s.name
-            ''', [lab_slot_id, lab_slot_id, exercise_slot, academic_year_id])
-        else:
-            # Use query without replenishment_note
-            attendance_basic = query_db('''
-                SELECT 
-                    s.student_id, 
-                    s.name,
-                    s.email,
-                    st.team_number,
-                    a.status,
-                    a.timestamp
-                FROM 
-                    Attendance a
-                JOIN 
-                    Students s ON a.student_id = s.student_id
-                LEFT JOIN 
-                    StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
-                WHERE 
-                    a.lab_slot_id = ? AND a.exercise_slot = ? AND a.academic_year_id = ?
-                ORDER BY 
-                    st.team_number, s.name
-            ''', [lab_slot_id, lab_slot_id, exercise_slot, academic_year_id])
-            
-            # Convert Row objects to dictionaries first
-            attendance_basic = [dict(record) for record in attendance_basic]
-            
-            # Add empty replenishment_note field
-            attendance_records = []
-            for record in attendance_basic:
-                record['replenishment_note'] = None
-                attendance_records.append(record)
+        attendance_records = query_db(f'''
+            SELECT 
+                s.student_id, 
+                s.name,
+                s.email,
+                st.team_number,
+                a.status,
+                a.timestamp,
+                {get_schema().column_or_null('Attendance', 'a', 'replenishment_note')}
+            FROM 
+                Attendance a
+            JOIN 
+                Students s ON a.student_id = s.student_id
+            LEFT JOIN 
+                StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
+            WHERE 
+                a.lab_slot_id = ? AND a.exercise_slot = ? AND a.academic_year_id = ?
+            ORDER BY 
+                st.team_number, s.name
+        ''', [lab_slot_id, lab_slot_id, exercise_slot, academic_year_id])
         
         if not attendance_records:
             flash('No attendance records found', 'warning')
@@ -2678,25 +2638,16 @@ def export_attendance_view(academic_year_id, lab_slot_id, exercise_slot):
 @app.route('/upgrade_database/')
 def upgrade_database():
     try:
-        # Initialize connection
-        conn = sqlite3.connect(app.config['DATABASE'])
-        cursor = conn.cursor()
+        db = get_db()
+        before = schema_version(db)
+        after = migrate(db, verbose=True)
+        app.extensions['schema_version'] = after
+        app.extensions['schema_capabilities'] = SchemaCapabilities.inspect(db)
         
-        # Check if column exists
-        column_exists = True
-        try:
-            cursor.execute('SELECT replenishment_note FROM Attendance LIMIT 1')
-            print("Column replenishment_note already exists.")
-            flash("Column replenishment_note already exists.", "info")
-        except sqlite3.OperationalError:
-            # Add the column
-            print("Adding replenishment_note column to Attendance table...")
-            cursor.execute('ALTER TABLE Attendance ADD COLUMN replenishment_note TEXT')
-            conn.commit()
-            print("Successfully added replenishment_note column.")
-            flash("Successfully added replenishment_note column to Attendance table.", "success")
-        
-        conn.close()
+        if after == before:
+            flash(f"Database schema is already up to date (version {after}).", "info")
+        else:
+            flash(f"Database schema upgraded from version {before} to {after}.", "success")
         
     except Exception as e:
         error_msg = f"Error upgrading database: {e}"
@@ -2705,49 +2656,19 @@ def upgrade_database():
     
     return redirect(url_for('dashboard'))
 
-# Function to check for the replenishment_note column
-def check_database_schema():
-    try:
-        # Check if replenishment_note column exists
-        column_exists = True
-        try:
-            # Try a test query
-            get_db().execute('SELECT replenishment_note FROM Attendance LIMIT 1')
-            print("Column 'replenishment_note' already exists in Attendance table.")
-        except sqlite3.OperationalError:
-            print("Column 'replenishment_note' does not exist in Attendance table.")
-            
-            # Add the column
-            try:
-                modify_db('ALTER TABLE Attendance ADD COLUMN replenishment_note TEXT')
-                print("Successfully added 'replenishment_note' column to Attendance table.")
-            except sqlite3.OperationalError as e:
-                print(f"Error adding replenishment_note column: {e}")
-    except Exception as e:
-        print(f"Error checking database schema: {e}")
-
-# Register a function to run before the first request
+# Apply pending migrations once per worker, for servers that skip init_db()
 @app.before_request
 def before_first_request():
-    if not getattr(app, 'schema_checked', False):
-        with app.app_context():
-            check_database_schema()
-        app.schema_checked = True
+    if app.extensions.get('schema_version') != CURRENT_VERSION:
+        app.extensions['schema_version'] = migrate(get_db())
+        app.extensions['schema_capabilities'] = SchemaCapabilities.inspect(get_db())
 
 @app.route('/teams/export/<int:academic_year_id>/<int:lab_slot_id>/')
 def export_teams(academic_year_id, lab_slot_id):
     # Get academic year and lab slot
-    academic_year = query_db(
-        'SELECT id, semester, year FROM AcademicYear WHERE id=?',
-        [academic_year_id],
-        one=True
-    )
+    academic_year = named_query('academic_year', [academic_year_id], one=True)
     
-    lab_slot = query_db(
-        'SELECT id, name FROM LabSlots WHERE id=?',
-        [lab_slot_id],
-        one=True
-    )
+    lab_slot = named_query('lab_slot', [lab_slot_id], one=True)
     
     if not academic_year or not lab_slot:
         flash('Academic year or lab slot not found', 'danger')
@@ -2755,24 +2676,7 @@ def export_teams(academic_year_id, lab_slot_id):
     
     try:
         # Get students with their team assignments
-        students = query_db('''
-            SELECT 
-                s.student_id, 
-                s.name,
-                s.email,
-                s.username,
-                st.team_number
-            FROM 
-                Students s
-            JOIN 
-                Enrollments e ON s.student_id = e.student_id
-            LEFT JOIN 
-                StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
-            WHERE 
-                e.lab_slot_id = ? AND e.academic_year_id = ?
-            ORDER BY 
-                st.team_number, s.name
-        ''', [lab_slot_id, lab_slot_id, academic_year_id])
+        students = named_query('lab_roster_with_teams', [lab_slot_id, lab_slot_id, academic_year_id])
         
         if not students:
             flash('No students found for this lab slot', 'warning')
@@ -2881,62 +2785,23 @@ def export_teams(academic_year_id, lab_slot_id):
 @app.route('/grades/export/<int:academic_year_id>/<int:lab_slot_id>/')
 def export_grades(academic_year_id, lab_slot_id):
     # Get academic year and lab slot
-    academic_year = query_db(
-        'SELECT id, semester, year FROM AcademicYear WHERE id=?',
-        [academic_year_id],
-        one=True
-    )
+    academic_year = named_query('academic_year', [academic_year_id], one=True)
     
-    lab_slot = query_db(
-        'SELECT id, name FROM LabSlots WHERE id=?',
-        [lab_slot_id],
-        one=True
-    )
+    lab_slot = named_query('lab_slot', [lab_slot_id], one=True)
     
     if not academic_year or not lab_slot:
         flash('Academic year or lab slot not found', 'danger')
         return redirect(url_for('grades_index'))
     
     try:
-        # Get all students for this lab slot
-        students = query_db('''
-            SELECT 
-                s.student_id, 
-                s.name,
-                s.email,
-                st.team_number
-            FROM 
-                Students s
-            JOIN 
-                Enrollments e ON s.student_id = e.student_id
-            LEFT JOIN 
-                StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = ?
-            WHERE 
-                e.lab_slot_id = ? AND e.academic_year_id = ?
-            ORDER BY 
-                st.team_number, s.name
-        ''', [lab_slot_id, lab_slot_id, academic_year_id])
+        # Students with their team numbers, one column per graded exercise and the average
+        students, grades = grade_matrix(academic_year_id, lab_slot_id)
         
-        if not students:
+        if students.empty:
             flash('No students found for this lab slot', 'warning')
             return redirect(url_for('grades_index'))
-            
-        # Convert student data to DataFrame
-        student_data = [dict(student) for student in students]
-        df_students = pd.DataFrame(student_data)
         
-        # Get all grades for this lab slot
-        grades = query_db('''
-            SELECT 
-                g.student_id,
-                g.exercise_slot,
-                g.grade,
-                g.timestamp
-            FROM 
-                Grades g
-            WHERE 
-                g.lab_slot_id = ? AND g.academic_year_id = ?
-        ''', [lab_slot_id, academic_year_id])
+        df_students = students[['student_id', 'name', 'email', 'team_number']]
         
         # Generate filename
         timestamp = datetime.now().strftime("%Y.%m.%d.%H.%M.%S")
@@ -2948,106 +2813,87 @@ def export_grades(academic_year_id, lab_slot_id):
             # Create different sheets for different views
             
             # Sheet 1: Student summary with all grades
-            if grades:
-                # Convert grades to DataFrame
-                grades_data = [dict(grade) for grade in grades]
-                df_grades = pd.DataFrame(grades_data)
+            if not grades.empty:
+                merged_df = students.drop(columns=['username', 'absences'])
                 
-                # Create a pivot table
-                if not df_grades.empty and 'student_id' in df_grades.columns and 'exercise_slot' in df_grades.columns and 'grade' in df_grades.columns:
-                    # Ensure the index and column values exist
-                    grades_pivot = pd.pivot_table(
-                        df_grades, 
-                        values='grade', 
-                        index='student_id',
-                        columns='exercise_slot', 
-                        aggfunc='first'
-                    )
-                    
-                    # Calculate average grade for each student
-                    grades_pivot['Average'] = grades_pivot.mean(axis=1, numeric_only=True)
+                # Rename columns for better readability
+                merged_df = merged_df.rename(columns={
+                    'student_id': 'Student ID',
+                    'name': 'Student Name',
+                    'email': 'Email',
+                    'team_number': 'Team'
+                })
+                
+                # Sort by team and student name
+                merged_df = merged_df.sort_values(by=['Team', 'Student Name'])
+                
+                # Write to Excel
+                merged_df.to_excel(writer, sheet_name="Grades Summary", index=False)
+                
+                # Get workbook and worksheet
+                workbook = writer.book
+                worksheet = writer.sheets["Grades Summary"]
+                
+                # Add filters
+                worksheet.autofilter(0, 0, len(merged_df), len(merged_df.columns) - 1)
+                
+                # Add header formatting
+                header_format = workbook.add_format({
+                    'bold': True,
+                    'bg_color': '#D3D3D3',
+                    'border': 1
+                })
+                
+                for col_num, value in enumerate(merged_df.columns.values):
+                    worksheet.write(0, col_num, value, header_format)
+                
+                # Add conditional formatting for grades
+                # Green for good grades (>=8.5), yellow for ok (>=5), red for fail (<5)
+                good_format = workbook.add_format({'bg_color': '#c6efce'})
+                ok_format = workbook.add_format({'bg_color': '#ffeb9c'})
+                fail_format = workbook.add_format({'bg_color': '#ffc7ce'})
+                
+                # Apply to all numeric grade columns (skip the first 4 columns which are student info)
+                for col_num in range(4, len(merged_df.columns)):
+                    worksheet.conditional_format(1, col_num, len(merged_df), col_num, {
+                        'type': 'cell',
+                        'criteria': '>=',
+                        'value': 8.5,
+                        'format': good_format
+                    })
                     
-                    # Merge with student info
-                    if 'student_id' in df_students.columns:
-                        merged_df = pd.merge(
-                            df_students, 
-                            grades_pivot,
-                            left_on='student_id',
-                            right_index=True,
-                            how='left'
-                        )
-                        
-                        # Rename columns for better readability
-                        merged_df = merged_df.rename(columns={
-                            'student_id': 'Student ID',
-                            'name': 'Student Name',
-                            'email': 'Email',
-                            'team_number': 'Team'
-                        })
-                        
-                        # Sort by team and student name
-                        if 'Team' in merged_df.columns and 'Student Name' in merged_df.columns:
-                            merged_df = merged_df.sort_values(by=['Team', 'Student Name'])
-                        
-                        # Write to Excel
-                        merged_df.to_excel(writer, sheet_name="Grades Summary", index=False)
-                        
-                        # Get workbook and worksheet
-                        workbook = writer.book
-                        worksheet = writer.sheets["Grades Summary"]
-                        
-                        # Add filters
-                        worksheet.autofilter(0, 0, len(merged_df), len(merged_df.columns) - 1)
-                        
-                        # Add header formatting
-                        header_format = workbook.add_format({
-                            'bold': True,
-                            'bg_color': '#D3D3D3',
-                            'border': 1
-                        })
-                        
-                        for col_num, value in enumerate(merged_df.columns.values):
-                            worksheet.write(0, col_num, value, header_format)
-                        
-                        # Add conditional formatting for grades
-                        # Green for good grades (>=8.5), yellow for ok (>=5), red for fail (<5)
-                        good_format = workbook.add_format({'bg_color': '#c6efce'})
-                        ok_format = workbook.add_format({'bg_color': '#ffeb9c'})
-                        fail_format = workbook.add_format({'bg_color': '#ffc7ce'})
-                        
-                        # Apply to all numeric grade columns (skip the first 4 columns which are student info)
-                        for col_num in range(4, len(merged_df.columns)):
-                            worksheet.conditional_format(1, col_num, len(merged_df), col_num, {
-                                'type': 'cell',
-                                'criteria': '>=',
-                                'value': 8.5,
-                                'format': good_format
-                            })
-                            
-                            worksheet.conditional_format(1, col_num, len(merged_df), col_num, {
-                                'type': 'cell',
-                                'criteria': 'between',
-                                'minimum': 5,
-                                'maximum': 8.49,
-                                'format': ok_format
-                            })
-                            
-                            worksheet.conditional_format(1, col_num, len(merged_df), col_num, {
-                                'type': 'cell',
-                                'criteria': '<',
-                                'value': 5,
-                                'format': fail_format
-                            })
-                else:
-                    # If no proper grade data, just export student list
-                    df_students_renamed = df_students.rename(columns={
-                        'student_id': 'Student ID',
-                        'name': 'Student Name',
-                        'email': 'Email',
-                        'team_number': 'Team'
+                    worksheet.conditional_format(1, col_num, len(merged_df), col_num, {
+                        'type': 'cell',
+                        'criteria': 'between',
+                        'minimum': 5,
+                        'maximum': 8.49,
+                        'format': ok_format
                     })
                     
-                    df_students_renamed.to_excel(writer, sheet_name="Students", index=False)
+                    worksheet.conditional_format(1, col_num, len(merged_df), col_num, {
+                        'type': 'cell',
+                        'criteria': '<',
+                        'value': 5,
+                        'format': fail_format
+                    })
+
+                # Statistics sheet: one row per exercise plus the average column
+                statistics = []
+                for column in merged_df.columns[4:]:
+                    summary = summarize(merged_df[column])
+                    statistics.append({
+                        'Exercise': column,
+                        'Graded': summary['count'],
+                        'Average': summary['average'],
+                        'Std Dev': summary['stddev'],
+                        'Min': summary['min'],
+                        'P25': summary['percentiles'][25],
+                        'Median': summary['median'],
+                        'P75': summary['percentiles'][75],
+                        'P90': summary['percentiles'][90],
+                        'Max': summary['max'],
+                    })
+                pd.DataFrame(statistics).round(2).to_excel(writer, sheet_name="Statistics", index=False)
             else:
                 # If no grades, just export student list
                 df_students_renamed = df_students.rename(columns={
@@ -3060,50 +2906,36 @@ def export_grades(academic_year_id, lab_slot_id):
                 df_students_renamed.to_excel(writer, sheet_name="Students", index=False)
             
             # Sheet 2: Per-exercise details (only if we have grades)
-            if grades and len(grades) > 0:
-                # Convert grades to DataFrame first
-                grades_data = [dict(grade) for grade in grades]
-                df_all_grades = pd.DataFrame(grades_data)
+            exercise_slots = sorted(grades['exercise_slot'].unique())
+            for exercise in exercise_slots[:10]:  # Limit to 10 exercises to avoid too many sheets
+                # Student info with the grades for this exercise
+                ex_merged = pd.merge(
+                    df_students,
+                    grades.loc[grades['exercise_slot'] == exercise, ['student_id', 'grade', 'timestamp']],
+                    on='student_id',
+                    how='left'
+                )
                 
-                if not df_all_grades.empty and 'exercise_slot' in df_all_grades.columns:
-                    # Group by exercise slot
-                    exercise_slots = sorted(set(df_all_grades['exercise_slot'].tolist()))
-                    
-                    for i, exercise in enumerate(exercise_slots[:10]):  # Limit to 10 exercises to avoid too many sheets
-                        # Filter grades for this exercise
-                        exercise_grades = df_all_grades[df_all_grades['exercise_slot'] == exercise]
-                        
-                        if not exercise_grades.empty and 'student_id' in exercise_grades.columns:
-                            # Merge with student info
-                            if 'student_id' in df_students.columns:
-                                ex_merged = pd.merge(
-                                    df_students,
-                                    exercise_grades[['student_id', 'grade', 'timestamp']],
-                                    on='student_id',
-                                    how='left'
-                                )
-                                
-                                # Rename columns
-                                ex_merged = ex_merged.rename(columns={
-                                    'student_id': 'Student ID',
-                                    'name': 'Student Name',
-                                    'email': 'Email',
-                                    'team_number': 'Team',
-                                    'grade': 'Grade',
-                                    'timestamp': 'Recorded At'
-                                })
-                                
-                                # Sort by team and student name
-                                if 'Team' in ex_merged.columns and 'Student Name' in ex_merged.columns:
-                                    ex_merged = ex_merged.sort_values(by=['Team', 'Student Name'])
-                                
-                                # Limit sheet name length (Excel has a 31 char limit)
-                                sheet_name = f"{exercise}"
-                                if len(sheet_name) > 31:
-                                    sheet_name = sheet_name[:28] + "..."
-                                
-                                # Write to Excel
-                                ex_merged.to_excel(writer, sheet_name=sheet_name, index=False)
+                # Rename columns
+                ex_merged = ex_merged.rename(columns={
+                    'student_id': 'Student ID',
+                    'name': 'Student Name',
+                    'email': 'Email',
+                    'team_number': 'Team',
+                    'grade': 'Grade',
+                    'timestamp': 'Recorded At'
+                })
+                
+                # Sort by team and student name
+                ex_merged = ex_merged.sort_values(by=['Team', 'Student Name'])
+                
+                # Limit sheet name length (Excel has a 31 char limit)
+                sheet_name = f"{exercise}"
+                if len(sheet_name) > 31:
+                    sheet_name = sheet_name[:28] + "..."
+                
+                # Write to Excel
+                ex_merged.to_excel(writer, sheet_name=sheet_name, index=False)
         
         return send_file(filename, as_attachment=True)
     except Exception as e:
@@ -10,6 +10,11 @@ from datetime import datetime, timedelta
 from functools import wraps
 from werkzeug.security import generate_password_hash, check_password_hash
 from create_grade_template import create_grade_template
+from migrations import migrate
+from grading import (GradingPolicy, PASS_GRADE, override_params, GRADING_POLICY_QUERY, SET_GRADING_POLICY,
+                     SET_FINAL_GRADE_OVERRIDE, PRUNE_FINAL_GRADE_OVERRIDE)
+from queries import QUERIES
+from grade_stats import GRADE_AGGREGATES, from_aggregates
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -422,6 +427,12 @@ def dashboard():
             LIMIT 10
         ''')
     
+    # Grade statistics for the Average Grade card, one aggregate pass over Grades
+    if academic_year_id:
+        grades = query_db(QUERIES['dashboard_grades_for_year'], [academic_year_id], one=True)
+    else:
+        grades = query_db(QUERIES['dashboard_grades'], one=True)
+    
     # Get all academic years for the filter dropdown
     academic_years = query_db('SELECT id, semester, year FROM AcademicYear ORDER BY year, semester')
     
@@ -437,14 +448,18 @@ def dashboard():
         exam_slots_by_academic_year=exam_slots_by_year,
         absences_by_lab=absences_by_lab,
         avg_grades_by_exercise=avg_grades_by_exercise,
-        final_grades_stats=final_grades_stats
+        final_grades_stats=final_grades_stats,
+        grade_summary=from_aggregates(grades)
     )
 
 # Update the URL routes for dashboard in base.html
 @app.context_processor
 def inject_globals():
     return {
-        'request': request
+        'request': request,
+        # The templates are shared by simple_app.py and simple_app.pyw, which
+        # do not have all the same routes
+        'has_endpoint': lambda endpoint: endpoint in app.view_functions
     }
 
 # Academic Year routes
@@ -1355,8 +1370,8 @@ def attendance_view():
 def grades_index():
     academic_years = query_db('SELECT id, semester, year FROM AcademicYear ORDER BY year, semester')
     
-    # Get grade statistics
-    grade_records = query_db('''
+    # Get grade statistics (see grade_stats.py)
+    grade_records = query_db(f'''
         SELECT 
             g.academic_year_id,
             g.lab_slot_id,
@@ -1364,8 +1379,7 @@ def grades_index():
             MAX(g.timestamp) as timestamp,
             ac.semester || ' ' || ac.year as academic_year_name,
             l.name as lab_slot_name,
-            COUNT(g.id) as students_count,
-            AVG(g.grade) as average_grade
+            {GRADE_AGGREGATES}
         FROM 
             Grades g
         JOIN 
@@ -1377,6 +1391,7 @@ def grades_index():
         ORDER BY 
             timestamp DESC
     ''')
+    grade_records = [dict(row, stats=from_aggregates(row)) for row in grade_records]
     
     return render_template('grades/index.html', 
                           academic_years=academic_years,
@@ -1561,6 +1576,120 @@ def grades_view():
                           grade_records=grade_records,
                           grade_stats=grade_stats)
 
+def final_grade_rows(academic_year_id):
+    """{student_id: final grade row} for a year's students, shared by the final-grades page and the exports.
+
+    This app keeps exam grades in ExamGrades, which the FinalGrades view does
+    not read, so they are computed here. Per student: the average of the
+    exercise grades, the June and September exams (by exam slot name) and the
+    latest exam taken. Values entered by hand on the page
+    (FinalGradeOverrides) replace the lab average and the June/September
+    grades; with a hand-entered exam grade the exam counted is September's,
+    else June's, otherwise it is the latest exam. A passed exam (>= PASS_GRADE)
+    gives lab_weight * lab average + exam_weight * exam with the year's
+    GradingPolicy, a failed or missing one lab_weight * lab average.
+    Missing values are 0, as the page and export always showed them.
+    """
+    policy = GradingPolicy.from_row(
+        query_db(GRADING_POLICY_QUERY, {'academic_year_id': academic_year_id}, one=True)
+    )
+    exercise_grades = {}
+    for grade in query_db('''
+        SELECT student_id, grade, exercise_slot
+        FROM Grades
+        WHERE academic_year_id = ?
+        ORDER BY exercise_slot
+    ''', [academic_year_id]):
+        exercise_grades.setdefault(grade['student_id'], []).append(grade)
+    exams = {}
+    for exam in query_db('''
+        SELECT 
+            eg.student_id,
+            eg.grade,
+            eg.timestamp,
+            es.name as exam_name
+        FROM 
+            ExamGrades eg
+        JOIN 
+            ExamSlots es ON eg.exam_slot_id = es.id
+        WHERE 
+            es.academic_year_id = ?
+        ORDER BY 
+            es.date DESC, eg.timestamp DESC
+    ''', [academic_year_id]):
+        exams.setdefault(exam['student_id'], []).append(exam)
+    overrides = {
+        override['student_id']: override for override in query_db(
+            'SELECT * FROM FinalGradeOverrides WHERE academic_year_id = ?', [academic_year_id]
+        )
+    }
+    students = query_db('''
+        SELECT DISTINCT student_id FROM Enrollments WHERE academic_year_id = ?
+    ''', [academic_year_id])
+    
+    rows = {}
+    for student in students:
+        student_id = student['student_id']
+        grades = [grade['grade'] for grade in exercise_grades.get(student_id, []) if grade['grade'] is not None]
+        lab_average = round(sum(grades) / len(grades), 2) if grades else 0
+        
+        # Process exam grades to find June and September exams
+        june_exam = None
+        september_exam = None
+        latest_exam = None
+        for exam in exams.get(student_id, []):
+            exam_name = (exam['exam_name'] or '').lower()
+            timestamp = exam['timestamp'] or ''
+            
+            # Check if this is a June or September exam by name
+            if 'june' in exam_name or 'jun' in exam_name:
+                if not june_exam or timestamp > (june_exam['timestamp'] or ''):
+                    june_exam = exam
+            elif 'september' in exam_name or 'sep' in exam_name:
+                if not september_exam or timestamp > (september_exam['timestamp'] or ''):
+                    september_exam = exam
+            
+            # Keep track of the latest exam taken
+            if not latest_exam or timestamp > (latest_exam['timestamp'] or ''):
+                latest_exam = exam
+        
+        computed = {
+            'lab_average': lab_average,
+            'jun_exam_grade': june_exam['grade'] if june_exam else 0,
+            'sep_exam_grade': september_exam['grade'] if september_exam else 0,
+        }
+        row = dict(computed)
+        latest_exam_name = latest_exam['exam_name'] if latest_exam else 'None'
+        exam_grade = latest_exam['grade'] if latest_exam else 0
+        
+        # Values equal to the computed ones (e.g. kept from the old FinalGrades table) change nothing
+        override = overrides.get(student_id)
+        edited = {
+            column: override[column] for column in computed
+            if override[column] is not None and override[column] != computed[column]
+        } if override else {}
+        row.update(edited)
+        if 'sep_exam_grade' in edited or 'jun_exam_grade' in edited:
+            exam_grade = row['sep_exam_grade'] or row['jun_exam_grade']
+            latest_exam_name = 'Entered by hand'
+        
+        if exam_grade is not None and exam_grade >= PASS_GRADE:
+            final_grade = round(policy.lab_weight * row['lab_average'] + policy.exam_weight * exam_grade, 2)
+        else:
+            final_grade = round(policy.lab_weight * row['lab_average'], 2)
+        
+        row.update(
+            student_id=student_id,
+            exercise_grades=exercise_grades.get(student_id, []),
+            latest_exam=latest_exam_name,
+            latest_exam_grade=exam_grade if exam_grade is not None else 0,
+            final_grade=final_grade,
+            overridden=bool(edited),
+            computed=computed,
+        )
+        rows[student_id] = row
+    return rows
+
 @app.route('/grades/final/')
 @login_required
 def grades_final():
@@ -1605,125 +1734,57 @@ def grades_final():
             s.name
     ''', [selected_year_id])
     
-    final_grades = []
+    # Same computation as the export, from Grades and ExamGrades
+    rows = final_grade_rows(selected_year_id)
+    final_grades = [dict(rows[student['student_id']], name=student['name']) for student in students]
+    policy = GradingPolicy.from_row(
+        query_db(GRADING_POLICY_QUERY, {'academic_year_id': selected_year_id}, one=True)
+    )
+    
+    graded = [student['final_grade'] for student in final_grades if student['final_grade'] is not None]
+    distribution = [0] * 10
+    for grade in graded:
+        distribution[min(max(int(grade), 0), 9)] += 1
     grade_stats = {
-        'total': 0,
-        'passed': 0,
-        'failed': 0,
-        'average': 0,
-        'distribution': [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]  # 0-1, 1-2, ..., 9-10
+        'total': len(final_grades),
+        'passed': sum(1 for grade in graded if grade >= PASS_GRADE),
+        'failed': sum(1 for grade in graded if grade < PASS_GRADE),
+        'average': sum(graded) / len(graded) if graded else 0,
+        'distribution': distribution
     }
     
-    total_final_grade = 0
-    
-    for student in students:
-        student_id = student['student_id']
-        
-        # Get exercise grades
-        exercise_grades = query_db('''
-            SELECT grade, exercise_slot
-            FROM Grades
-            WHERE student_id = ? AND academic_year_id = ?
-        ''', [student_id, selected_year_id])
-        
-        # Calculate average of exercise grades
-        avg_exercise_grade = 0
-        if exercise_grades:
-            total = sum(grade['grade'] for grade in exercise_grades)
-            avg_exercise_grade = round(total / len(exercise_grades), 2)
-        
-        # Get all exam grades for this student in this academic year
-        all_exam_grades = query_db('''
-            SELECT 
-                eg.grade,
-                eg.timestamp,
-                es.name as exam_name,
-                es.date
-            FROM 
-                ExamGrades eg
-            JOIN 
-                ExamSlots es ON eg.exam_slot_id = es.id
-            WHERE 
-                eg.student_id = ? 
-                AND es.academic_year_id = ?
-            ORDER BY 
-                es.date DESC, eg.timestamp DESC
-        ''', [student_id, selected_year_id])
-        
-        # Process exam grades to find June and September exams
-        june_exam = None
-        september_exam = None
-        latest_exam = None
-        
-        for exam in all_exam_grades:
-            exam_name = exam['exam_name'].lower()
-            
-            # Check if this is a June or September exam by name
-            if 'june' in exam_name or 'jun' in exam_name:
-                if not june_exam or exam['timestamp'] > june_exam['timestamp']:
-                    june_exam = exam
-            elif 'september' in exam_name or 'sep' in exam_name:
-                if not september_exam or exam['timestamp'] > september_exam['timestamp']:
-                    september_exam = exam
-            
-            # Keep track of the latest exam taken
-            if not latest_exam or exam['timestamp'] > latest_exam['timestamp']:
-                latest_exam = exam
-        
-        # Extract the grades
-        june_grade = june_exam['grade'] if june_exam else 0
-        september_grade = september_exam['grade'] if september_exam else 0
-        
-        # Use the latest exam for final grade calculation
-        latest_exam_grade = latest_exam['grade'] if latest_exam else 0
-        exam_name = latest_exam['exam_name'] if latest_exam else 'None'
-        
-        # Calculate final grade according to the formula
-        final_grade = 0
-        if latest_exam_grade >= 5:
-            # If exam grade is >= 5, final grade is 25% exercises + 75% exam
-            final_grade = round(0.25 * avg_exercise_grade + 0.75 * latest_exam_grade, 2)
-        else:
-            # If exam grade is < 5, final grade is 25% of exercises only
-            final_grade = round(0.25 * avg_exercise_grade, 2)
-        
-        # Update statistics
-        grade_stats['total'] += 1
-        total_final_grade += final_grade
-        
-        if final_grade >= 5:
-            grade_stats['passed'] += 1
-        else:
-            grade_stats['failed'] += 1
-        
-        # Update distribution
-        bin_index = min(int(final_grade), 9)
-        grade_stats['distribution'][bin_index] += 1
-        
-        # Store student details with grades
-        final_grades.append({
-            'student_id': student_id,
-            'name': student['name'],
-            'exercise_grades': exercise_grades,
-            'avg_exercise_grade': avg_exercise_grade,
-            'jun_exam_grade': june_grade,
-            'sep_exam_grade': september_grade,
-            'latest_exam': exam_name,
-            'latest_exam_grade': latest_exam_grade,
-            'final_grade': final_grade
-        })
-    
-    # Calculate average final grade
-    if grade_stats['total'] > 0:
-        grade_stats['average'] = total_final_grade / grade_stats['total']
-    
     return render_template('grades/final.html',
                           academic_years=academic_years,
                           selected_year_id=selected_year_id,
                           selected_year=selected_year,
                           lab_slots=lab_slots,
                           final_grades=final_grades,
-                          grade_stats=grade_stats)
+                          grade_stats=grade_stats,
+                          policy=policy)
+
+@app.route('/grades/final/policy/', methods=['POST'])
+@login_required
+def grades_final_policy():
+    academic_year_id = request.form.get('academic_year_id', type=int)
+    lab_weight = request.form.get('lab_weight', type=float)
+    exam_weight = request.form.get('exam_weight', type=float)
+    
+    if not academic_year_id or lab_weight is None or exam_weight is None:
+        flash('Invalid request parameters', 'danger')
+        return redirect(url_for('grades_final'))
+    
+    policy = GradingPolicy(lab_weight, exam_weight)
+    try:
+        policy.validate()
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('grades_final', academic_year_id=academic_year_id))
+    
+    # The FinalGrades view picks up the new weights on its next read
+    modify_db(SET_GRADING_POLICY, policy.params(academic_year_id))
+    flash('Grading policy saved', 'success')
+    
+    return redirect(url_for('grades_final', academic_year_id=academic_year_id))
 
 @app.route('/grades/final/export/<int:academic_year_id>/')
 @login_required
@@ -1754,96 +1815,29 @@ def export_final_grades(academic_year_id):
             s.name
     ''', [academic_year_id])
     
-    # Prepare data for Excel
+    # Prepare data for Excel, computed like the final-grades page
+    final_grades = final_grade_rows(academic_year_id)
     data = []
     
     for student in students:
         student_id = student['student_id']
-        
-        # Get exercise grades
-        exercise_grades = query_db('''
-            SELECT grade, exercise_slot
-            FROM Grades
-            WHERE student_id = ? AND academic_year_id = ?
-            ORDER BY exercise_slot
-        ''', [student_id, academic_year_id])
-        
-        # Calculate average of exercise grades
-        avg_exercise_grade = 0
-        if exercise_grades:
-            total = sum(grade['grade'] for grade in exercise_grades)
-            avg_exercise_grade = round(total / len(exercise_grades), 2)
-        
-        # Get all exam grades for this student in this academic year
-        all_exam_grades = query_db('''
-            SELECT 
-                eg.grade,
-                eg.timestamp,
-                es.name as exam_name,
-                es.date
-            FROM 
-                ExamGrades eg
-            JOIN 
-                ExamSlots es ON eg.exam_slot_id = es.id
-            WHERE 
-                eg.student_id = ? 
-                AND es.academic_year_id = ?
-            ORDER BY 
-                es.date DESC, eg.timestamp DESC
-        ''', [student_id, academic_year_id])
-        
-        # Process exam grades to find June and September exams
-        june_exam = None
-        september_exam = None
-        latest_exam = None
-        
-        for exam in all_exam_grades:
-            exam_name = exam['exam_name'].lower()
-            
-            # Check if this is a June or September exam by name
-            if 'june' in exam_name or 'jun' in exam_name:
-                if not june_exam or exam['timestamp'] > june_exam['timestamp']:
-                    june_exam = exam
-            elif 'september' in exam_name or 'sep' in exam_name:
-                if not september_exam or exam['timestamp'] > september_exam['timestamp']:
-                    september_exam = exam
-            
-            # Keep track of the latest exam taken
-            if not latest_exam or exam['timestamp'] > latest_exam['timestamp']:
-                latest_exam = exam
-        
-        # Extract the grades
-        june_grade = june_exam['grade'] if june_exam else 0
-        september_grade = september_exam['grade'] if september_exam else 0
-        
-        # Use the latest exam for final grade calculation
-        latest_exam_grade = latest_exam['grade'] if latest_exam else 0
-        exam_name = latest_exam['exam_name'] if latest_exam else 'None'
-        
-        # Calculate final grade according to the formula
-        final_grade = 0
-        if latest_exam_grade >= 5:
-            # If exam grade is >= 5, final grade is 25% exercises + 75% exam
-            final_grade = round(0.25 * avg_exercise_grade + 0.75 * latest_exam_grade, 2)
-        else:
-            # If exam grade is < 5, final grade is 25% of exercises only
-            final_grade = round(0.25 * avg_exercise_grade, 2)
+        final_grade = final_grades[student_id]
         
         # Create row with student basic info
         row = {
             'Student ID': student_id,
             'Name': student['name'],
             'Lab Group': student['lab_slot_name'],
-            'Exercises Avg': avg_exercise_grade,
-            'June Exam Grade': june_grade,
-            'September Exam Grade': september_grade,
-            'Latest Exam': exam_name,
-            'Latest Exam Grade': latest_exam_grade,
-            'Final Grade': final_grade
+            'Exercises Avg': final_grade['lab_average'],
+            'June Exam Grade': final_grade['jun_exam_grade'],
+            'September Exam Grade': final_grade['sep_exam_grade'],
+            'Latest Exam': final_grade['latest_exam'],
+            'Latest Exam Grade': final_grade['latest_exam_grade'],
+            'Final Grade': final_grade['final_grade']
         }
         
         # Add individual exercise grades
-        for grade in exercise_grades:
+        for grade in final_grade['exercise_grades']:
             exercise_name = grade['exercise_slot']
             row[f"Exercise {exercise_name}"] = grade['grade']
         
@@ -1862,11 +1856,40 @@ def export_final_grades(academic_year_id):
         # Auto-adjust columns' width
         worksheet = writer.sheets['Final Grades']
         for i, col in enumerate(df.columns):
-            max_length = max(df[col].astype(str).map(len).max(), len(col)) + 2
+            max_length = max(df[col].map(lambda value: len(str(value))).max(), len(col)) + 2
             worksheet.column_dimensions[chr(65 + i)].width = max_length
     
     return send_file(filepath, as_attachment=True, download_name=filename)
 
+def parse_grade(value):
+    """Float for a submitted grade, None for a blank one; raises ValueError otherwise."""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    return float(value)
+
+def final_grade_override(current, student_id, academic_year_id, lab_average, jun_exam_grade, sep_exam_grade):
+    """FinalGradeOverrides parameters keeping only the values that differ from the computed ones."""
+    def differs(value, column):
+        computed = current['computed'][column]
+        return None if value is None or abs(value - (computed or 0)) < 0.005 else value
+    return override_params(
+        student_id,
+        academic_year_id,
+        differs(lab_average, 'lab_average'),
+        differs(jun_exam_grade, 'jun_exam_grade'),
+        differs(sep_exam_grade, 'sep_exam_grade')
+    )
+
+def save_final_grade_overrides(rows):
+    db = get_db()
+    try:
+        db.executemany(SET_FINAL_GRADE_OVERRIDE, rows)
+        db.executemany(PRUNE_FINAL_GRADE_OVERRIDE, rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
 @app.route('/grades/final/save/', methods=['POST'])
 @login_required
 def grades_final_save():
@@ -1876,57 +1899,25 @@ def grades_final_save():
         flash('Invalid request parameters', 'danger')
         return redirect(url_for('grades_index'))
     
-    # Get all students for this academic year
-    students = query_db('''
-        SELECT DISTINCT s.student_id
-        FROM Students s
-        JOIN Enrollments e ON s.student_id = e.student_id
-        WHERE e.academic_year_id = ?
-    ''', [academic_year_id])
-    
     try:
-        count = 0
-        for student in students:
-            student_id = student['student_id']
-            
-            lab_average = request.form.get(f'lab_average_{student_id}', '')
-            jun_exam = request.form.get(f'jun_exam_{student_id}', '')
-            sep_exam = request.form.get(f'sep_exam_{student_id}', '')
+        current = final_grade_rows(academic_year_id)
+        rows = []
+        for student_id in current:
             
-            # Calculate final grade - take best of Jun or Sep exam
             try:
-                lab_avg = float(lab_average) if lab_average.strip() else 0
-                jun_grade = float(jun_exam) if jun_exam.strip() else 0
-                sep_grade = float(sep_exam) if sep_exam.strip() else 0
-                
-                best_exam = max(jun_grade, sep_grade)
-                final_grade = 0.5 * lab_avg + 0.5 * best_exam if best_exam > 0 else 0
+                lab_avg = parse_grade(request.form.get(f'lab_average_{student_id}', ''))
+                jun_grade = parse_grade(request.form.get(f'jun_exam_{student_id}', ''))
+                sep_grade = parse_grade(request.form.get(f'sep_exam_{student_id}', ''))
             except ValueError:
                 flash(f'Invalid grade value for student {student_id}', 'warning')
                 continue
             
-            # Check if record exists
-            existing = query_db('''
-                SELECT id FROM FinalGrades
-                WHERE student_id = ? AND academic_year_id = ?
-            ''', [student_id, academic_year_id], one=True)
-            
-            if existing:
-                # Update existing record
-                modify_db('''
-                    UPDATE FinalGrades
-                    SET lab_average = ?, jun_exam_grade = ?, sep_exam_grade = ?, final_grade = ?
-                    WHERE student_id = ? AND academic_year_id = ?
-                ''', [lab_avg, jun_grade, sep_grade, final_grade, student_id, academic_year_id])
-            else:
-                # Insert new record
-                modify_db('''
-                    INSERT INTO FinalGrades
-                    (student_id, lab_average, jun_exam_grade, sep_exam_grade, final_grade, academic_year_id)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', [student_id, lab_avg, jun_grade, sep_grade, final_grade, academic_year_id])
-            
-            count += 1
+            rows.append(final_grade_override(
+                current[student_id], student_id, academic_year_id, lab_avg, jun_grade, sep_grade
+            ))
+        
+        save_final_grade_overrides(rows)
+        count = len(rows)
         
         flash(f'Final grades saved for {count} students', 'success')
     except Exception as e:
@@ -1935,6 +1926,45 @@ def grades_final_save():
     
     return redirect(url_for('grades_final', academic_year_id=academic_year_id))
 
+@app.route('/api/final_grades/update', methods=['POST'])
+@login_required
+def api_final_grades_update():
+    data = request.get_json(silent=True) or {}
+    academic_year_id = data.get('academic_year_id')
+    student_id = data.get('student_id')
+    
+    if not academic_year_id or not student_id:
+        return jsonify({'success': False, 'error': 'Academic year ID and student ID are required'}), 400
+    
+    current = final_grade_rows(academic_year_id).get(student_id)
+    if not current:
+        return jsonify({'success': False, 'error': 'Student is not enrolled in this academic year'}), 404
+    
+    try:
+        # Inputs the page does not send keep their current value
+        row = final_grade_override(
+            current,
+            student_id,
+            academic_year_id,
+            parse_grade(data.get('lab_average', current['lab_average'])),
+            parse_grade(data.get('jun_exam_grade', current['jun_exam_grade'])),
+            parse_grade(data.get('sep_exam_grade', current['sep_exam_grade']))
+        )
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Invalid grade value'}), 400
+    
+    try:
+        save_final_grade_overrides([row])
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    updated = final_grade_rows(academic_year_id)[student_id]
+    return jsonify({
+        'success': True,
+        **{column: updated[column] for column in
+           ('lab_average', 'jun_exam_grade', 'sep_exam_grade', 'final_grade', 'overridden')}
+    })
+
 # Enhanced student management
 @app.route('/students/detail/<string:student_id>/')
 @login_required
@@ -2229,7 +2259,7 @@ def student_delete(student_id):
         modify_db('DELETE FROM StudentTeams WHERE student_id = ?', [student_id])
         modify_db('DELETE FROM Attendance WHERE student_id = ?', [student_id])
         modify_db('DELETE FROM Grades WHERE student_id = ?', [student_id])
-        modify_db('DELETE FROM FinalGrades WHERE student_id = ?', [student_id])
+        modify_db('DELETE FROM FinalGradeOverrides WHERE student_id = ?', [student_id])
         
         # Delete student
         modify_db('DELETE FROM Students WHERE student_id = ?', [student_id])
@@ -2514,6 +2544,9 @@ def init_test_data_route():
 def init_db():
     with app.app_context():
         db = get_db()
+        # The tables shared with simple_app.py, the FinalGrades view and the
+        # summary tables come from the versioned migrations
+        migrate(db)
         cursor = db.cursor()
         
         # Create AcademicYear table
@@ -2648,21 +2681,6 @@ def init_db():
             )
         ''')
 
-        # Create FinalGrades table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS FinalGrades (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id TEXT,
-                lab_average REAL,
-                jun_exam_grade REAL,
-                sep_exam_grade REAL,
-                final_grade REAL,
-                academic_year_id INTEGER,
-                FOREIGN KEY(student_id) REFERENCES Students(student_id),
-                FOREIGN KEY(academic_year_id) REFERENCES AcademicYear(id)
-            )
-        ''')
-
         # Create ExamGrades table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS ExamGrades (
@@ -2766,31 +2784,33 @@ def export_all_data(academic_year_id):
                 g.academic_year_id = ? AND g.lab_slot_id IN ({placeholders})
         ''', [academic_year_id] + selected_lab_ids)
         
-        # Get all final grades
-        all_final_grades = query_db('''
-            SELECT 
-                fg.student_id,
-                s.name as student_name,
-                l.name as lab_slot_name,
-                l.id as lab_slot_id,
-                st.team_number,
-                fg.lab_average,
-                fg.jun_exam_grade,
-                fg.sep_exam_grade,
-                fg.final_grade
-            FROM 
-                FinalGrades fg
-            INNER JOIN
-                Students s ON fg.student_id = s.student_id
-            INNER JOIN
-                Enrollments e ON s.student_id = e.student_id AND e.academic_year_id = fg.academic_year_id
-            INNER JOIN
-                LabSlots l ON e.lab_slot_id = l.id
-            LEFT JOIN
-                StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = l.id
-            WHERE 
-                fg.academic_year_id = ?
-        ''', [academic_year_id])
+        # Get all final grades, computed like the final-grades page
+        final_grades = final_grade_rows(academic_year_id)
+        all_final_grades = [
+            dict(
+                dict(student),
+                **{column: final_grades[student['student_id']][column]
+                   for column in ('lab_average', 'jun_exam_grade', 'sep_exam_grade', 'final_grade')}
+            )
+            for student in query_db('''
+                SELECT 
+                    s.student_id,
+                    s.name as student_name,
+                    l.name as lab_slot_name,
+                    l.id as lab_slot_id,
+                    st.team_number
+                FROM 
+                    Enrollments e
+                INNER JOIN
+                    Students s ON e.student_id = s.student_id
+                INNER JOIN
+                    LabSlots l ON e.lab_slot_id = l.id
+                LEFT JOIN
+                    StudentTeams st ON s.student_id = st.student_id AND st.lab_slot_id = l.id
+                WHERE 
+                    e.academic_year_id = ?
+            ''', [academic_year_id])
+        ]
         
         # Convert student data to DataFrame
         students_data = [dict(student) for student in students]
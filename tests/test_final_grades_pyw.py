@@ -0,0 +1,118 @@
+"""
+simple_app.pyw keeps exam grades in ExamGrades: its final-grades page and
+its Excel export must both compute final grades from them, and agree.
+"""
+import importlib.machinery
+import importlib.util
+import io
+import os
+import sqlite3
+import sys
+import types
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def load_pyw():
+    try:
+        import create_grade_template  # noqa: F401
+    except ImportError:
+        # Only the grade-template download uses it, not the pages tested here
+        sys.modules['create_grade_template'] = types.SimpleNamespace(create_grade_template=None)
+    loader = importlib.machinery.SourceFileLoader('simple_app_pyw', os.path.join(ROOT, 'simple_app.pyw'))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    # Flask finds the templates through the module's file
+    sys.modules[loader.name] = module
+    loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pyw = load_pyw()
+    pyw.app.config['DATABASE'] = str(tmp_path / 'student_register.db')
+    pyw.app.config['TESTING'] = True
+    pyw.init_db()
+
+    conn = sqlite3.connect(pyw.app.config['DATABASE'])
+    conn.executescript('''
+        INSERT INTO AcademicYear (id, semester, year) VALUES (1, 'Spring', 2024);
+        INSERT INTO LabSlots (id, name, academic_year_id) VALUES (1, 'Monday', 1);
+        INSERT INTO Students (student_id, name) VALUES
+            ('s1', 'Alice'), ('s2', 'Bob'), ('s3', 'Carol'), ('s4', 'Dan');
+        INSERT INTO Enrollments (student_id, lab_slot_id, academic_year_id) VALUES
+            ('s1', 1, 1), ('s2', 1, 1), ('s3', 1, 1), ('s4', 1, 1);
+        INSERT INTO Grades (student_id, lab_slot_id, exercise_slot, grade, timestamp, academic_year_id) VALUES
+            ('s1', 1, 'Lab1', 8, '2024-03-01', 1), ('s1', 1, 'Lab2', 6, '2024-03-08', 1),
+            ('s2', 1, 'Lab1', 10, '2024-03-01', 1),
+            ('s3', 1, 'Lab1', 4, '2024-03-01', 1);
+        INSERT INTO ExamSlots (id, name, date, academic_year_id) VALUES
+            (1, 'June exam', '2024-06-20', 1), (2, 'September exam', '2024-09-10', 1);
+        -- s1 passes in June; s2 fails in June and passes in September; s3 only fails
+        INSERT INTO ExamGrades (student_id, exam_slot_id, grade, timestamp, academic_year_id) VALUES
+            ('s1', 1, 7, '2024-06-20 10:00:00', 1),
+            ('s2', 1, 3, '2024-06-20 10:00:00', 1),
+            ('s2', 2, 9, '2024-09-10 10:00:00', 1),
+            ('s3', 1, 2, '2024-06-20 10:00:00', 1);
+    ''')
+    conn.commit()
+    conn.close()
+
+    client = pyw.app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+    return client
+
+
+def page_grades(client):
+    html = client.get('/grades/final/?academic_year_id=1').get_data(as_text=True)
+    grades = {}
+    for row in html.split('<tr')[1:]:
+        for student_id in ('s1', 's2', 's3', 's4'):
+            if f'<td>{student_id}</td>' in row:
+                grades[student_id] = row.split('class="final-grade">')[1].split('<')[0]
+    return grades
+
+
+def export_grades(client):
+    response = client.get('/grades/final/export/1/')
+    assert response.status_code == 200
+    df = pd.read_excel(io.BytesIO(response.data))
+    return {row['Student ID']: row for _, row in df.iterrows()}
+
+
+def test_page_and_export_compute_final_grades_from_exam_grades(client):
+    page = page_grades(client)
+    export = export_grades(client)
+
+    # 0.25 * lab average + 0.75 * latest exam when it is passed, 0.25 * lab average otherwise
+    expected = {'s1': 7.0, 's2': 9.25, 's3': 1.0, 's4': 0.0}
+    assert {student_id: row['Final Grade'] for student_id, row in export.items()} == expected
+    assert export['s2']['Latest Exam'] == 'September exam'
+    assert export['s2']['June Exam Grade'] == 3
+    assert export['s2']['September Exam Grade'] == 9
+    for student_id, final_grade in expected.items():
+        assert float(page[student_id].replace('—', '0')) == final_grade
+
+
+def test_hand_entered_grades_reach_page_and_export(client):
+    response = client.post('/api/final_grades/update', json={
+        'academic_year_id': 1, 'student_id': 's3', 'jun_exam_grade': '2', 'sep_exam_grade': '6',
+    })
+    assert response.get_json()['final_grade'] == 5.5
+
+    # Unchanged values are not stored as overrides
+    client.post('/api/final_grades/update', json={
+        'academic_year_id': 1, 'student_id': 's1', 'jun_exam_grade': '7', 'sep_exam_grade': '',
+    })
+
+    assert page_grades(client)['s3'] == '5.5'
+    assert export_grades(client)['s3']['Final Grade'] == 5.5
+    assert export_grades(client)['s1']['Final Grade'] == 7.0
+    assert page_grades(client)['s1'] == '7.0'
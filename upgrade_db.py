@@ -1,34 +1,26 @@
 import os
 import sqlite3
+from migrations import migrate, schema_version
 
 def upgrade_database():
     print("Checking database for upgrades...")
     
     # Connect to database
     conn = sqlite3.connect('student_register.db')
-    cursor = conn.cursor()
     
-    # Check if replenishment_note column exists in Attendance table
-    column_exists = False
+    # Apply any pending schema migrations
+    before = schema_version(conn)
     try:
-        cursor.execute('SELECT replenishment_note FROM Attendance LIMIT 1')
-        column_exists = True
-        print("Column 'replenishment_note' already exists in Attendance table.")
-    except sqlite3.OperationalError:
-        column_exists = False
-        print("Column 'replenishment_note' does not exist in Attendance table.")
-    
-    # Add replenishment_note column if it doesn't exist
-    if not column_exists:
-        try:
-            cursor.execute('ALTER TABLE Attendance ADD COLUMN replenishment_note TEXT')
-            conn.commit()
-            print("Successfully added 'replenishment_note' column to Attendance table.")
-        except sqlite3.OperationalError as e:
-            print(f"Error adding replenishment_note column: {e}")
+        after = migrate(conn, verbose=True)
+        if after == before:
+            print(f"Database schema is already up to date (version {after}).")
+        else:
+            print(f"Upgraded database schema from version {before} to {after}.")
+    except sqlite3.Error as e:
+        print(f"Error upgrading database: {e}")
     
     conn.close()
     print("Database upgrade completed.")
 
 if __name__ == "__main__":
-    upgrade_database() 
\ No newline at end of file
+    upgrade_database()
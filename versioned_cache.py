@@ -0,0 +1,80 @@
+"""
+Result cache invalidated by SQLite's data version.
+
+`PRAGMA data_version` on a connection changes whenever another connection
+(in this process, another worker or the desktop app) commits to the
+database. A DataVersionWatcher keeps one such connection that never writes,
+so its data version moves on every commit, and VersionedCache stores each
+computed value together with the version it was computed at. A cached value
+is served only while the version is unchanged, so there is nothing to
+invalidate by hand on the write paths.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from db_pool import open_connection
+
+
+class DataVersionWatcher:
+    def __init__(self, database, pragmas=None):
+        self.database = database
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._conn = open_connection(database, pragmas, cached_statements=1, readonly=True)
+
+    def version(self):
+        """Current data version; changes after every commit made by another connection."""
+        with self._lock:
+            return self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class VersionedCache:
+    def __init__(self, watcher, max_entries=64):
+        self.watcher = watcher
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+        }
+
+    def get(self, key, compute):
+        """Return the cached value for `key`, calling `compute()` if it is missing or stale."""
+        version = self.watcher.version()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[1]
+            self._stats['misses'] += 1
+
+        # Stored under the version read before computing, so a commit that
+        # lands meanwhile makes the entry stale instead of hiding the change
+        value = compute()
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        stats['data_version'] = self.watcher.version()
+        return stats
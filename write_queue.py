@@ -0,0 +1,189 @@
+"""
+Single-writer queue for the Lab Database.
+
+One background thread owns the worker's writing connection. Callers submit
+write jobs and get a concurrent.futures.Future back; the thread drains
+everything already queued, runs each job inside its own SAVEPOINT and
+commits the whole group at once. Concurrent saves then share one commit
+instead of failing with "database is locked".
+
+Code that needs an interactive transaction (reads mixed with writes) can
+borrow the writer connection with `transaction()` or `acquire()`/`release()`;
+queued jobs wait until it is handed back.
+"""
+import os
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+from db_pool import open_connection, PoolTimeout
+
+
+class _Job:
+    __slots__ = ('kind', 'statements', 'future')
+
+    def __init__(self, kind, statements=None):
+        self.kind = kind
+        self.statements = statements
+        self.future = Future()
+
+
+class WriteQueue:
+    def __init__(self, database, max_batch=64, timeout=30.0, pragmas=None):
+        self.database = database
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.pid = os.getpid()
+
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._released = None
+        self._stats = {
+            'jobs': 0,
+            'failed': 0,
+            'groups': 0,
+            'leases': 0,
+        }
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, query, args=(), many=False):
+        """Queue one statement (or an executemany batch); the future resolves to its rowcount."""
+        return self.submit_batch([(query, args, many)])
+
+    def submit_batch(self, statements):
+        """Queue (query, args, many) statements that must commit or fail together."""
+        job = _Job('write', list(statements))
+        self._jobs.put(job)
+        return job.future
+
+    def acquire(self):
+        """Borrow the writer connection once every job queued before this call is committed."""
+        job = _Job('lease')
+        self._jobs.put(job)
+        try:
+            conn, released = job.future.result(timeout=self.timeout)
+        except FutureTimeout:
+            if job.future.cancel():
+                raise PoolTimeout(f'Writer connection not available after {self.timeout} seconds')
+            conn, released = job.future.result()
+        self._released = released
+        return conn
+
+    def release(self, conn):
+        """Hand the writer connection back to the writer thread."""
+        released, self._released = self._released, None
+        released.set()
+
+    @contextmanager
+    def transaction(self):
+        """Run a block as one BEGIN IMMEDIATE transaction on the writer connection."""
+        conn = self.acquire()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queued'] = self._jobs.qsize()
+        stats['avg_group_size'] = round(stats['jobs'] / stats['groups'], 2) if stats['groups'] else 0.0
+        return stats
+
+    def close(self):
+        """Commit everything already queued and stop the writer thread."""
+        self._jobs.put(None)
+        self._thread.join()
+
+    def _run(self):
+        conn = open_connection(self.database, self.pragmas)
+        try:
+            while True:
+                batch = [self._jobs.get()]
+                # Group commit: take whatever else is already waiting
+                while len(batch) < self.max_batch:
+                    try:
+                        batch.append(self._jobs.get_nowait())
+                    except queue.Empty:
+                        break
+                if self._apply(conn, batch):
+                    break
+        finally:
+            conn.close()
+
+    def _apply(self, conn, batch):
+        """Commit the write jobs of a batch, lending the connection in between. True means stop."""
+        group = []
+        for job in batch:
+            if job is not None and job.kind == 'write':
+                group.append(job)
+                continue
+            self._commit(conn, group)
+            group = []
+            if job is None:
+                return True
+            self._lend(conn, job)
+        self._commit(conn, group)
+        return False
+
+    def _commit(self, conn, group):
+        group = [job for job in group if job.future.set_running_or_notify_cancel()]
+        if not group:
+            return
+
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for job in group:
+                # A failing job is rolled back on its own without aborting the group
+                conn.execute('SAVEPOINT job')
+                try:
+                    rowcount = 0
+                    for query, args, many in job.statements:
+                        cur = conn.executemany(query, args) if many else conn.execute(query, args)
+                        rowcount += max(cur.rowcount, 0)
+                    conn.execute('RELEASE job')
+                    results.append((job, rowcount, None))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO job')
+                    conn.execute('RELEASE job')
+                    results.append((job, None, e))
+            conn.commit()
+        except Exception as e:
+            # The group as a whole could not be committed
+            if conn.in_transaction:
+                conn.rollback()
+            results = [(job, None, e) for job in group]
+
+        failed = 0
+        for job, rowcount, error in results:
+            if error is None:
+                job.future.set_result(rowcount)
+            else:
+                failed += 1
+                job.future.set_exception(error)
+        with self._lock:
+            self._stats['jobs'] += len(group)
+            self._stats['failed'] += failed
+            self._stats['groups'] += 1
+
+    def _lend(self, conn, job):
+        if not job.future.set_running_or_notify_cancel():
+            return
+        released = threading.Event()
+        job.future.set_result((conn, released))
+        released.wait()
+        # Never carry a borrower's unfinished transaction into the next group
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._stats['leases'] += 1